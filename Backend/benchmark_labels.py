@@ -0,0 +1,62 @@
+# benchmark_labels.py
+"""
+Checks and times the columnar pair filter and labels in training_pairs.py
+against the row-wise ``DataFrame.apply`` versions they replaced.
+
+    python benchmark_labels.py [--dataset sharespace_profiles.csv] [--repeat 3]
+
+Exits non-zero if the outputs differ in any row.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from training_pairs import calculate_compatibility_score, compatibility_scores, load_profiles, pair_frames
+from users.candidates import BUDGET_TOLERANCE, budget_overlap_mask, budget_overlap_ok
+
+
+def best_of(fn, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="sharespace_profiles.csv")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    seekers, listers = load_profiles(args.dataset)
+    seekers_small, listers_small = pair_frames(seekers, listers)
+    merged = seekers_small.merge(listers_small, on="key_city", how="inner", suffixes=("_seeker", "_lister"))
+    print(f"{len(seekers):,} seekers x {len(listers):,} listers -> {len(merged):,} same-city pairs")
+
+    t_apply, keep_apply = best_of(lambda: merged.apply(
+        lambda r: budget_overlap_ok(r["budget_seeker"], r["budget_lister"], BUDGET_TOLERANCE), axis=1
+    ).to_numpy(dtype=bool), args.repeat)
+    t_mask, keep_mask = best_of(lambda: budget_overlap_mask(
+        merged["budget_seeker"].to_numpy(), merged["budget_lister"].to_numpy(), BUDGET_TOLERANCE
+    ), args.repeat)
+    filter_ok = np.array_equal(keep_apply, keep_mask)
+
+    pairs = merged[keep_mask].reset_index(drop=True)
+    t_label_apply, labels_apply = best_of(
+        lambda: pairs.apply(calculate_compatibility_score, axis=1).to_numpy(dtype=float), args.repeat
+    )
+    t_label_vec, labels_vec = best_of(lambda: compatibility_scores(pairs), args.repeat)
+    labels_ok = np.array_equal(labels_apply, labels_vec)
+
+    print(f"{'step':<14}{'rows':>12}{'apply s':>10}{'columnar s':>12}{'speedup':>9}  identical")
+    print(f"{'budget filter':<14}{len(merged):>12,}{t_apply:>10.3f}{t_mask:>12.4f}{t_apply / t_mask:>8.0f}x  {filter_ok}")
+    print(f"{'labels':<14}{len(pairs):>12,}{t_label_apply:>10.3f}{t_label_vec:>12.4f}{t_label_apply / t_label_vec:>8.0f}x  {labels_ok}")
+    return 0 if filter_ok and labels_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Listing analytics: view and favorite events, counted in hourly and daily buckets.
+
+Recording an event only bumps an in-process counter; a daemon thread flushes
+the buffered counts every ``LISTING_ANALYTICS_FLUSH_INTERVAL`` seconds as one
+transaction. Flushes only ever add: they insert the ``ListingStat`` bucket
+rows they need, then run ``UPDATE ... SET views = views + n`` statements, one
+per bucket, event and distinct ``n``, and the same for the lifetime
+``Listing.views``. Requests never wait on these writes or their locks, and
+because the database adds each increment itself, concurrent requests and
+workers can't overwrite each other's counts the way ``views += 1; save()``
+did. Buckets start on UTC hours and days; the flusher prunes hourly buckets
+older than ``LISTING_STATS_HOURLY_RETENTION_DAYS`` and keeps daily ones.
+
+Lost-update semantics: counts are at-most-once. Whatever a process has
+buffered and not yet flushed (up to one interval's worth) is lost if it dies
+without running its exit hook, e.g. on SIGKILL or an OOM kill. A flush that
+fails, say on a locked database, puts its counts back and retries on the
+next tick. Until then, other processes don't see this process's pending
+events; a detail page shows the stored view count plus this process's own
+pending views, and ``/stats/`` shows only flushed ones. ``QuerySet.update``
+sends no signals, so flushes don't invalidate the feed or cluster caches
+either.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Listing, ListingStat
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('views', 'favorites', 'unfavorites')
+FLUSH_BATCH_SIZE = 500
+PRUNE_INTERVAL = 60 * 60  # seconds
+
+
+def _increment(queryset, key, field, counts):
+    """Add ``counts[k]`` to ``field`` of the rows whose ``key`` is ``k``: one UPDATE per distinct count."""
+    by_increment = defaultdict(list)
+    for pk, n in counts.items():
+        by_increment[n].append(pk)
+    for n, pks in by_increment.items():
+        for start in range(0, len(pks), FLUSH_BATCH_SIZE):
+            queryset.filter(**{f'{key}__in': pks[start:start + FLUSH_BATCH_SIZE]}).update(**{field: F(field) + n})
+
+
+def bucket_start(moment, granularity):
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == ListingStat.DAY else moment
+
+
+def series(listing, granularity, since):
+    """``EVENTS`` counts of ``listing`` per bucket from ``since`` to now, zero-filled, oldest first."""
+    step = timedelta(days=1) if granularity == ListingStat.DAY else timedelta(hours=1)
+    start, end = bucket_start(since, granularity), bucket_start(timezone.now(), granularity)
+    rows = {
+        row['start']: row
+        for row in ListingStat.objects.filter(listing=listing, granularity=granularity, start__gte=start)
+        .values('start', *EVENTS)
+    }
+    points = []
+    while start <= end:
+        row = rows.get(start, {})
+        points.append({'start': start, **{event: row.get(event, 0) for event in EVENTS}})
+        start += step
+    return points
+
+
+class EventRecorder:
+    def __init__(self, interval=None):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._counts = Counter()  # (listing_id, event, hour) -> n
+        self._pending = Counter()  # (listing_id, event) -> n
+        self._thread = None
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, 'LISTING_ANALYTICS_FLUSH_INTERVAL', 5.0)
+
+    def record(self, listing_id, event, count=1):
+        """
+        Count ``count`` ``event``s (one of ``EVENTS``) of ``listing_id``. Returns
+        how many to add to a total read before the call: these and any of the
+        same still buffered here.
+        """
+        hour = bucket_start(timezone.now(), ListingStat.HOUR)
+        with self._lock:
+            self._counts[listing_id, event, hour] += count
+            self._pending[listing_id, event] += count
+            pending = self._pending[listing_id, event]
+        if self.interval <= 0:
+            # Write-through, for tests and single-shot scripts.
+            self.flush()
+            return count
+        self._ensure_flusher()
+        return pending
+
+    def pending(self, listing_id, event):
+        with self._lock:
+            return self._pending[listing_id, event]
+
+    def flush(self):
+        """Write the buffered counts; returns how many events were written."""
+        with self._lock:
+            counts, self._counts, self._pending = self._counts, Counter(), Counter()
+        if not counts:
+            return 0
+        try:
+            with transaction.atomic():
+                self._write(counts)
+        except DatabaseError:
+            with self._lock:
+                self._counts.update(counts)
+                for (listing_id, event, _), n in counts.items():
+                    self._pending[listing_id, event] += n
+            raise
+        return sum(counts.values())
+
+    def _write(self, counts):
+        ids = list({listing_id for listing_id, _, _ in counts})
+        # Events of listings deleted since are dropped: their buckets would have no row to point at.
+        live = set()
+        for start in range(0, len(ids), FLUSH_BATCH_SIZE):
+            live.update(Listing.objects.filter(id__in=ids[start:start + FLUSH_BATCH_SIZE]).values_list('id', flat=True))
+
+        views = Counter()
+        buckets = defaultdict(Counter)  # (granularity, start) -> {(listing_id, event): n}
+        for (listing_id, event, hour), n in counts.items():
+            if listing_id not in live:
+                continue
+            if event == 'views':
+                views[listing_id] += n
+            buckets[ListingStat.HOUR, hour][listing_id, event] += n
+            buckets[ListingStat.DAY, bucket_start(hour, ListingStat.DAY)][listing_id, event] += n
+
+        _increment(Listing.objects.all(), 'id', 'views', views)
+        for (granularity, start), bucket in buckets.items():
+            ListingStat.objects.bulk_create(
+                [ListingStat(listing_id=listing_id, granularity=granularity, start=start)
+                 for listing_id in {listing_id for listing_id, _ in bucket}],
+                ignore_conflicts=True, batch_size=FLUSH_BATCH_SIZE,
+            )
+            rows = ListingStat.objects.filter(granularity=granularity, start=start)
+            for event in EVENTS:
+                _increment(rows, 'listing_id', event, {
+                    listing_id: n for (listing_id, e), n in bucket.items() if e == event
+                })
+
+    def prune(self):
+        """Delete hourly buckets past their retention; returns how many."""
+        cutoff = timezone.now() - timedelta(days=settings.LISTING_STATS_HOURLY_RETENTION_DAYS)
+        deleted, _ = ListingStat.objects.filter(granularity=ListingStat.HOUR, start__lt=cutoff).delete()
+        return deleted
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            # A forked worker inherits the attribute but not the thread.
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._thread is None:
+                atexit.register(self._flush_quietly)
+            self._thread = threading.Thread(target=self._run, name='listing-analytics-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        pruned_at = None
+        while True:
+            time.sleep(self.interval)
+            self._flush_quietly()
+            if pruned_at is None or time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                try:
+                    self.prune()
+                except Exception:
+                    logger.exception("Pruning hourly listing stats failed.")
+                pruned_at = time.monotonic()
+            # The flusher's own connection: don't hold it open between ticks.
+            connection.close()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing listing analytics failed; retrying next interval.")
+
+
+events = EventRecorder()
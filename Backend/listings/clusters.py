@@ -0,0 +1,102 @@
+"""
+Map clusters of active listings, aggregated per geohash cell.
+
+The zoom level picks the cell precision; cells are grouped into tiles two
+geohash characters coarser (up to 1024 cells each), and each tile's clusters
+are computed once and cached. Saving or deleting a listing drops the tiles
+containing its old and new position (see signals.py). Writes that skip
+signals, such as ``QuerySet.update`` or ``bulk_create``, are picked up when
+the tile expires after ``LISTING_CLUSTER_TILE_TTL`` seconds.
+"""
+from itertools import groupby
+from statistics import median
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import geo
+from .models import Listing
+
+CLUSTER_FIELDS = ['geohash', 'count', 'latitude', 'longitude', 'min_rent', 'median_rent', 'listing_id']
+TILE_DEPTH = 2
+MAX_PRECISION = geo.GEOHASH_PRECISION - 1
+MAX_TILES = 64
+
+
+def precision_for_zoom(zoom):
+    """
+    The finest precision whose cells are still at least 1/8 of a 256px map
+    tile wide (about 32px) at ``zoom``: a cell spans 360 / 2**ceil(5p / 2)
+    degrees of longitude, a map tile 360 / 2**zoom.
+    """
+    precision = 1
+    while precision < MAX_PRECISION and -(-5 * (precision + 1) // 2) <= zoom + 3:
+        precision += 1
+    return precision
+
+
+def fit_precision(boxes, zoom):
+    """``precision_for_zoom``, coarsened until the viewport needs at most ``MAX_TILES`` tiles."""
+    precision = precision_for_zoom(zoom)
+    while precision > 1 and sum(
+            geo.cell_count(*box, max(precision - TILE_DEPTH, 0)) for box in boxes) > MAX_TILES:
+        precision -= 1
+    return precision
+
+
+def tile_key(precision, tile):
+    return f'listing-clusters:{precision}:{tile}'
+
+
+def tiles_for(boxes, precision):
+    tile_precision = max(precision - TILE_DEPTH, 0)
+    return sorted({tile for box in boxes for tile in geo.cells(*box, tile_precision)})
+
+
+def compute_tile(precision, tile):
+    """``CLUSTER_FIELDS`` rows for every non-empty cell at ``precision`` under ``tile``."""
+    listings = Listing.objects.filter(is_active=True, geohash__isnull=False)
+    if tile:
+        listings = listings.filter(geo.prefix_ranges([tile]))
+    rows = listings.order_by('geohash').values_list('geohash', 'latitude', 'longitude', 'rent', 'id')
+    clusters = []
+    for cell, members in groupby(rows.iterator(chunk_size=2000), key=lambda row: row[0][:precision]):
+        _, lats, lngs, rents, ids = zip(*members)
+        count = len(ids)
+        clusters.append([
+            cell, count, round(sum(lats) / count, 6), round(sum(lngs) / count, 6),
+            min(rents), median(rents), str(ids[0]) if count == 1 else None,
+        ])
+    return clusters
+
+
+def get_clusters(boxes, precision):
+    """Clusters whose centroid lies in any of ``boxes``, from cached tiles."""
+    tiles = tiles_for(boxes, precision)
+    keys = {tile: tile_key(precision, tile) for tile in tiles}
+    cached = cache.get_many(keys.values())
+    missing = {}
+    for tile in tiles:
+        if keys[tile] not in cached:
+            missing[keys[tile]] = compute_tile(precision, tile)
+    if missing:
+        cache.set_many(missing, timeout=settings.LISTING_CLUSTER_TILE_TTL)
+        cached.update(missing)
+
+    return [
+        cluster
+        for tile in tiles for cluster in cached[keys[tile]]
+        if any(min_lat <= cluster[2] <= max_lat and min_lng <= cluster[3] <= max_lng
+               for min_lat, min_lng, max_lat, max_lng in boxes)
+    ]
+
+
+def invalidate(geohashes):
+    """Drop every cached tile, at every zoom, that covers one of ``geohashes``."""
+    keys = [
+        tile_key(precision, geohash[:max(precision - TILE_DEPTH, 0)])
+        for geohash in geohashes if geohash
+        for precision in range(1, MAX_PRECISION + 1)
+    ]
+    if keys:
+        cache.delete_many(keys)
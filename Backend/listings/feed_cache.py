@@ -0,0 +1,129 @@
+"""
+Response cache for the listing feed (``PersonalizedListingListView``).
+
+Anonymous visitors and listers get the same feed for the same filters, so
+their responses are cached under the normalized query params, plus the user
+id for listers (``is_favorited`` is per viewer). Seekers' feeds depend on
+their compatibility scores and are never cached.
+
+Every key includes the current generation, a random token. Any
+change that can alter a feed response (listings, their images, favorites,
+roommates, the profile fields shown for listers and roommates) replaces the
+token on commit, so all older entries stop matching at once and age out
+after ``LISTING_FEED_CACHE_TTL``. View-count bumps don't invalidate: the
+``views`` shown in a cached feed can lag by up to that TTL.
+
+Only uses ``get``/``set``/``add``, so any Django cache backend works,
+including local-memory and file-based ones.
+"""
+import hashlib
+import uuid
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.utils.urls import replace_query_param
+
+from .pagination import KeysetPagination
+from .search import normalize_query
+
+GENERATION_KEY = 'listing-feed:generation'
+
+
+def _boolean(value):
+    return 'true' if value.lower() == 'true' else 'false'
+
+
+def _integer(value):
+    try:
+        return str(int(value))
+    except ValueError:
+        return value  # rejected the same way whatever the spelling
+
+
+def _numbers(value):
+    try:
+        return ','.join(repr(float(v)) for v in value.split(','))
+    except ValueError:
+        return value
+
+
+# How each param the feed reads is normalized; anything else is ignored. ``show`` only
+# narrows a seeker's feed, and those aren't cached.
+FEED_PARAMS = {
+    'search': normalize_query,
+    'pets_allowed': _boolean,
+    'smoking_allowed': _boolean,
+    'min_rent': _integer,
+    'max_rent': _integer,
+    'near': _numbers,
+    'radius_km': _numbers,
+    'bbox': _numbers,
+    'order': str.strip,
+    'page_size': lambda value: str(KeysetPagination.parse_page_size(value)),
+    'cursor': str,
+    'size': lambda value: value.strip().lower(),
+}
+# The feed skips these when empty; any other empty param still changes the response.
+EMPTY_MEANS_ABSENT = {'search', 'min_rent', 'max_rent', 'size'}
+
+
+def normalize(query_params):
+    params = {}
+    for name, normalizer in FEED_PARAMS.items():
+        value = query_params.get(name)
+        if value is not None:
+            value = normalizer(value)
+            if value or name not in EMPTY_MEANS_ABSENT:
+                params[name] = value
+    return params
+
+
+def cache_key(request):
+    """
+    The cache key for this feed request, or ``None`` if it must not be cached.
+    Taken before the feed is queried, so a change committed meanwhile leaves
+    the response under the old generation.
+    """
+    user = request.user
+    if user.is_authenticated and user.role == 'Seeker':
+        return None
+    viewer = user.pk if user.is_authenticated else 'anon'
+    params = urlencode(sorted(normalize(request.query_params).items()))
+    return f'listing-feed:{generation()}:{viewer}:{hashlib.sha1(params.encode()).hexdigest()}'
+
+
+def generation():
+    token = cache.get(GENERATION_KEY)
+    if token is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        token = cache.get(GENERATION_KEY)
+    return token
+
+
+def invalidate():
+    # A fresh token rather than a counter: an evicted counter restarting at 1 could
+    # bring back entries from an earlier run of it.
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def lookup(request, key):
+    """The cached response data for ``key``, with ``next`` rebuilt for this request's URL."""
+    entry = cache.get(key)
+    if entry is None or not isinstance(entry, dict):
+        return entry
+    cursor = entry['cursor']
+    next_link = None
+    if cursor is not None:
+        next_link = replace_query_param(request.build_absolute_uri(), KeysetPagination.cursor_query_param, cursor)
+    return {'next': next_link, 'results': entry['results']}
+
+
+def store(key, data):
+    if isinstance(data, dict):
+        # Keep the cursor, not the link: the link echoes the request's own spelling of the params.
+        cursor = None
+        if data['next']:
+            cursor = parse_qs(urlsplit(data['next']).query)[KeysetPagination.cursor_query_param][0]
+        data = {'cursor': cursor, 'results': data['results']}
+    cache.set(key, data, timeout=settings.LISTING_FEED_CACHE_TTL)
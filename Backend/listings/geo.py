@@ -0,0 +1,131 @@
+"""
+Location queries over ``Listing.latitude``/``longitude``.
+
+Each listing stores the geohash of its coordinates in an indexed column. A box
+is covered by a handful of geohash cells, each of which is one B-tree range
+scan (``geohash >= 'dr5r' AND geohash < 'dr5r{'``); the exact coordinate and
+haversine checks then run only on the rows those ranges return. Works the
+same on SQLite and Postgres: Django registers the trig functions the distance
+expression needs on SQLite connections.
+"""
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # cells of about 5 x 5 metres
+MAX_COVER_CELLS = 16
+EARTH_RADIUS_KM = 6371.0088
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell; longitude gets the odd bit."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** (bits - bits // 2)
+
+
+def _grid(min_lat, min_lng, max_lat, max_lng, precision):
+    """Row and column index ranges of the cells at ``precision`` that overlap the box."""
+    height, width = cell_size(precision)
+    rows = range(int((min_lat + 90) // height), int(min(max_lat + 90, 180 - 1e-9) // height) + 1)
+    cols = range(int((min_lng + 180) // width), int(min(max_lng + 180, 360 - 1e-9) // width) + 1)
+    return rows, cols
+
+
+def cells(min_lat, min_lng, max_lat, max_lng, precision):
+    """Geohashes of the cells at ``precision`` that overlap the box (``['']``, the whole globe, at 0)."""
+    if precision == 0:
+        return ['']
+    height, width = cell_size(precision)
+    rows, cols = _grid(min_lat, min_lng, max_lat, max_lng, precision)
+    return sorted({
+        encode(-90 + (r + 0.5) * height, -180 + (c + 0.5) * width, precision)
+        for r in rows for c in cols
+    })
+
+
+def cell_count(min_lat, min_lng, max_lat, max_lng, precision):
+    if precision == 0:
+        return 1
+    rows, cols = _grid(min_lat, min_lng, max_lat, max_lng, precision)
+    return len(rows) * len(cols)
+
+
+def cover(min_lat, min_lng, max_lat, max_lng):
+    """
+    Geohash prefixes whose cells together contain the box, using the finest
+    precision that needs at most ``MAX_COVER_CELLS`` of them. ``None`` when
+    the box is so large that filtering by prefix would not narrow anything.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if cell_count(min_lat, min_lng, max_lat, max_lng, precision) <= MAX_COVER_CELLS:
+            return cells(min_lat, min_lng, max_lat, max_lng, precision)
+    return None
+
+
+def prefix_ranges(prefixes):
+    # '{' sorts straight after 'z', the last geohash character.
+    return Q(*(Q(geohash__gte=p, geohash__lt=p + '{') for p in prefixes), _connector=Q.OR)
+
+
+def within_box(min_lat, min_lng, max_lat, max_lng):
+    """``Q`` for listings inside the box; ``min_lng > max_lng`` means it crosses the antimeridian."""
+    if min_lng > max_lng:
+        return within_box(min_lat, min_lng, max_lat, 180.0) | within_box(min_lat, -180.0, max_lat, max_lng)
+    condition = Q(latitude__range=(min_lat, max_lat), longitude__range=(min_lng, max_lng))
+    prefixes = cover(min_lat, min_lng, max_lat, max_lng)
+    return condition if prefixes is None else prefix_ranges(prefixes) & condition
+
+
+def around(latitude, longitude, radius_km):
+    """The (min_lat, min_lng, max_lat, max_lng) box enclosing a circle; min_lng > max_lng across the antimeridian."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude))
+    if ratio >= 1.0:  # the circle reaches a pole
+        return min_lat, -180.0, max_lat, 180.0
+    dlng = math.degrees(math.asin(ratio))
+    wrap = lambda lng: (lng + 180.0) % 360.0 - 180.0
+    return min_lat, wrap(longitude - dlng), max_lat, wrap(longitude + dlng)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    dlat, dlng = math.radians(lat2 - lat1), math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def distance_km(latitude, longitude):
+    """Great-circle distance in km from a point to each row's coordinates, as a query expression."""
+    lat = Radians(F('latitude'))
+    origin = Value(math.radians(latitude), output_field=FloatField())
+    a = (
+        Power(Sin((lat - origin) / 2), 2)
+        + math.cos(math.radians(latitude)) * Cos(lat)
+        * Power(Sin((Radians(F('longitude')) - math.radians(longitude)) / 2), 2)
+    )
+    # Rounding can push a just past 1 for antipodal points, outside asin's domain.
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(Least(a, Value(1.0))))
@@ -0,0 +1,249 @@
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat.models import Conversation, Message
+from listings.geo import encode
+from listings.thumbnails import LISTING_SIZES, variants
+from listings.models import Listing, ListingImage
+from users.models import CustomUser
+
+# Rough centre of each generate_dataset.CITIES entry; listings scatter ~10 km around it.
+CITY_CENTRES = {
+    "Metro City": (23.0225, 72.5714),
+    "Suburbia": (19.0760, 72.8777),
+    "Coastal Town": (15.2993, 74.1240),
+    "Mountain Village": (32.2432, 77.1892),
+}
+MESSAGE_TEXTS = [
+    "Hi! Is the room still available?",
+    "Yes, it is. When would you like to visit?",
+    "Does the rent include utilities?",
+    "Could we do a video call this weekend?",
+    "Sounds good, see you then.",
+    "Are pets allowed in the flat?",
+]
+
+
+def seeded_uuids(rng, n):
+    """``n`` version-4 UUIDs drawn from ``rng``, so a seed always yields the same primary keys."""
+    return [uuid.UUID(bytes=raw, version=4) for raw in np.frombuffer(rng.bytes(16 * n), dtype='V16').tolist()]
+
+
+def unique_pairs(rng, n, left, right, unordered=False):
+    """
+    Up to ``n`` distinct (i, j) index pairs, i < ``left`` and j < ``right``.
+    ``unordered`` pairs are people with each other: i < j, never (j, i) or (i, i).
+    """
+    if not n or not left or not right:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    i = rng.integers(0, left, n)
+    j = rng.integers(0, right, n)
+    if unordered:
+        i, j = np.minimum(i, j), np.maximum(i, j)
+    keys = np.unique(i * right + j)
+    i, j = keys // right, keys % right
+    if unordered:
+        i, j = i[i != j], j[i != j]
+    return i, j
+
+
+def batched(n, size):
+    for start in range(0, n, size):
+        yield start, min(start + size, n)
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with reproducible synthetic users, listings (with roommates and images), '
+        'favorites and chat history through batched bulk_create, for capacity testing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--listings', type=int, default=1_000)
+        parser.add_argument('--conversations', type=int, default=5_000)
+        parser.add_argument('--messages', type=int, default=50_000)
+        parser.add_argument('--favorites-per-user', type=float, default=3.0, help='Average favorites per user.')
+        parser.add_argument('--images-per-listing', type=int, default=3)
+        parser.add_argument('--max-roommates', type=int, default=2, help='Current roommates per listing, 0..N.')
+        parser.add_argument('--lister-share', type=float, default=0.4)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='load', help='Username prefix marking the generated users.')
+        parser.add_argument('--password', default='password123', help='Shared by every generated user.')
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete users with --prefix (and everything they own) first.')
+
+    def handle(self, *args, **options):
+        from generate_dataset import (
+            BUDGET_RANGE, CITIES, CLEANLINESS_RANGE, GENDER_PREFERENCE_OPTIONS, GUEST_FREQUENCY_OPTIONS,
+            MBTI_TYPES, NOISE_LEVEL_RANGE, OCCUPATION_OPTIONS, SLEEP_SCHEDULE_OPTIONS, SMOKING_OPTIONS,
+            SOCIAL_LEVEL_OPTIONS, WORK_SCHEDULE_OPTIONS,
+        )
+
+        prefix, batch_size = options['prefix'], options['batch_size']
+        existing = CustomUser.objects.filter(username__startswith=f'{prefix}_')
+        if options['clear']:
+            with self.phase('clear'):
+                existing.delete()
+        elif existing.exists():
+            raise CommandError(f"Users named {prefix}_* already exist; pass --clear or another --prefix.")
+
+        # The prefix is part of the seed so two data sets can coexist without key collisions.
+        rng = np.random.default_rng([options['seed'], zlib.crc32(prefix.encode())])
+        n_users = options['users']
+        n_listers = int(round(n_users * options['lister_share']))
+        if options['listings'] and not n_listers:
+            raise CommandError('Listings need at least one lister; raise --users or --lister-share.')
+
+        # One hash for everyone: PBKDF2 is deliberately slow, and every load user logs in the same way.
+        password = make_password(options['password'])
+
+        user_ids = seeded_uuids(rng, n_users)
+        user_cities = rng.choice(CITIES, n_users, p=[0.5, 0.25, 0.15, 0.1])
+        mbti_codes, mbti_weights = zip(*MBTI_TYPES.items())
+        with self.phase('users', n_users):
+            for lo, hi in batched(n_users, batch_size):
+                n = hi - lo
+                columns = {
+                    'cleanliness': rng.choice(CLEANLINESS_RANGE, n, p=[0.1, 0.2, 0.4, 0.2, 0.1]),
+                    'sleep_schedule': rng.choice(SLEEP_SCHEDULE_OPTIONS, n, p=[0.4, 0.3, 0.3]),
+                    'noise_level': rng.choice(NOISE_LEVEL_RANGE, n, p=[0.3, 0.3, 0.2, 0.1, 0.1]),
+                    'guest_frequency': rng.choice(GUEST_FREQUENCY_OPTIONS, n, p=[0.5, 0.4, 0.1]),
+                    'social_level': rng.choice(SOCIAL_LEVEL_OPTIONS, n, p=[0.2, 0.5, 0.3]),
+                    'smoking': rng.choice(SMOKING_OPTIONS, n, p=[0.7, 0.2, 0.1]),
+                    'has_pets': rng.random(n) < 0.2,
+                    'gender_preference': rng.choice(GENDER_PREFERENCE_OPTIONS, n, p=[0.3, 0.3, 0.4]),
+                    'work_schedule': rng.choice(WORK_SCHEDULE_OPTIONS, n, p=[0.4, 0.1, 0.3, 0.2]),
+                    'occupation': rng.choice(OCCUPATION_OPTIONS, n, p=[0.25, 0.15, 0.15, 0.1, 0.1, 0.1, 0.15]),
+                    'mbti_type': rng.choice(mbti_codes, n, p=mbti_weights),
+                    'budget': rng.integers(BUDGET_RANGE[0], BUDGET_RANGE[1], n),
+                }
+                CustomUser.objects.bulk_create([
+                    CustomUser(
+                        id=user_ids[k], username=f'{prefix}_{k}', email=f'{prefix}_{k}@example.com',
+                        password=password, role='Lister' if k < n_listers else 'Seeker', city=str(user_cities[k]),
+                        **{field: values[k - lo].item() for field, values in columns.items()},
+                    )
+                    for k in range(lo, hi)
+                ], batch_size=batch_size)
+
+        n_listings = options['listings']
+        listing_ids = seeded_uuids(rng, n_listings)
+        listing_listers = rng.integers(0, n_listers, n_listings) if n_listings else np.empty(0, dtype=np.int64)
+        roommate_counts = rng.integers(0, options['max_roommates'] + 1, n_listings)
+        image_field = ListingImage._meta.get_field('image')
+        image_variants = [variants(image_field, f'sharespace/load/{i}', LISTING_SIZES) for i in range(1000)]
+        with self.phase('listings', n_listings):
+            for lo, hi in batched(n_listings, batch_size):
+                n = hi - lo
+                rent = rng.integers(BUDGET_RANGE[0], BUDGET_RANGE[1], n)
+                needed = roommate_counts[lo:hi] + rng.integers(1, 3, n)
+                flags = rng.random((n, 3))
+                offsets = (rng.random((n, 2)) - 0.5) * 0.2
+                rows = []
+                for k in range(lo, hi):
+                    lister = listing_listers[k]
+                    city = str(user_cities[lister])
+                    lat, lng = CITY_CENTRES[city]
+                    latitude = round(lat + offsets[k - lo, 0], 6)
+                    longitude = round(lng + offsets[k - lo, 1], 6)
+                    rows.append(Listing(
+                        id=listing_ids[k], lister_id=user_ids[lister], city=city,
+                        title=f'Room {k} in {city}', address=f'{100 + k % 900} Blossom Avenue, {city}',
+                        description='Furnished room with shared kitchen and high-speed internet.',
+                        rent=int(rent[k - lo]), roommates_needed=int(needed[k - lo]),
+                        roommates_found=int(roommate_counts[k]),
+                        pets_allowed=bool(flags[k - lo, 0] < 0.5), smoking_allowed=bool(flags[k - lo, 1] < 0.2),
+                        is_active=bool(flags[k - lo, 2] < 0.9),
+                        latitude=latitude, longitude=longitude, geohash=encode(latitude, longitude),
+                        image=f'sharespace/load/{k % 1000}', image_variants=image_variants[k % 1000],
+                    ))
+                Listing.objects.bulk_create(rows, batch_size=batch_size)
+
+        n_images = n_listings * options['images_per_listing']
+        with self.phase('listing images', n_images):
+            for lo, hi in batched(n_images, batch_size):
+                ListingImage.objects.bulk_create([
+                    ListingImage(listing_id=listing_ids[k // options['images_per_listing']],
+                                 image=f'sharespace/load/{k % 1000}', image_variants=image_variants[k % 1000])
+                    for k in range(lo, hi)
+                ], batch_size=batch_size)
+
+        # Roommates: seekers living in each listing, roommate_counts[k] of them (minus rare collisions).
+        Roommate = Listing.current_roommates.through
+        listing_idx = np.repeat(np.arange(n_listings), roommate_counts)
+        if n_users > n_listers:
+            roommate_idx = rng.integers(n_listers, n_users, len(listing_idx))
+            keys = np.unique(listing_idx * n_users + roommate_idx)
+            listing_idx, roommate_idx = keys // n_users, keys % n_users
+        else:
+            listing_idx = roommate_idx = np.empty(0, dtype=np.int64)
+        with self.phase('roommates', len(listing_idx)):
+            self.bulk_insert(Roommate, len(listing_idx), batch_size, lambda lo, hi: [
+                Roommate(listing_id=listing_ids[i], customuser_id=user_ids[j])
+                for i, j in zip(listing_idx[lo:hi].tolist(), roommate_idx[lo:hi].tolist())
+            ])
+
+        Favorite = CustomUser.favorites.through
+        user_idx, fav_idx = unique_pairs(rng, int(n_users * options['favorites_per_user']), n_users, n_listings)
+        with self.phase('favorites', len(user_idx)):
+            self.bulk_insert(Favorite, len(user_idx), batch_size, lambda lo, hi: [
+                Favorite(customuser_id=user_ids[i], listing_id=listing_ids[j])
+                for i, j in zip(user_idx[lo:hi].tolist(), fav_idx[lo:hi].tolist())
+            ])
+
+        # Conversations between two distinct users; each message is sent by one of the two at random.
+        a_idx, b_idx = unique_pairs(rng, options['conversations'], n_users, n_users, unordered=True)
+        order = rng.permutation(len(a_idx))
+        a_idx, b_idx = a_idx[order], b_idx[order]
+        with self.phase('conversations', len(a_idx)):
+            conversation_ids = []
+            for lo, hi in batched(len(a_idx), batch_size):
+                created = Conversation.objects.bulk_create([
+                    Conversation(user_a_id=user_ids[a], user_b_id=user_ids[b])
+                    for a, b in zip(a_idx[lo:hi].tolist(), b_idx[lo:hi].tolist())
+                ], batch_size=batch_size)
+                conversation_ids.extend(c.pk for c in created)
+
+        n_messages = options['messages'] if len(a_idx) else 0
+        with self.phase('messages', n_messages):
+            for lo, hi in batched(n_messages, batch_size):
+                n = hi - lo
+                conv = rng.integers(0, len(a_idx), n)
+                from_b = rng.random(n) < 0.5
+                senders = np.where(from_b, b_idx[conv], a_idx[conv])
+                texts = rng.integers(0, len(MESSAGE_TEXTS), n)
+                read = rng.random(n) < 0.8
+                Message.objects.bulk_create([
+                    Message(conversation_id=conversation_ids[c], sender_id=user_ids[s],
+                            text=MESSAGE_TEXTS[t], is_read=bool(r))
+                    for c, s, t, r in zip(conv.tolist(), senders.tolist(), texts.tolist(), read.tolist())
+                ], batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {n_users:,} users, {n_listings:,} listings, {len(a_idx):,} conversations "
+            f"and {n_messages:,} messages (seed {options['seed']}, password '{options['password']}')."
+        ))
+
+    @staticmethod
+    def bulk_insert(model, n, batch_size, make_rows):
+        """Insert ``make_rows(lo, hi)`` for each batch of ``range(n)``; only one batch is in memory."""
+        for lo, hi in batched(n, batch_size):
+            model.objects.bulk_create(make_rows(lo, hi), batch_size=batch_size)
+
+    @contextmanager
+    def phase(self, name, rows=None):
+        start = time.perf_counter()
+        with transaction.atomic():
+            yield
+        elapsed = time.perf_counter() - start
+        rate = f" ({rows / elapsed:,.0f} rows/s)" if rows and elapsed else ''
+        self.stdout.write(f"  {name}: {'' if rows is None else f'{rows:,} rows in '}{elapsed:.1f}s{rate}")
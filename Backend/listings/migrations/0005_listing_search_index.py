@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from listings.search import drop_search_index, ensure_search_index
+
+
+def create_index(apps, schema_editor):
+    ensure_search_index(schema_editor.connection.alias)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_listing_feed_keyset_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
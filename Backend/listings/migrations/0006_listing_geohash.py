@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+from listings.geo import encode
+
+
+def backfill_geohash(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    located = Listing.objects.filter(latitude__isnull=False, longitude__isnull=False).only('latitude', 'longitude')
+    batch = []
+    for listing in located.iterator(chunk_size=2000):
+        listing.geohash = encode(listing.latitude, listing.longitude)
+        batch.append(listing)
+        if len(batch) == 2000:
+            Listing.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Listing.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_listing_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
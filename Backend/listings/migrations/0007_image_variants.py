@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+from listings.thumbnails import LISTING_SIZES, variants
+
+
+def backfill_image_variants(apps, schema_editor):
+    for model_name in ('Listing', 'ListingImage'):
+        model = apps.get_model('listings', model_name)
+        field = model._meta.get_field('image')
+        batch = []
+        for row in model.objects.exclude(image__isnull=True).exclude(image='').only('image').iterator(chunk_size=2000):
+            row.image_variants = variants(field, row.image, LISTING_SIZES)
+            batch.append(row)
+            if len(batch) == 2000:
+                model.objects.bulk_update(batch, ['image_variants'])
+                batch = []
+        model.objects.bulk_update(batch, ['image_variants'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_listing_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listingimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(backfill_image_variants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_favorites_count(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    Favorite = apps.get_model('users', 'CustomUser').favorites.through
+    favorites = Favorite.objects.filter(listing_id=OuterRef('pk')).order_by().values('listing_id')
+    Listing.objects.update(favorites_count=Coalesce(Subquery(favorites.annotate(n=Count('*')).values('n')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_image_variants'),
+        ('users', '0007_customuser_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ListingStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('favorites', models.PositiveIntegerField(default=0)),
+                ('unfavorites', models.PositiveIntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['granularity', 'start'], name='listing_stat_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('listing', 'granularity', 'start'), name='listing_stat_bucket_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_favorites_count, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ import uuid
 from django.db import models
 from users.models import CustomUser
 from cloudinary.models import CloudinaryField
+from . import geo, thumbnails
 
 class Listing(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -25,16 +26,79 @@ class Listing(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # Derived from latitude/longitude on save; indexed for location queries (see geo.py).
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False, db_index=True)
 
     image = CloudinaryField('image', blank=True, null=True)
+    # Sized URLs of image, built on save (see thumbnails.py).
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Lifetime totals, only ever changed by increments: views by analytics.py,
+    # favorites_count recounted by signals.py when favorites change.
     views = models.PositiveIntegerField(default=0)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = {'views', 'favorites_count'}
+
+    class Meta:
+        indexes = [
+            # Keyset pages of the feed: WHERE is_active ... ORDER BY created_at DESC, id DESC
+            models.Index(fields=['is_active', '-created_at', '-id'], name='listing_feed_keyset_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        located = self.latitude is not None and self.longitude is not None
+        self.geohash = geo.encode(self.latitude, self.longitude) if located else None
+        self.image_variants = thumbnails.variants(self._meta.get_field('image'), self.image, thumbnails.LISTING_SIZES)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # A full save of an instance read earlier would put back the counters it read.
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS and field.attname not in deferred
+            ]
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = update_fields = {*update_fields, 'geohash'}
+        if update_fields is not None and 'image' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'image_variants'}
+        super().save(*args, **kwargs)
+
 class ListingImage(models.Model):
     listing = models.ForeignKey(Listing, related_name='images', on_delete=models.CASCADE)
     image = CloudinaryField('image')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.image_variants = thumbnails.variants(self._meta.get_field('image'), self.image, thumbnails.LISTING_SIZES)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'image' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'image_variants'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"Image for {self.listing.title}"
\ No newline at end of file
+        return f"Image for {self.listing.title}"
+
+
+class ListingStat(models.Model):
+    """A listing's view and favorite events in one UTC hour or day (see analytics.py)."""
+    HOUR, DAY = 'hour', 'day'
+
+    listing = models.ForeignKey(Listing, related_name='stats', on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=4, choices=[(HOUR, 'Hour'), (DAY, 'Day')])
+    start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    favorites = models.PositiveIntegerField(default=0)
+    unfavorites = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # One row per bucket; also serves a listing's time series, in order.
+            models.UniqueConstraint(fields=['listing', 'granularity', 'start'], name='listing_stat_bucket_unique'),
+        ]
+        indexes = [
+            # Pruning expired hourly buckets.
+            models.Index(fields=['granularity', 'start'], name='listing_stat_expiry_idx'),
+        ]
@@ -0,0 +1,96 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination:
+    """
+    Cursor pagination over a keyset such as ``('-created_at', '-id')``, given
+    in ``order_by`` notation.
+
+    The cursor is the key of the last row served, so each page is one indexed
+    range query (``WHERE key < cursor ORDER BY key DESC LIMIT n``). Rows added
+    or removed meanwhile never shift later pages the way an offset does. The
+    last key field must be unique so that ties on the earlier ones still have
+    an order.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+        self.fields = tuple(f.lstrip('-') for f in self.ordering)
+
+    def requested(self, request):
+        params = request.query_params
+        return self.page_size_query_param in params or self.cursor_query_param in params
+
+    def get_page_size(self, request):
+        return self.parse_page_size(request.query_params.get(self.page_size_query_param))
+
+    @classmethod
+    def parse_page_size(cls, value):
+        try:
+            size = int(value)
+        except (TypeError, ValueError):
+            return cls.page_size
+        return max(1, min(size, cls.max_page_size))
+
+    def order(self, queryset):
+        return queryset.order_by(*self.ordering)
+
+    def paginate_queryset(self, queryset, request):
+        """Return one page of ``queryset`` (already filtered and annotated), ordered by the keyset."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        queryset = self.order(queryset)
+        if cursor:
+            try:
+                queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound('Invalid cursor')
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        page = rows[:page_size]
+        self.next_key = [getattr(page[-1], f) for f in self.fields] if page else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_key))
+
+    def _after(self, key):
+        # (a, b, c) after (A, B, C) as a disjunction: a past A, or a = A and b past B, ...
+        condition = Q()
+        for i, (field, ordered) in enumerate(zip(self.fields, self.ordering)):
+            past = 'lt' if ordered.startswith('-') else 'gt'
+            condition |= Q(**{f: v for f, v in zip(self.fields[:i], key[:i])}, **{f'{field}__{past}': key[i]})
+        return condition
+
+    def encode_cursor(self, key):
+        values = [v.isoformat() if isinstance(v, datetime) else v if isinstance(v, (int, float)) else str(v)
+                  for v in key]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(key, list) or len(key) != len(self.fields):
+            raise NotFound('Invalid cursor')
+        return key
@@ -0,0 +1,194 @@
+"""
+Full-text search over listing title, description, city and address.
+
+SQLite: an external-content FTS5 table over ``listings_listing`` kept in sync
+by triggers, so ``bulk_create`` and ``QuerySet.update`` are covered as well as
+``save``/``delete``. Postgres: a generated, weighted ``tsvector`` column with
+a GIN index. Other backends fall back to the old ``icontains`` scan.
+
+The FTS5 rows are keyed on ``listings_listing.search_key``, an INTEGER column
+the insert trigger fills, not on the table's implicit rowid: the primary key
+is a UUID, so the rowid is not an INTEGER PRIMARY KEY, and VACUUM is free to
+renumber it, which would point every index entry at the wrong listing. Like
+Postgres' ``search_vector``, the column is not a model field, so Django never
+writes it.
+
+``ensure_search_index`` is idempotent and is re-run after every ``migrate``
+(see ``apps.py``): SQLite drops a table's triggers, and the column, when a
+migration rebuilds it, so they are recreated, and the index rebuilt, whenever
+they are missing.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, Expression, FloatField, Q, Value
+
+FTS_TABLE = 'listings_listing_fts'
+SEARCH_FIELDS = ('title', 'description', 'city', 'address')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SEARCH_KEY = 'search_key'
+SEARCH_KEY_INDEX = 'listing_search_key_idx'
+
+_SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+        CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON listings_listing BEGIN
+            UPDATE listings_listing SET {SEARCH_KEY} = (SELECT coalesce(max({SEARCH_KEY}), 0) + 1 FROM listings_listing)
+            WHERE rowid = new.rowid;
+            INSERT INTO {FTS_TABLE}(rowid, title, description, city, address)
+            SELECT {SEARCH_KEY}, new.title, new.description, new.city, new.address
+            FROM listings_listing WHERE rowid = new.rowid;
+        END""",
+    f'{FTS_TABLE}_ad': f"""
+        CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON listings_listing BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, city, address)
+            VALUES ('delete', old.{SEARCH_KEY}, old.title, old.description, old.city, old.address);
+        END""",
+    # Only text edits touch the index; view counts and flags don't.
+    f'{FTS_TABLE}_au': f"""
+        CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, description, city, address ON listings_listing BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, city, address)
+            VALUES ('delete', old.{SEARCH_KEY}, old.title, old.description, old.city, old.address);
+            INSERT INTO {FTS_TABLE}(rowid, title, description, city, address)
+            VALUES (new.{SEARCH_KEY}, new.title, new.description, new.city, new.address);
+        END""",
+}
+
+_POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(city, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(address, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+)
+
+
+def ensure_search_index(using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            rebuild = False
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, 'listings_listing')}
+            if SEARCH_KEY not in columns:
+                cursor.execute(f"ALTER TABLE listings_listing ADD COLUMN {SEARCH_KEY} INTEGER")
+                cursor.execute(f"CREATE UNIQUE INDEX {SEARCH_KEY_INDEX} ON listings_listing({SEARCH_KEY})")
+                rebuild = True
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            row = cursor.fetchone()
+            if row is not None and f"content_rowid='{SEARCH_KEY}'" not in row[0]:
+                cursor.execute(f"DROP TABLE {FTS_TABLE}")  # keyed on the rowid, from before search_key
+                row = None
+            if row is None:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                    f"title, description, city, address, content='listings_listing', content_rowid='{SEARCH_KEY}', "
+                    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+                rebuild = True
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'listings_listing'")
+            existing = {row[0] for row in cursor.fetchall()}
+            if rebuild or not set(_SQLITE_TRIGGERS) <= existing:
+                for name, sql in _SQLITE_TRIGGERS.items():
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    cursor.execute(sql)
+                # Rows may have been added, or the table rebuilt, without the triggers: key them and
+                # reindex from scratch.
+                cursor.execute(
+                    f"UPDATE listings_listing SET {SEARCH_KEY} = rowid + "
+                    f"(SELECT coalesce(max({SEARCH_KEY}), 0) FROM listings_listing) WHERE {SEARCH_KEY} IS NULL"
+                )
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"ALTER TABLE listings_listing ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS ({_POSTGRES_VECTOR}) STORED"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS listing_search_vector_idx ON listings_listing USING GIN (search_vector)"
+            )
+
+
+def drop_search_index(using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for name in _SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+            cursor.execute(f"DROP INDEX IF EXISTS {SEARCH_KEY_INDEX}")
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, 'listings_listing')}
+            if SEARCH_KEY in columns:
+                cursor.execute(f"ALTER TABLE listings_listing DROP COLUMN {SEARCH_KEY}")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS listing_search_vector_idx")
+            cursor.execute("ALTER TABLE listings_listing DROP COLUMN IF EXISTS search_vector")
+
+
+class TableSQL(Expression):
+    """
+    Raw SQL over the queryset's own ``listings_listing`` row: ``{table}`` is
+    replaced by its alias, which differs once the queryset is nested as a
+    subquery (``id__in=...``).
+    """
+    def __init__(self, sql, params, output_field, alias=None):
+        super().__init__(output_field=output_field)
+        self.sql, self.params, self.alias = sql, params, alias
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        clone = self.copy()
+        clone.alias = query.get_initial_alias()
+        return clone
+
+    def relabeled_clone(self, change_map):
+        clone = self.copy()
+        clone.alias = change_map.get(self.alias, self.alias)
+        return clone
+
+    def get_group_by_cols(self):
+        return [self]
+
+    def as_sql(self, compiler, connection):
+        return self.sql.replace('{table}', compiler.quote_name_unless_alias(self.alias)), self.params
+
+
+def normalize_query(query):
+    """The words ``search_listings`` matches on, lower-cased and space-separated."""
+    return ' '.join(TOKEN_RE.findall(query.lower()))
+
+
+def search_listings(queryset, query):
+    """
+    Filter ``queryset`` to listings matching every word of ``query`` as a
+    prefix and annotate ``search_rank``, higher is more relevant.
+    """
+    tokens = TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        # Each word quoted, so user input can't form FTS5 syntax; * makes it a prefix query.
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        matches = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"  # search_key values
+        # bm25() is lower-is-better; column weights favour title, then city and address. It
+        # can't be correlated per row (each call rescans the term's postings for its IDF), so
+        # the ranks are materialized once (LIMIT -1 stops SQLite flattening the subquery) and
+        # looked up through an automatic index.
+        ranks = (
+            f"(SELECT ranked.score FROM (SELECT rowid AS id, -bm25({FTS_TABLE}, 10.0, 1.0, 4.0, 4.0) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT -1) ranked WHERE ranked.id = {{table}}.{SEARCH_KEY})"
+        )
+        return queryset.filter(
+            TableSQL(f"{{table}}.{SEARCH_KEY} IN ({matches})", [match], BooleanField()),
+        ).annotate(search_rank=TableSQL(ranks, [match], FloatField()))
+
+    if vendor == 'postgresql':
+        tsquery = "to_tsquery('simple', %s)"
+        match = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.filter(
+            TableSQL(f"{{table}}.search_vector @@ {tsquery}", [match], BooleanField()),
+        ).annotate(search_rank=TableSQL(f"ts_rank_cd({{table}}.search_vector, {tsquery})", [match], FloatField()))
+
+    condition = Q()
+    for token in tokens:
+        condition &= Q(*(Q(**{f'{field}__icontains': token}) for field in SEARCH_FIELDS), _connector=Q.OR)
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -1,5 +1,8 @@
+from django.db.models import prefetch_related_objects
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
 from .models import Listing, ListingImage
+from . import thumbnails, uploads
 from users.models import CustomUser
 from users.serializers import UserSerializer
 
@@ -11,10 +14,36 @@ class ListingImageSerializer(serializers.ModelSerializer):
         fields = ("image_url",)
 
     def get_image_url(self, obj):
-        try:
-            return obj.image.url if obj.image else ""
-        except Exception:
-            return ""
+        size = thumbnails.requested_size(self.context.get("request"))
+        return thumbnails.url(obj, "image", size, thumbnails.LISTING_SIZES) or ""
+
+class ListingListSerializer(serializers.ListSerializer):
+    """
+    ``many=True`` path for ListingSerializer: loads what every row needs for
+    the whole batch up front (lister, images and roommates prefetched, the
+    viewer's favorites as one set), so a list costs the same number of
+    queries whatever its length.
+    """
+
+    def to_representation(self, data):
+        listings = list(data.all() if isinstance(data, BaseManager) else data)
+        if listings:
+            self.load_relations(listings)
+        return super().to_representation(listings)
+
+    def load_relations(self, listings):
+        # Skips anything the view already select_related or prefetched.
+        prefetch_related_objects(listings, 'lister', 'images', 'current_roommates')
+
+        request = self.context.get("request")
+        user = getattr(request, "user", None)
+        favorited = set()
+        if user and user.is_authenticated:
+            favorited = set(user.favorites.filter(id__in=[listing.id for listing in listings])
+                            .values_list('id', flat=True))
+        for listing in listings:
+            listing.is_favorited = listing.id in favorited
+
 
 class ListingSerializer(serializers.ModelSerializer):
     lister = UserSerializer(read_only=True)
@@ -26,6 +55,7 @@ class ListingSerializer(serializers.ModelSerializer):
     images = ListingImageSerializer(many=True, read_only=True)
     image_url = serializers.SerializerMethodField()
     compatibility_score = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     current_roommates = serializers.PrimaryKeyRelatedField(
         many=True,
@@ -36,11 +66,12 @@ class ListingSerializer(serializers.ModelSerializer):
     current_roommates_details = UserSerializer(
         many=True, read_only=True, source="current_roommates"
     )
-    favorites_count = serializers.SerializerMethodField()
+    favorites_count = serializers.ReadOnlyField()
     views = serializers.ReadOnlyField()
 
     class Meta:
         model = Listing
+        list_serializer_class = ListingListSerializer
         fields = [
             "id",
             "title",
@@ -58,6 +89,7 @@ class ListingSerializer(serializers.ModelSerializer):
             "images",
             "images_data",
             "compatibility_score",
+            "distance_km",
             "roommates_needed",
             "roommates_found",
             "current_roommates",
@@ -68,15 +100,21 @@ class ListingSerializer(serializers.ModelSerializer):
         ]
 
     def get_image_url(self, obj):
-        try:
-            return obj.image.url if obj.image else None
-        except Exception:
-            return None
+        size = thumbnails.requested_size(self.context.get("request"))
+        return thumbnails.url(obj, "image", size, thumbnails.LISTING_SIZES)
 
     def get_compatibility_score(self, obj):
         return getattr(obj, "compatibility_score", None)
 
+    def get_distance_km(self, obj):
+        # Only set when the feed is filtered with near=
+        distance = getattr(obj, "distance_km", None)
+        return round(distance, 3) if distance is not None else None
+
     def get_is_favorited(self, obj):
+        # Set for the whole batch by ListingListSerializer
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         request = self.context.get("request")
         user = getattr(request, "user", None)
         if user and user.is_authenticated:
@@ -90,19 +128,10 @@ class ListingSerializer(serializers.ModelSerializer):
         if current_roommates_data:
             listing.current_roommates.set(current_roommates_data)
         if images_data:
-            listing.image = images_data[0]
-            listing.save()
-            for image_data in images_data:
-                ListingImage.objects.create(listing=listing, image=image_data)
+            # Uploaded after commit; ``image_url`` and ``images`` stay empty until then.
+            uploads.attach_listing_images(listing, images_data)
         return listing
     
-    def get_favorites_count(self, obj):
-        # Check if the annotation from the view is present
-        if hasattr(obj, 'favorites_count'):
-            return obj.favorites_count
-        # Fallback for other views where the annotation might not be present
-        return obj.favorited_by.count()
-    
     def update(self, instance, validated_data):
         images_data = validated_data.pop("images_data", None)
         current_roommates_data = validated_data.pop("current_roommates", [])
@@ -115,18 +144,10 @@ class ListingSerializer(serializers.ModelSerializer):
         if current_roommates_data is not None:
             instance.current_roommates.set(current_roommates_data)
 
-        # Handle images
-        if images_data is not None:
-            # Clear existing images
-            instance.images.all().delete()
-            
-            # The first image is the main one
-            instance.image = images_data[0]
-            
-            # Save other images as ListingImage objects
-            if len(images_data) > 1:
-                for image_data in images_data[1:]:
-                    ListingImage.objects.create(listing=instance, image=image_data)
-
         instance.save()
+
+        # Handle images: the first is the main one, the rest replace the gallery once uploaded
+        if images_data:
+            uploads.attach_listing_images(instance, images_data, replace=True, gallery_from=1)
+
         return instance
\ No newline at end of file
@@ -0,0 +1,99 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from users.models import CustomUser
+from users.serializers import UserSerializer
+from . import analytics, clusters, feed_cache
+from .models import Listing, ListingImage
+
+# Fields a cached cluster tile is computed from.
+CLUSTER_INPUT_FIELDS = {'latitude', 'longitude', 'geohash', 'rent', 'is_active'}
+
+
+@receiver(pre_save, sender=Listing)
+def detect_cluster_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._stale_geohashes = set()
+    if raw:
+        return
+    # View-count bumps and text edits leave every cluster as it was.
+    if update_fields is not None and not set(update_fields) & CLUSTER_INPUT_FIELDS:
+        return
+    old = None
+    if not instance._state.adding:
+        old = sender.objects.filter(pk=instance.pk).values_list('geohash', flat=True).first()
+    instance._stale_geohashes = {old, instance.geohash} - {None}
+
+
+@receiver(post_save, sender=Listing)
+def invalidate_clusters_on_save(sender, instance, **kwargs):
+    geohashes = getattr(instance, '_stale_geohashes', None)
+    if geohashes:
+        transaction.on_commit(lambda: clusters.invalidate(geohashes))
+
+
+@receiver(post_delete, sender=Listing)
+def invalidate_clusters_on_delete(sender, instance, **kwargs):
+    if instance.geohash:
+        transaction.on_commit(lambda: clusters.invalidate([instance.geohash]))
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+@receiver(post_save, sender=ListingImage)
+@receiver(post_delete, sender=ListingImage)
+def invalidate_feed_on_listing_change(sender, raw=False, update_fields=None, **kwargs):
+    # Detail-page view-count bumps would otherwise flush the feed on every visit.
+    if raw or update_fields is not None and set(update_fields) <= {'views'}:
+        return
+    transaction.on_commit(feed_cache.invalidate)
+
+
+@receiver(m2m_changed, sender=CustomUser.favorites.through)
+@receiver(m2m_changed, sender=Listing.current_roommates.through)
+def invalidate_feed_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(feed_cache.invalidate)
+
+
+@receiver(m2m_changed, sender=CustomUser.favorites.through)
+def count_favorites(sender, instance, action, reverse, pk_set, **kwargs):
+    """Recount ``favorites_count`` of the listings affected and record the events once committed."""
+    if action in ('pre_remove', 'pre_clear'):
+        # Removing a favorite that isn't there is a no-op: note which ones exist.
+        links = sender.objects.filter(**{'listing_id' if reverse else 'customuser_id': instance.pk})
+        if pk_set is not None:
+            links = links.filter(**{'customuser_id__in' if reverse else 'listing_id__in': pk_set})
+        instance._removed_favorites = list(links.values_list('listing_id', flat=True))
+        return
+    if action == 'post_add':
+        event, listing_ids = 'favorites', [instance.pk] * len(pk_set) if reverse else pk_set
+    elif action in ('post_remove', 'post_clear'):
+        event, listing_ids = 'unfavorites', instance.__dict__.pop('_removed_favorites', [])
+    else:
+        return
+    counts = Counter(listing_ids)
+    if not counts:
+        return
+    favorites = sender.objects.filter(listing_id=OuterRef('pk')).order_by().values('listing_id')
+    Listing.objects.filter(id__in=counts).update(
+        favorites_count=Coalesce(Subquery(favorites.annotate(n=Count('*')).values('n')), 0))
+
+    def record():
+        for listing_id, n in counts.items():
+            analytics.events.record(listing_id, event, n)
+    transaction.on_commit(record)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_feed_on_profile_change(sender, created, raw=False, update_fields=None, **kwargs):
+    # Listers and roommates are shown with their profile (``avatar_url`` reads ``avatar``); a new
+    # account isn't on any listing yet, and logins only touch last_login.
+    shown = set(UserSerializer.Meta.fields) | {'avatar'}
+    if raw or created or update_fields is not None and not set(update_fields) & shown:
+        return
+    transaction.on_commit(feed_cache.invalidate)
@@ -1,3 +1,639 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import CompatibilityScore, CustomUser
+from users.serializers import ProfileUpdateSerializer
+from . import analytics, feed_cache, geo, thumbnails, uploads
+from .models import Listing, ListingImage, ListingStat
+from .serializers import ListingSerializer
+from .analytics import EventRecorder
+
+
+class FeedPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeker = CustomUser.objects.create_user('seeker', password='x', role='Seeker', city='Metro City',
+                                                    budget=1000)
+        cls.listers = [
+            CustomUser.objects.create_user(f'lister{i}', password='x', role='Lister', city='Metro City', budget=1000)
+            for i in range(7)
+        ]
+        cls.listings = [
+            Listing.objects.create(lister=lister, title=f'Room {i}', city='Metro City', rent=900)
+            for i, lister in enumerate(cls.listers)
+        ]
+        roommate = CustomUser.objects.create_user('roommate', password='x', role='Seeker', city='Metro City',
+                                                  budget=1000)
+        cls.listings[0].current_roommates.add(roommate)
+        # Listing i scores 15 * i, except listing 0: its lister and roommate average 0 and 90 -> 45,
+        # which ties with listing 3.
+        for i, lister in enumerate(cls.listers):
+            CompatibilityScore.objects.create(seeker=cls.seeker, member=lister, model_version='v1', score=15 * i)
+        CompatibilityScore.objects.create(seeker=cls.seeker, member=roommate, model_version='v1', score=90)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url, pages = response.data['next'], pages + 1
+        return ids, pages
+
+    def test_anonymous_pages_follow_created_at_and_id(self):
+        ids, pages = self.walk('/api/listings/?page_size=3')
+        expected = Listing.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, [str(i) for i in expected])
+        self.assertEqual(pages, 3)
+
+    def test_seeker_pages_are_ranked_by_stored_scores(self):
+        self.client.force_authenticate(self.seeker)
+        with mock.patch('users.compatibility.registry.current', return_value=(object(), 'v1')), \
+                mock.patch('listings.views.get_model_version', return_value='v1'):
+            ids, _ = self.walk('/api/listings/?page_size=2')
+            top = self.client.get('/api/listings/?page_size=10&show=top_matches').data['results']
+
+        by_id = {str(listing.id): i for i, listing in enumerate(self.listings)}
+        self.assertEqual([by_id[i] for i in ids], [6, 5, 4, 3, 0, 2, 1])
+        self.assertEqual([row['compatibility_score'] for row in top], [90, 75])
+
+    def test_unpaginated_feed_is_unchanged(self):
+        response = self.client.get('/api/listings/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), len(self.listings))
+
+    def test_bad_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/api/listings/?cursor=not-a-cursor').status_code, 404)
+
+
+class ListingSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+        make = lambda title, **kw: Listing.objects.create(lister=cls.lister, title=title, **{
+            'city': 'Metro City', 'rent': 900, **kw})
+        cls.loft = make('Sunny loft', description='Bright room near the park', pets_allowed=True)
+        cls.studio = make('Quiet studio', description='Sunny south-facing windows', rent=1400)
+        cls.basement = make('Basement room', description='Cheap and central', address='12 Harbor Street')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, query, **params):
+        response = self.client.get('/api/listings/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.data]
+
+    def test_results_are_ranked_by_relevance(self):
+        # A title match outranks a description match; words match as prefixes, in any field.
+        self.assertEqual(self.search('sunny'), ['Sunny loft', 'Quiet studio'])
+        self.assertEqual(self.search('harb'), ['Basement room'])
+        self.assertEqual(self.search('sunny windows'), ['Quiet studio'])
+        self.assertEqual(self.search('"sunny*" (loft'), ['Sunny loft'])  # syntax is not passed through
+
+    def test_search_combines_with_filters(self):
+        self.assertEqual(self.search('sunny', max_rent=1000), ['Sunny loft'])
+        self.assertEqual(self.search('sunny', pets_allowed='false'), ['Quiet studio'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.studio.title = 'Penthouse suite'
+        self.studio.description = 'Top floor'
+        self.studio.save()
+        self.loft.delete()
+        Listing.objects.filter(pk=self.basement.pk).update(description='Sunny again')
+
+        self.assertEqual(self.search('sunny'), ['Basement room'])
+        self.assertEqual(self.search('penthouse'), ['Penthouse suite'])
+
+    def test_index_survives_renumbered_rowids(self):
+        # VACUUM may renumber the rowids of a table without an INTEGER PRIMARY KEY.
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE listings_listing SET rowid = 1000 - rowid")
+        Listing.objects.create(lister=self.lister, title='Sunny attic', city='Metro City', rent=900)
+        self.assertEqual(self.search('sunny'), ['Sunny attic', 'Sunny loft', 'Quiet studio'])
+        self.assertEqual(self.search('harb'), ['Basement room'])
+
+    def test_search_pages(self):
+        ids = []
+        url = '/api/listings/?search=sunny&page_size=1'
+        while url:
+            response = self.client.get(url)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [str(self.loft.id), str(self.studio.id)])
+
+    def test_seeker_search_pages(self):
+        seeker = CustomUser.objects.create_user('seeker', password='x', role='Seeker', city='Metro City', budget=1000)
+        CompatibilityScore.objects.create(seeker=seeker, member=self.lister, model_version='v1', score=80)
+        self.client.force_authenticate(seeker)
+        with mock.patch('users.compatibility.registry.current', return_value=(object(), 'v1')):
+            response = self.client.get('/api/listings/?search=sunny&page_size=5')
+        self.assertEqual([row['title'] for row in response.data['results']], ['Sunny loft', 'Quiet studio'])
+        self.assertEqual(response.data['results'][0]['compatibility_score'], 80)
+
+
+class ListingLocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+        places = {
+            'Harbor': (40.7000, -74.0000),
+            'Midtown': (40.7500, -73.9900),   # ~5.6 km north of Harbor
+            'Uptown': (40.8000, -73.9500),    # ~13 km
+            'Across': (40.7050, -74.0300),    # ~2.6 km west
+            'Faraway': (34.0500, -118.2500),
+            'Dateline': (0.0, 179.9990),
+            'Unmapped': (None, None),
+        }
+        for title, (lat, lng) in places.items():
+            Listing.objects.create(lister=lister, title=title, city='Metro City', rent=900, latitude=lat, longitude=lng)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def titles(self, **params):
+        response = self.client.get('/api/listings/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.data]
+
+    def test_geohash_follows_coordinates(self):
+        listing = Listing.objects.get(title='Harbor')
+        self.assertEqual(listing.geohash, geo.encode(40.7, -74.0))
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        listing.latitude, listing.longitude = 34.05, -118.25
+        listing.save(update_fields=['latitude', 'longitude'])
+        self.assertEqual(Listing.objects.get(pk=listing.pk).geohash, geo.encode(34.05, -118.25))
+        self.assertIsNone(Listing.objects.get(title='Unmapped').geohash)
+
+    def test_near_filters_by_radius_and_orders_by_distance(self):
+        response = self.client.get('/api/listings/', {'near': '40.7,-74.0', 'radius_km': 6, 'order': 'distance'})
+        rows = response.data
+        self.assertEqual([row['title'] for row in rows], ['Harbor', 'Across', 'Midtown'])
+        for row in rows:
+            self.assertAlmostEqual(row['distance_km'], geo.haversine_km(40.7, -74.0, row['latitude'],
+                                                                        row['longitude']), places=3)
+        self.assertEqual(sorted(self.titles(near='40.7,-74.0', radius_km=20)),
+                         ['Across', 'Harbor', 'Midtown', 'Uptown'])
+
+    def test_bbox_and_antimeridian(self):
+        self.assertEqual(sorted(self.titles(bbox='-74.01,40.69,-73.98,40.76')), ['Harbor', 'Midtown'])
+        self.assertEqual(self.titles(bbox='179.9,-0.1,-179.9,0.1'), ['Dateline'])
+        self.assertEqual(self.titles(near='0,-179.999', radius_km=1), ['Dateline'])
+
+    def test_distance_pages(self):
+        ids, url = [], '/api/listings/?near=40.7,-74.0&radius_km=20&order=distance&page_size=1'
+        while url:
+            response = self.client.get(url)
+            ids += [row['title'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, ['Harbor', 'Across', 'Midtown', 'Uptown'])
+
+    def test_bad_coordinates_are_rejected(self):
+        for params in ({'near': '91,0'}, {'near': '40.7'}, {'bbox': '1,2,3'}, {'bbox': '0,10,1,5'},
+                       {'near': '40.7,-74', 'radius_km': 'nan'}):
+            self.assertEqual(self.client.get('/api/listings/', params).status_code, 400, params)
+
+
+class ListingClusterTests(TestCase):
+    bbox = '-74.1,40.6,-73.9,40.8'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+        make = lambda lat, lng, rent: Listing.objects.create(lister=cls.lister, title='Room', city='Metro City',
+                                                             rent=rent, latitude=lat, longitude=lng)
+        cls.downtown = [make(40.7001, -74.0001, 800), make(40.7003, -74.0003, 1000), make(40.7005, -74.0002, 1500)]
+        cls.uptown = make(40.7800, -73.9500, 1200)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, zoom=12, bbox=None):
+        response = self.client.get('/api/listings/clusters/', {'bbox': bbox or self.bbox, 'zoom': zoom})
+        self.assertEqual(response.status_code, 200)
+        return [dict(zip(response.data['fields'], row)) for row in response.data['clusters']]
+
+    def test_clusters_aggregate_listings_per_cell(self):
+        downtown, uptown = sorted(self.get(), key=lambda c: -c['count'])
+        self.assertEqual((downtown['count'], downtown['min_rent'], downtown['median_rent']), (3, 800, 1000))
+        self.assertAlmostEqual(downtown['latitude'], 40.7003)
+        self.assertIsNone(downtown['listing_id'])
+        self.assertEqual((uptown['count'], uptown['listing_id']), (1, str(self.uptown.id)))
+        # Zoomed out, everything falls in one cell.
+        self.assertEqual([c['count'] for c in self.get(zoom=4)], [4])
+
+    def test_tiles_are_cached_and_invalidated_by_listing_changes(self):
+        self.get()
+        with self.assertNumQueries(0):
+            self.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.downtown[0].latitude, self.downtown[0].longitude = 40.7801, -73.9501
+            self.downtown[0].save()
+        self.assertEqual(sorted(c['count'] for c in self.get()), [2, 2])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.uptown.delete()
+            Listing.objects.create(lister=self.lister, title='New', city='Metro City', rent=700,
+                                   latitude=40.7002, longitude=-74.0004)
+        self.assertEqual(sorted(c['count'] for c in self.get()), [1, 3])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.downtown[1].views += 1
+            self.downtown[1].save(update_fields=['views'])
+        self.assertEqual(callbacks, [])
+
+    def test_bad_viewport_is_rejected(self):
+        for params in ({'zoom': 3}, {'bbox': self.bbox}, {'bbox': self.bbox, 'zoom': 30}):
+            self.assertEqual(self.client.get('/api/listings/clusters/', params).status_code, 400, params)
+
+
+# Events recorded here are written through rather than by a flusher thread.
+@override_settings(LISTING_ANALYTICS_FLUSH_INTERVAL=0)
+class ListingListQueryTests(TestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = CustomUser.objects.create_user('viewer', password='x', role='Lister', city='Metro City')
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+        cls.roommates = [
+            CustomUser.objects.create_user(f'roommate{i}', password='x', role='Seeker', city='Metro City')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def add_listings(self, n):
+        for i in range(n):
+            listing = Listing.objects.create(lister=self.lister, title=f'Room {i}', city='Metro City', rent=900)
+            listing.current_roommates.set(self.roommates)
+            ListingImage.objects.create(listing=listing, image=f'sharespace/room{i}')
+            self.viewer.favorites.add(listing)
+            self.roommates[0].favorites.add(listing)
+
+    def assertConstantQueries(self, url, expected):
+        self.client.force_authenticate(self.viewer)
+        for n in (2, 3):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add_listings(n)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            rows = response.data['results'] if isinstance(response.data, dict) else response.data
+            self.assertTrue(all(row['is_favorited'] and row['favorites_count'] == 2 for row in rows))
+            self.assertTrue(all(len(row['current_roommates_details']) == 2 and row['images'] for row in rows))
+
+    def test_feed_queries_do_not_grow_with_listings(self):
+        # listings with their lister, images, roommates, viewer's favorites
+        self.assertConstantQueries('/api/listings/', 4)
+
+    def test_paginated_feed_queries_do_not_grow_with_listings(self):
+        self.assertConstantQueries('/api/listings/?page_size=20', 4)
+
+    def test_favorites_queries_do_not_grow_with_listings(self):
+        self.assertConstantQueries('/api/users/favorites/', 4)
+
+
+@override_settings(LISTING_ANALYTICS_FLUSH_INTERVAL=0)
+class FeedCacheTests(TestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+        cls.listings = [
+            Listing.objects.create(lister=cls.lister, title=f'Sunny room {i}', city='Metro City', rent=800 + 100 * i)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_equivalent_params_share_an_entry(self):
+        first = self.client.get('/api/listings/', {'search': 'Sunny ROOM', 'max_rent': '950', 'pets_allowed': 'False'})
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/listings/', {'pets_allowed': 'no', 'max_rent': ' 950', 'search': 'sunny, room'})
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(len(first.data), 2)
+        with self.assertNumQueries(3):  # anonymous: no favorites of their own to read
+            self.client.get('/api/listings/', {'search': 'sunny room', 'max_rent': '1000'})
+
+    def test_writes_invalidate_on_commit(self):
+        self.client.get('/api/listings/')
+        writes = [
+            lambda: Listing.objects.create(lister=self.lister, title='New', city='Metro City', rent=700),
+            lambda: ListingImage.objects.create(listing=self.listings[0], image='sharespace/new'),
+            lambda: self.lister.favorites.add(self.listings[1]),
+            lambda: CustomUser.objects.filter(pk=self.lister.pk).first().save(update_fields=['bio']),
+        ]
+        for write in writes:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            with self.assertNumQueries(3):
+                self.client.get('/api/listings/')
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.listings[0].views += 1
+            self.listings[0].save(update_fields=['views'])
+            self.lister.save(update_fields=['last_login'])
+        self.assertEqual(callbacks, [])
+
+    def test_listers_get_their_own_entries_and_seekers_none(self):
+        self.lister.favorites.add(self.listings[0])
+        self.client.get('/api/listings/')
+        self.client.force_authenticate(self.lister)
+        favorited = {row['id']: row['is_favorited'] for row in self.client.get('/api/listings/').data}
+        self.assertTrue(favorited[str(self.listings[0].id)])
+
+        seeker = CustomUser.objects.create_user('seeker', password='x', role='Seeker', city='Metro City')
+        self.client.force_authenticate(seeker)
+        self.assertIsNone(feed_cache.cache_key(self.client.get('/api/listings/').wsgi_request))
+
+    def test_cached_pages_link_to_the_requested_url(self):
+        first = self.client.get('/api/listings/?page_size=2')
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/listings/?page_size=02&show=all')
+        self.assertEqual(again.data['results'], first.data['results'])
+        self.assertIn('page_size=02', again.data['next'])
+        ids = [row['id'] for row in again.data['results'] + self.client.get(again.data['next']).data['results']]
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as path, override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': path}}):
+            first = self.client.get('/api/listings/?page_size=2')
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/listings/?page_size=2').data, first.data)
+
+
+@override_settings(LISTING_ANALYTICS_FLUSH_INTERVAL=0)
+class ListingAnalyticsTests(TestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+        cls.seeker = CustomUser.objects.create_user('seeker', password='x', role='Seeker', city='Metro City')
+        cls.listings = [
+            Listing.objects.create(lister=cls.lister, title=f'Room {i}', city='Metro City', rent=900, views=10)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_buffered_and_flushed_as_increments(self):
+        recorder = EventRecorder(interval=60)
+        with mock.patch.object(recorder, '_ensure_flusher'):
+            for listing, n in zip(self.listings, (3, 3, 1)):
+                for _ in range(n):
+                    pending = recorder.record(listing.id, 'views')
+            self.assertEqual(pending, 1)
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).views, 10)
+
+        # A save elsewhere meanwhile isn't overwritten: the flush adds to whatever is stored.
+        Listing.objects.filter(pk=self.listings[0].pk).update(views=50)
+        # Savepoint, live listings, one UPDATE per distinct increment, then per bucket
+        # (hour, day): one INSERT and one UPDATE per distinct increment.
+        with self.assertNumQueries(2 + 1 + 2 + 2 * (1 + 2)):
+            self.assertEqual(recorder.flush(), 7)
+        self.assertEqual([Listing.objects.get(pk=listing.pk).views for listing in self.listings], [53, 13, 11])
+        self.assertEqual(recorder.flush(), 0)
+
+        buckets = ListingStat.objects.filter(listing=self.listings[0]).values_list('granularity', 'views')
+        self.assertEqual(sorted(buckets), [('day', 3), ('hour', 3)])
+
+    def test_failed_flush_keeps_counts(self):
+        recorder = EventRecorder(interval=60)
+        with mock.patch.object(recorder, '_ensure_flusher'):
+            recorder.record(self.listings[0].id, 'views')
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                recorder.flush()
+        self.assertEqual(recorder.pending(self.listings[0].id, 'views'), 1)
+
+    def test_events_land_in_hourly_and_daily_buckets(self):
+        recorder = EventRecorder(interval=60)
+        start = timezone.now().replace(hour=22, minute=30) - timedelta(days=1)
+        with mock.patch.object(recorder, '_ensure_flusher'):
+            for hours in (0, 0, 1, 2):  # 22:30, 23:30 and 00:30 the next day
+                with mock.patch('django.utils.timezone.now', return_value=start + timedelta(hours=hours)):
+                    recorder.record(self.listings[0].id, 'views')
+            with mock.patch('django.utils.timezone.now', return_value=start + timedelta(hours=2)):
+                recorder.record(self.listings[0].id, 'favorites', 2)
+        recorder.flush()
+        recorder.flush()  # nothing left, and no duplicate buckets
+
+        hourly = ListingStat.objects.filter(listing=self.listings[0], granularity='hour')
+        daily = ListingStat.objects.filter(listing=self.listings[0], granularity='day').order_by('start')
+        self.assertEqual(sorted(hourly.values_list('views', 'favorites')), [(1, 0), (1, 2), (2, 0)])
+        self.assertEqual([(row.views, row.favorites) for row in daily], [(3, 0), (1, 2)])
+
+        with mock.patch('django.utils.timezone.now', return_value=start + timedelta(days=30)):
+            self.assertEqual(recorder.prune(), 3)
+        self.assertEqual(daily.count(), 2)
+
+    def test_favorites_count_is_kept_exact(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seeker.favorites.add(*self.listings[:2])
+            self.lister.favorites.add(self.listings[0])
+            self.seeker.favorites.remove(self.listings[0], self.listings[2])  # listings[2] wasn't a favorite
+            self.listings[1].favorited_by.add(self.lister)
+        counts = dict(Listing.objects.values_list('title', 'favorites_count'))
+        self.assertEqual(counts, {'Room 0': 1, 'Room 1': 2, 'Room 2': 0})
+        stats = dict(ListingStat.objects.filter(granularity='day').values_list('listing__title', 'unfavorites'))
+        self.assertEqual(stats, {'Room 0': 1, 'Room 1': 0})
+        self.assertEqual(ListingStat.objects.get(granularity='day', listing=self.listings[1]).favorites, 2)
+
+        # A full save of a stale instance doesn't put back the counts it read.
+        self.listings[0].title = 'Room zero'
+        self.listings[0].save()
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).favorites_count, 1)
+
+    def test_detail_view_does_not_write(self):
+        with mock.patch.object(analytics.events, '_ensure_flusher'), mock.patch.object(analytics.events, '_interval', 60):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                first = self.client.get(f'/api/listings/{self.listings[0].id}/')
+                second = self.client.get(f'/api/listings/{self.listings[0].id}/')
+            self.assertEqual((first.data['views'], second.data['views']), (11, 12))
+            self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).views, 10)
+            self.assertEqual(callbacks, [])
+            analytics.events.flush()
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).views, 12)
+
+    def test_stats_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seeker.favorites.add(self.listings[0])
+            analytics.events.record(self.listings[0].id, 'views', 4)
+        url = f'/api/listings/{self.listings[0].id}/stats/'
+        self.client.force_authenticate(self.seeker)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_authenticate(self.lister)
+        data = self.client.get(url, {'granularity': 'hour', 'days': 1}).data
+        self.assertEqual(data['totals'], {'views': 14, 'favorites': 1})
+        self.assertEqual(len(data['series']), 25)
+        self.assertEqual(data['series'][-1]['views'], 4)
+        self.assertEqual(sum(point['favorites'] for point in data['series']), 1)
+        self.assertEqual(len(self.client.get(url).data['series']), 31)
+        self.assertEqual(self.client.get(url, {'granularity': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'granularity': 'hour', 'days': 30}).status_code, 400)
+
+        with self.assertNumQueries(5):  # listings, lister, images, roommates, the viewer's favorites
+            rows = self.client.get('/api/listings/my-listings/').data
+        self.assertEqual({row['favorites_count'] for row in rows}, {0, 1})
+
+
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city='Metro City')
+
+    def setUp(self):
+        storage_dir = tempfile.TemporaryDirectory()
+        self.staging_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(storage_dir.cleanup)
+        self.addCleanup(self.staging_dir.cleanup)
+        overrides = override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'images': {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                           'OPTIONS': {'location': storage_dir.name}},
+            },
+            IMAGE_UPLOAD_STAGING_DIR=self.staging_dir.name,
+            IMAGE_UPLOAD_BACKGROUND=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def photos(self, *names):
+        return [SimpleUploadedFile(name, b'photo ' + name.encode(), content_type='image/jpeg') for name in names]
+
+    def gallery(self, listing):
+        # CloudinaryField reads a stored name as public id plus format.
+        return sorted(str(image.image) for image in ListingImage.objects.filter(listing=listing))
+
+    def test_listing_images_upload_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            listing = ListingSerializer().create({
+                'lister': self.lister, 'title': 'Sunny room', 'city': 'Metro City', 'rent': 900,
+                'images_data': self.photos('front.jpg', 'kitchen.jpg'),
+            })
+        self.assertFalse(ListingImage.objects.filter(listing=listing).exists())
+        self.assertEqual(len(os.listdir(self.staging_dir.name)), 2)
+
+        for callback in callbacks:
+            callback()
+        listing.refresh_from_db()
+        self.assertEqual((str(listing.image), listing.image.format), ('listings/front', 'jpg'))
+        self.assertEqual(self.gallery(listing), ['listings/front', 'listings/kitchen'])
+        self.assertIn('w_480', ListingImage.objects.filter(listing=listing).first().image_variants['card'])
+        self.assertEqual(os.listdir(self.staging_dir.name), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ListingSerializer().update(listing, {'images_data': self.photos('new.jpg', 'garden.jpg')})
+        listing.refresh_from_db()
+        self.assertEqual(str(listing.image), 'listings/new')
+        self.assertEqual(self.gallery(listing), ['listings/garden'])
+
+    def test_failed_upload_leaves_images_unchanged(self):
+        listing = Listing.objects.create(lister=self.lister, title='Room', city='Metro City', rent=900, image='old')
+        with mock.patch('django.core.files.storage.FileSystemStorage.save', side_effect=OSError('host down')):
+            with self.assertLogs('listings.uploads', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+                ListingSerializer().update(listing, {'images_data': self.photos('new.jpg')})
+        listing.refresh_from_db()
+        self.assertEqual(str(listing.image), 'old')
+        self.assertEqual(os.listdir(self.staging_dir.name), [])
+
+    def test_files_staged_by_a_rolled_back_request_are_swept(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            ListingSerializer().create({
+                'lister': self.lister, 'title': 'Sunny room', 'city': 'Metro City', 'rent': 900,
+                'images_data': self.photos('front.jpg'),
+            })
+            raise RuntimeError('request failed')
+        leftover, = os.listdir(self.staging_dir.name)
+        old = time.time() - settings.IMAGE_UPLOAD_STAGING_MAX_AGE - 1
+        os.utime(os.path.join(self.staging_dir.name, leftover), (old, old))
+
+        with self.captureOnCommitCallbacks():
+            listing = Listing.objects.create(lister=self.lister, title='Room', city='Metro City', rent=900)
+            uploads.attach_listing_images(listing, self.photos('new.jpg'))
+        remaining = os.listdir(self.staging_dir.name)
+        self.assertEqual(len(remaining), 1)
+        self.assertNotIn(leftover, remaining)
+
+    def test_avatar_uploads_after_commit(self):
+        serializer = ProfileUpdateSerializer(
+            self.lister, data={'bio': 'Hi', 'avatar': self.photos('me.jpg')[0]}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks() as callbacks:
+            serializer.save()
+        self.lister.refresh_from_db()
+        self.assertEqual((self.lister.bio, self.lister.avatar), ('Hi', None))
+
+        for callback in callbacks:
+            callback()
+        self.lister.refresh_from_db()
+        self.assertEqual(str(self.lister.avatar), 'avatars/me')
+
+
+@override_settings(LISTING_ANALYTICS_FLUSH_INTERVAL=0)
+class ThumbnailTests(TestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lister = CustomUser.objects.create_user(
+            'lister', password='x', role='Lister', city='Metro City', avatar='avatars/me.jpg')
+        cls.listing = Listing.objects.create(
+            lister=cls.lister, title='Sunny room', city='Metro City', rent=900, image='listings/front.jpg')
+        ListingImage.objects.create(listing=cls.listing, image='listings/kitchen.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_variants_are_stored_on_save(self):
+        self.assertEqual(set(self.listing.image_variants), set(thumbnails.LISTING_SIZES))
+        self.assertEqual(set(self.lister.avatar_variants), set(thumbnails.AVATAR_SIZES))
+        listing = Listing.objects.get(pk=self.listing.pk)
+        self.assertEqual(listing.image_variants['full'], listing.image.url)
+
+        listing.image = 'listings/back.png'
+        listing.save(update_fields=['image'])
+        self.assertIn('listings/back', Listing.objects.get(pk=listing.pk).image_variants['card'])
+
+    def test_size_param_picks_the_variant(self):
+        row, = self.client.get('/api/listings/', {'size': 'card'}).data
+        self.assertEqual(row['image_url'], self.listing.image_variants['card'])
+        self.assertIn('w_480', row['images'][0]['image_url'])
+        # Avatars have no card variant: they get their own thumbnail.
+        self.assertEqual(row['lister']['avatar_url'], self.lister.avatar_variants['avatar'])
+
+        row, = self.client.get('/api/listings/').data
+        self.assertEqual(row['image_url'], Listing.objects.get(pk=self.listing.pk).image.url)
+        self.assertEqual(self.client.get('/api/listings/', {'size': 'huge'}).status_code, 400)
+
+    def test_rows_without_variants_build_the_url(self):
+        Listing.objects.filter(pk=self.listing.pk).update(image_variants={})
+        row = self.client.get(f'/api/listings/{self.listing.pk}/', {'size': 'gallery'}).data
+        self.assertIn('c_limit', row['image_url'])
@@ -0,0 +1,72 @@
+"""
+Sized variants of listing photos and avatars.
+
+Cloudinary resizes on the fly from transformation parameters in the URL, so a
+variant is just a URL. Each row stores the URLs of its variants next to the
+image (``image_variants``, ``avatar_variants``), built in ``save()`` whenever
+the image is written, and serializers read them from there instead of
+building a URL per object per response. Clients pick one with
+``?size=card|gallery|avatar|full``; ``full``, the original, is the default.
+An image without the requested variant serves its nearest one: a listing
+photo's ``avatar`` is its ``card``, an avatar's ``card`` or ``gallery`` is
+its ``avatar``.
+
+Rows written without ``save()`` (``bulk_create``, ``QuerySet.update``) must
+set their variants themselves; a row without them falls back to building the
+URL while serializing.
+"""
+from django.core.files.uploadedfile import UploadedFile
+from rest_framework.exceptions import ValidationError
+
+DEFAULT_SIZE = 'full'
+SIZES = ('card', 'gallery', 'avatar', 'full')
+LISTING_SIZES = ('card', 'gallery', 'full')
+AVATAR_SIZES = ('avatar', 'full')
+NEAREST = {'avatar': 'card', 'card': 'avatar', 'gallery': 'avatar'}
+
+# Automatic format (WebP/AVIF where the browser takes them) and quality on every variant.
+_COMPRESSED = {'fetch_format': 'auto', 'quality': 'auto'}
+TRANSFORMATIONS = {
+    'card': {'width': 480, 'height': 360, 'crop': 'fill', 'gravity': 'auto', **_COMPRESSED},
+    'gallery': {'width': 1280, 'crop': 'limit', **_COMPRESSED},
+    'avatar': {'width': 128, 'height': 128, 'crop': 'thumb', 'gravity': 'face', **_COMPRESSED},
+    'full': {},
+}
+
+
+def variants(field, value, sizes):
+    """
+    URLs of ``sizes`` for ``value`` of the CloudinaryField ``field``; empty when
+    there is no image, or it is a file not uploaded yet.
+    """
+    if not value or isinstance(value, UploadedFile):
+        return {}
+    resource = field.to_python(value)
+    return {size: resource.build_url(**TRANSFORMATIONS[size]) for size in sizes}
+
+
+def requested_size(request):
+    """The ``size`` query param, validated; ``DEFAULT_SIZE`` without a request or the param."""
+    if request is None:
+        return DEFAULT_SIZE
+    size = request.query_params.get('size', '').strip().lower() or DEFAULT_SIZE
+    if size not in SIZES:
+        raise ValidationError({'size': f"Must be one of: {', '.join(SIZES)}."})
+    return size
+
+
+def url(instance, name, size, sizes):
+    """
+    The ``size`` URL of ``instance``'s image field ``name`` (``sizes`` are the
+    ones it has), from its ``{name}_variants`` if stored; ``None`` without an image.
+    """
+    if size not in sizes:
+        size = NEAREST[size]
+    stored = getattr(instance, f'{name}_variants', None)
+    if stored and size in stored:
+        return stored[size]
+    try:
+        built = variants(instance._meta.get_field(name), getattr(instance, name), [size])
+    except Exception:
+        return None
+    return built.get(size)
@@ -0,0 +1,170 @@
+"""
+Background image uploads for listing photos and avatars.
+
+Uploaded files are staged to ``IMAGE_UPLOAD_STAGING_DIR`` during the request,
+which then returns without waiting on the image host. Once the request's
+transaction commits, a background job pushes the staged files through the
+``images`` storage (``STORAGES`` in settings: Cloudinary in production,
+``FileSystemStorage`` in tests) ``IMAGE_UPLOAD_WORKERS`` at a time, then
+points the listing or user at the stored names, which ``CloudinaryField``
+reads as public ids. Staged files are removed whatever the outcome. A failed
+upload is logged and leaves the listing's images, or the avatar, unchanged.
+
+If the transaction rolls back instead, the job never runs: Django drops
+``on_commit`` callbacks on rollback and has no rollback hook to clean up
+with, and a process can die between staging and uploading. ``stage()``
+therefore first sweeps staged files older than
+``IMAGE_UPLOAD_STAGING_MAX_AGE``, which no pending job still needs.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.db import connection, transaction
+
+from . import thumbnails
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_executors = {}
+
+
+def _executor(name, workers):
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'image-{name}')
+        return _executors[name]
+
+
+def sweep(max_age=None):
+    """Delete staged files older than ``max_age`` seconds (``IMAGE_UPLOAD_STAGING_MAX_AGE``); returns how many."""
+    if max_age is None:
+        max_age = settings.IMAGE_UPLOAD_STAGING_MAX_AGE
+    cutoff = time.time() - max_age
+    swept = 0
+    try:
+        entries = list(os.scandir(settings.IMAGE_UPLOAD_STAGING_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                swept += 1
+        except FileNotFoundError:
+            pass  # uploaded and discarded meanwhile
+    return swept
+
+
+def stage(files):
+    """Copy uploaded files to the staging directory; returns ``(path, original name)`` pairs."""
+    sweep()
+    os.makedirs(settings.IMAGE_UPLOAD_STAGING_DIR, exist_ok=True)
+    staged = []
+    for upload in files:
+        name = os.path.basename(upload.name or 'image')
+        fd, path = tempfile.mkstemp(dir=settings.IMAGE_UPLOAD_STAGING_DIR, suffix=os.path.splitext(name)[1])
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in upload.chunks():
+                fh.write(chunk)
+        staged.append((path, name))
+    return staged
+
+
+def upload_staged(staged, folder):
+    """Store staged files in parallel; returns their storage names, in order."""
+    storage = storages['images']
+
+    def upload(item):
+        path, name = item
+        with open(path, 'rb') as fh:
+            return storage.save(f'{folder}/{name}', File(fh, name=name))
+
+    return list(_executor('uploads', settings.IMAGE_UPLOAD_WORKERS).map(upload, staged))
+
+
+def _after_commit(job):
+    """Run ``job`` once the current transaction commits, in the background unless configured not to."""
+    def run():
+        try:
+            job()
+        except Exception:
+            logger.exception("Background image upload failed.")
+
+    def background():
+        try:
+            run()
+        finally:
+            connection.close()  # the worker thread's own connection
+
+    if settings.IMAGE_UPLOAD_BACKGROUND:
+        transaction.on_commit(lambda: _executor('jobs', 2).submit(background))
+    else:
+        transaction.on_commit(run)
+
+
+def _discard(staged):
+    for path, _ in staged:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def attach_listing_images(listing, files, replace=False, gallery_from=0):
+    """
+    Upload ``files`` for ``listing`` in the background. The first becomes the
+    main image; ``files[gallery_from:]`` become ``ListingImage`` rows, after
+    removing the existing ones when ``replace`` is set.
+    """
+    from .models import Listing, ListingImage
+
+    staged = stage(files)
+    listing_id = listing.pk
+
+    def job():
+        try:
+            names = upload_staged(staged, 'listings')
+        finally:
+            _discard(staged)
+        with transaction.atomic():
+            listing = Listing.objects.select_for_update().filter(pk=listing_id).first()
+            if listing is None:
+                return  # deleted while uploading
+            if replace:
+                listing.images.all().delete()
+            listing.image = names[0]
+            listing.save(update_fields=['image'])
+            field = ListingImage._meta.get_field('image')
+            ListingImage.objects.bulk_create(
+                ListingImage(listing=listing, image=name,
+                             image_variants=thumbnails.variants(field, name, thumbnails.LISTING_SIZES))
+                for name in names[gallery_from:]
+            )
+
+    _after_commit(job)
+
+
+def attach_avatar(user, upload):
+    """Upload ``upload`` as ``user``'s avatar in the background."""
+    staged = stage([upload])
+    user_model, user_id = type(user), user.pk
+
+    def job():
+        try:
+            name, = upload_staged(staged, 'avatars')
+        finally:
+            _discard(staged)
+        user = user_model.objects.filter(pk=user_id).first()
+        if user is not None:
+            user.avatar = name
+            user.save(update_fields=['avatar'])
+
+    _after_commit(job)
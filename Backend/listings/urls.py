@@ -1,20 +1,24 @@
 from django.urls import path
 from .views import (
     PersonalizedListingListView,
+    ListingClusterView,
     ListingListView, 
     ListingCreateView, 
     ListingDetailView, 
     MyListingsView,
     ListingUpdateView,
-    ListingDeleteView
+    ListingDeleteView,
+    ListingStatsView,
 )
 
 urlpatterns = [
     # path('', ListingListView.as_view(), name='listing-list'),
     path('', PersonalizedListingListView.as_view(), name='listing-list-personalized'), 
+    path('clusters/', ListingClusterView.as_view(), name='listing-clusters'),
     path('create/', ListingCreateView.as_view(), name='listing-create'),
     path('my-listings/', MyListingsView.as_view(), name='my-listing-list'),
     path('<uuid:id>/', ListingDetailView.as_view(), name='listing-detail'),
     path('<uuid:id>/update/', ListingUpdateView.as_view(), name='listing-update'),
     path('<uuid:id>/delete/', ListingDeleteView.as_view(), name='listing-delete'),
+    path('<uuid:id>/stats/', ListingStatsView.as_view(), name='listing-stats'),
 ]
\ No newline at end of file
@@ -1,41 +1,99 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import generics
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from .models import Listing, CustomUser
-import pandas as pd
-import joblib
-from django.conf import settings
+from .models import Listing, ListingStat, CustomUser
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q
+from django.db.models import (
+    Case, Exists, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.lookups import GreaterThan
+from django.db.models.functions import Cast, Coalesce, Least, Round
+from . import analytics, clusters, feed_cache, geo
+from .pagination import KeysetPagination
+from .search import normalize_query, search_listings
 from .serializers import ListingSerializer
+from users.compatibility import get_scores, score_unscored
+from users.ml_utils import get_matcher, get_model_version
+from users.models import CompatibilityScore
 from django.db.models import Count
 
+# Seekers' feed order; without a model everyone gets the (created_at, id) suffix.
+# Searches are ordered by relevance for everyone, unless ordered by distance.
+FEED_KEYSET = ('-compatibility_score', '-created_at', '-id')
+SEARCH_KEYSET = ('-search_rank', '-created_at', '-id')
+DISTANCE_KEYSET = ('distance_km', '-created_at', '-id')
+Roommate = Listing.current_roommates.through
+DEFAULT_RADIUS_KM = 10
+MAX_RADIUS_KM = 500
+
+
+def coordinates(request, name, count, lng_first=True):
+    """Parse ``count`` comma-separated numbers from a query param as alternating lng/lat (or lat/lng)."""
+    raw = request.query_params.get(name)
+    if raw is None:
+        return None
+    try:
+        values = [float(v) for v in raw.split(',')]
+    except ValueError:
+        values = []
+    limits = (180, 90) if lng_first else (90, 180)
+    if len(values) != count or not all(abs(v) <= limits[i % 2] for i, v in enumerate(values)):
+        raise ValidationError({name: f'Expected {count} comma-separated coordinates.'})
+    return values
+
+
+def listing_score(seeker, version):
+    """
+    SQL twin of the feed's Python ranking: the seeker's stored score averaged
+    over a listing's lister and current roommates (themselves excluded),
+    rounded and capped at 99; 0 when none is stored.
+
+    Lister and roommates are looked up separately so each side is a probe of
+    the (seeker, model_version, member) unique index.
+    """
+    stored = CompatibilityScore.objects.filter(seeker_id=seeker.id, model_version=version).exclude(member_id=seeker.id)
+    lister = stored.filter(member_id=OuterRef('lister_id')).values('score')[:1]
+    roommates = (
+        stored.filter(member_id__in=Roommate.objects.filter(listing_id=OuterRef(OuterRef('pk'))).values('customuser_id'))
+        .values('seeker_id').annotate(total=Sum('score'), n=Count('id'))
+    )
+    total = Coalesce(Subquery(lister), 0.0) + Coalesce(Subquery(roommates.values('total')), 0.0)
+    n = Case(When(Exists(lister), then=1), default=0) + Coalesce(Subquery(roommates.values('n')), 0)
+    average = Case(When(GreaterThan(n, 0), then=total / Cast(n, FloatField())), default=Value(0.0))
+    return Least(Cast(Round(average), IntegerField()), Value(99))
+
+
 class PersonalizedListingListView(APIView):
     permission_classes = [AllowAny]
 
-    try:
-        model_path = settings.BASE_DIR / 'roommate_matcher_pipeline.pkl'
-        pipeline = joblib.load(model_path)
-    except FileNotFoundError:
-        pipeline = None
-
     def get(self, request, *args, **kwargs):
+        key = feed_cache.cache_key(request)
+        if key is not None:
+            cached = feed_cache.lookup(request, key)
+            if cached is not None:
+                return Response(cached)
+        response = self.get_feed(request)
+        if key is not None:
+            feed_cache.store(key, response.data)
+        return response
+
+    def get_feed(self, request):
         user = request.user
         queryset = Listing.objects.filter(is_active=True).select_related('lister').order_by('-created_at')
 
-        search_query = request.query_params.get('search', None)
+        search_query = normalize_query(request.query_params.get('search', ''))
         pets_allowed = request.query_params.get('pets_allowed', None)
         smoking_allowed = request.query_params.get('smoking_allowed', None)
         min_rent = request.query_params.get('min_rent', None)
         max_rent = request.query_params.get('max_rent', None)
 
         if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(city__icontains=search_query) |
-                Q(address__icontains=search_query)
-            )
+            queryset = search_listings(queryset, search_query)
         if pets_allowed is not None:
             queryset = queryset.filter(pets_allowed=pets_allowed.lower() == 'true')
         if smoking_allowed is not None:
@@ -46,61 +104,183 @@ class PersonalizedListingListView(APIView):
             queryset = queryset.filter(rent__lte=max_rent)
 
         show_filter = request.query_params.get('show', 'all')
-
-        if user.is_authenticated and user.role == 'Seeker':
-            if show_filter == 'my_city':
-                queryset = queryset.filter(city__iexact=user.city)
-
-            if self.pipeline is not None:
+        is_seeker = user.is_authenticated and user.role == 'Seeker'
+        if is_seeker and show_filter == 'my_city':
+            queryset = queryset.filter(city__iexact=user.city)
+
+        queryset, near = self.filter_location(request, queryset)
+        if near and request.query_params.get('order') == 'distance':
+            keyset = DISTANCE_KEYSET
+        else:
+            keyset = SEARCH_KEYSET if search_query else FEED_KEYSET
+        if keyset != FEED_KEYSET:
+            queryset = queryset.order_by(*keyset)
+
+        paginator = KeysetPagination(keyset)
+        if paginator.requested(request):
+            return self.get_page(request, queryset, paginator, is_seeker, show_filter)
+
+        if is_seeker:
+            matcher = get_matcher()
+            if matcher is not None:
                 queryset = queryset.prefetch_related('lister', 'current_roommates')
 
-                prediction_data = []
-                listing_member_map = []
-
+                listing_members = {}
                 for listing in queryset:
                     # Filter out the current user from the list of roommates to be scored
                     members_to_score = [listing.lister] + list(listing.current_roommates.all())
-                    members_to_score = [member for member in members_to_score if member.id != user.id]
+                    listing_members[listing.id] = [member for member in members_to_score if member.id != user.id]
 
-                    for member in members_to_score:
-                        prediction_data.append({
-                            **{f"{col}_seeker": getattr(user, col, None) for col in ['role', 'city', 'budget', 'cleanliness', 'noise_level', 'sleep_schedule', 'smoking', 'social_level', 'has_pets', 'gender_preference', 'work_schedule', 'occupation', 'mbti_type']},
-                            **{f"{col}_lister": getattr(member, col, None) for col in ['budget', 'has_pets', 'cleanliness', 'noise_level', 'sleep_schedule', 'smoking', 'social_level', 'gender_preference', 'work_schedule', 'occupation', 'mbti_type']}
-                        })
-                        listing_member_map.append(listing.id)
-
-                if prediction_data:
-                    df_to_predict = pd.DataFrame(prediction_data)
-                    df_to_predict.fillna(0, inplace=True)
-
-                    try:
-                        scores = self.pipeline.predict(df_to_predict)
-                        listing_scores = {}
-                        for i, listing_id in enumerate(listing_member_map):
-                            if listing_id not in listing_scores:
-                                listing_scores[listing_id] = []
-                            listing_scores[listing_id].append(scores[i])
-
-                        for listing in queryset:
-                            listing_id = listing.id
-                            if listing_id in listing_scores and listing_scores[listing_id]:
-                                avg_score = sum(listing_scores[listing_id]) / len(listing_scores[listing_id])
-                                listing.compatibility_score = min(99, int(round(avg_score)))
-                            else:
-                                listing.compatibility_score = 0
-                    except Exception as e:
-                        for listing in queryset:
-                            listing.compatibility_score = 0
+                try:
+                    scores = get_scores(user, [m for members in listing_members.values() for m in members])
+                except Exception as e:
+                    scores = {}
+
+                for listing in queryset:
+                    member_scores = [scores[m.id] for m in listing_members[listing.id] if m.id in scores]
+                    if member_scores:
+                        avg_score = sum(member_scores) / len(member_scores)
+                        listing.compatibility_score = min(99, int(round(avg_score)))
+                    else:
+                        listing.compatibility_score = 0
 
             if show_filter == 'top_matches':
                 queryset = [l for l in queryset if hasattr(l, 'compatibility_score') and l.compatibility_score >= 70]
 
-            queryset = sorted(queryset, key=lambda x: getattr(x, 'compatibility_score', 0), reverse=True)
+            if keyset == FEED_KEYSET:
+                queryset = sorted(queryset, key=lambda x: getattr(x, 'compatibility_score', 0), reverse=True)
 
 
         serializer = ListingSerializer(queryset, many=True, context={'request': request})
         return Response(serializer.data)
 
+    def filter_location(self, request, queryset):
+        """
+        ``bbox=min_lng,min_lat,max_lng,max_lat`` keeps listings inside the box
+        (``min_lng > max_lng`` crosses the antimeridian). ``near=lat,lng`` with
+        ``radius_km`` (default 10) keeps those within that great-circle
+        distance and annotates ``distance_km``; ``order=distance`` sorts by it.
+        """
+        bbox = coordinates(request, 'bbox', 4)
+        if bbox is not None:
+            min_lng, min_lat, max_lng, max_lat = bbox
+            if min_lat > max_lat:
+                raise ValidationError({'bbox': 'min_lat must not exceed max_lat.'})
+            queryset = queryset.filter(geo.within_box(min_lat, min_lng, max_lat, max_lng))
+
+        near = coordinates(request, 'near', 2, lng_first=False)
+        if near is None:
+            return queryset, False
+        radius = request.query_params.get('radius_km', DEFAULT_RADIUS_KM)
+        try:
+            radius = float(radius)
+        except ValueError:
+            radius = 0
+        if not 0 < radius <= MAX_RADIUS_KM:
+            raise ValidationError({'radius_km': f'Expected a distance between 0 and {MAX_RADIUS_KM} km.'})
+        lat, lng = near
+        queryset = queryset.filter(geo.within_box(*geo.around(lat, lng, radius))).annotate(
+            distance_km=geo.distance_km(lat, lng),
+        ).filter(distance_km__lte=radius)
+        return queryset, True
+
+    def get_page(self, request, queryset, paginator, is_seeker, show_filter):
+        """
+        One keyset page of the feed (opt in with ``page_size`` or ``cursor``).
+
+        Seekers are ranked by their compatibility with each listing's members,
+        computed in SQL from the score store, so only the page is read and
+        serialized. Unscored candidates are scored first, on the first page.
+        Searches are ranked by relevance instead.
+        """
+        user = request.user
+        version = None
+        if is_seeker:
+            if paginator.cursor_query_param not in request.query_params:
+                members = CustomUser.objects.filter(
+                    Q(id__in=queryset.order_by().values('lister_id'))
+                    | Q(id__in=Roommate.objects.filter(listing__in=queryset.order_by()).values('customuser_id'))
+                )
+                version = score_unscored(user, members)
+            else:
+                version = get_model_version()
+
+        if version is not None:
+            queryset = queryset.annotate(compatibility_score=listing_score(user, version))
+            if show_filter == 'top_matches':
+                queryset = queryset.filter(compatibility_score__gte=70)
+        elif paginator.ordering == FEED_KEYSET:
+            paginator = KeysetPagination(FEED_KEYSET[1:])
+
+        page = paginator.paginate_queryset(queryset.prefetch_related('images', 'current_roommates'), request)
+        serializer = ListingSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+class ListingClusterView(APIView):
+    """
+    Map clusters for a viewport: ``bbox=min_lng,min_lat,max_lng,max_lat`` and
+    ``zoom`` (0-20). Each cluster is a row of ``fields``; ``listing_id`` is set
+    when the cluster is a single listing.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        bbox = coordinates(request, 'bbox', 4)
+        if bbox is None:
+            raise ValidationError({'bbox': 'This parameter is required.'})
+        min_lng, min_lat, max_lng, max_lat = bbox
+        if min_lat > max_lat:
+            raise ValidationError({'bbox': 'min_lat must not exceed max_lat.'})
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= 20:
+            raise ValidationError({'zoom': 'Expected a whole number from 0 to 20.'})
+
+        if min_lng > max_lng:
+            boxes = [(min_lat, min_lng, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lng)]
+        else:
+            boxes = [(min_lat, min_lng, max_lat, max_lng)]
+        precision = clusters.fit_precision(boxes, zoom)
+        return Response({
+            'precision': precision,
+            'fields': clusters.CLUSTER_FIELDS,
+            'clusters': clusters.get_clusters(boxes, precision),
+        })
+
+
+class ListingStatsView(APIView):
+    """
+    A lister's time series for one of their listings: ``granularity=hour``
+    (the last ``days`` days, default 2, at most the hourly retention) or
+    ``granularity=day`` (default; the last ``days`` days, default 30, at most
+    365), zero-filled, oldest bucket first.
+    """
+    permission_classes = [IsAuthenticated]
+    DEFAULT_DAYS = {ListingStat.HOUR: 2, ListingStat.DAY: 30}
+
+    def get(self, request, id):
+        listing = generics.get_object_or_404(Listing.objects.filter(lister=request.user), id=id)
+        granularity = request.query_params.get('granularity', ListingStat.DAY)
+        if granularity not in self.DEFAULT_DAYS:
+            raise ValidationError({'granularity': f'Expected {ListingStat.HOUR} or {ListingStat.DAY}.'})
+        max_days = settings.LISTING_STATS_HOURLY_RETENTION_DAYS if granularity == ListingStat.HOUR else 365
+        try:
+            days = int(request.query_params.get('days', self.DEFAULT_DAYS[granularity]))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= max_days:
+            raise ValidationError({'days': f'Expected a whole number from 1 to {max_days}.'})
+
+        series = analytics.series(listing, granularity, timezone.now() - timedelta(days=days))
+        return Response({
+            'granularity': granularity,
+            'totals': {'views': listing.views, 'favorites': listing.favorites_count},
+            'series': series,
+        })
+
+
 class ListingListView(generics.ListAPIView):
     queryset = Listing.objects.filter(is_active=True).order_by('-created_at')
     permission_classes = [AllowAny]
@@ -119,39 +299,23 @@ class ListingDetailView(generics.RetrieveAPIView):
         obj = super().get_object()
         user = self.request.user
 
-        # Increment view count
-        if not user.is_authenticated or obj.lister != user:
-            obj.views += 1
-            obj.save(update_fields=['views'])
+        # Count the view (written behind, see analytics.py); show it and this process's pending ones
+        if not user.is_authenticated or obj.lister_id != user.id:
+            obj.views += analytics.events.record(obj.id, 'views')
 
         # Calculate compatibility scores if a seeker is viewing
         if user.is_authenticated and user.role == 'Seeker':
-            try:
-                model_path = settings.BASE_DIR / 'roommate_matcher_pipeline.pkl'
-                pipeline = joblib.load(model_path)
-            except FileNotFoundError:
-                pipeline = None
-
-            if pipeline:
+            matcher = get_matcher()
+            if matcher:
                 members_to_score = [obj.lister] + list(obj.current_roommates.all())
-                prediction_data = []
-
-                for member in members_to_score:
-                    prediction_data.append({
-                        **{f"{col}_seeker": getattr(user, col, None) for col in ['role', 'city', 'budget', 'cleanliness', 'noise_level', 'sleep_schedule', 'smoking', 'social_level', 'has_pets', 'gender_preference', 'work_schedule', 'occupation', 'mbti_type']},
-                        **{f"{col}_lister": getattr(member, col, None) for col in ['budget', 'has_pets', 'cleanliness', 'noise_level', 'sleep_schedule', 'smoking', 'social_level', 'gender_preference', 'work_schedule', 'occupation', 'mbti_type']}
-                    })
-
-                if prediction_data:
-                    df_to_predict = pd.DataFrame(prediction_data)
-                    df_to_predict.fillna(0, inplace=True)
-                    try:
-                        scores = pipeline.predict(df_to_predict)
-                        for member, score in zip(members_to_score, scores):
-                            member.compatibility_score = min(99, int(round(score)))
-                    except Exception as e:
-                        # Handle prediction errors gracefully
-                        pass
+                try:
+                    scores = get_scores(user, members_to_score)
+                    for member in members_to_score:
+                        if member.id in scores:
+                            member.compatibility_score = min(99, int(round(scores[member.id])))
+                except Exception as e:
+                    # Handle prediction errors gracefully
+                    pass
         return obj
 
     def get_serializer_context(self):
@@ -171,9 +335,8 @@ class MyListingsView(generics.ListAPIView):
     serializer_class = ListingSerializer
 
     def get_queryset(self):
-        return Listing.objects.filter(lister=self.request.user).annotate(
-            favorites_count=Count('favorited_by')
-        ).order_by('-created_at')
+        # views and favorites_count are stored totals; nothing to count here.
+        return Listing.objects.filter(lister=self.request.user).order_by('-created_at')
 
     def get_serializer_context(self):
         return {'request': self.request}
@@ -142,4 +142,48 @@ CHANNEL_LAYERS = {
     }
 }
 
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
\ No newline at end of file
+STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+
+# Local memory is per process: use a shared cache (Redis, Memcached) once there is more than
+# one worker, or a listing change only invalidates the worker that saved it.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "sharespace",
+    }
+}
+LISTING_CLUSTER_TILE_TTL = 60 * 60  # seconds; bounds staleness from writes that skip signals
+LISTING_FEED_CACHE_TTL = 60  # seconds; also how long a cached feed's view counts can lag
+LISTING_ANALYTICS_FLUSH_INTERVAL = 5  # seconds between write-behind view/favorite event flushes; 0 writes through
+LISTING_STATS_HOURLY_RETENTION_DAYS = 14  # daily buckets are kept
+
+# Django 5.1+ ignores DEFAULT_FILE_STORAGE and STATICFILES_STORAGE above; "default" and
+# "staticfiles" keep the storages actually in effect. Listing photos and avatars are
+# uploaded through "images" by listings/uploads.py.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    "images": {"BACKEND": "cloudinary_storage.storage.MediaCloudinaryStorage"},
+}
+IMAGE_UPLOAD_STAGING_DIR = BASE_DIR / "upload_staging"
+IMAGE_UPLOAD_STAGING_MAX_AGE = 60 * 60  # seconds; older staged files are left over and get swept
+IMAGE_UPLOAD_WORKERS = 4  # concurrent uploads per process, shared by all requests
+IMAGE_UPLOAD_BACKGROUND = True  # False uploads on commit, in the request thread
+
+# Roommate matcher model (see users/ml_utils.py)
+MATCHER_MODEL_PATH = BASE_DIR / "roommate_matcher_pipeline.pkl"
+MATCHER_COMPILED_PATH = BASE_DIR / "roommate_matcher_compiled.npz"  # written by `manage.py compile_matcher`
+# Native-categorical variant: point MATCHER_MODEL_PATH at roommate_matcher_categorical.json to serve it.
+MATCHER_CATEGORIES_PATH = BASE_DIR / "roommate_matcher_categories.json"
+MATCHER_META_PATH = BASE_DIR / "roommate_matcher_meta.pkl"  # column lists and the update_matcher watermark
+MATCHER_ARCHIVE_DIR = BASE_DIR / "matcher_versions"  # <version>.pkl for `score_all --model-version`, written by update_matcher
+MATCHER_RELOAD_INTERVAL = 5  # seconds between artifact mtime checks
+MATCHER_SCORE_MEMO_SIZE = 50_000  # LRU of encoded row -> score per model version; 0 disables
+MATCHER_REFRESH_INLINE_LIMIT = 1000  # pairs re-scored after a profile save; the rest are dropped and re-scored lazily
+
+# Optional scoring sidecar (`manage.py run_matcher`); None scores in-process.
+MATCHER_SIDECAR_SOCKET = None  # e.g. "/run/sharespace/matcher.sock"
+MATCHER_SIDECAR_TIMEOUT = 2.0  # seconds before a request falls back in-process
+MATCHER_SIDECAR_RETRY = 5.0    # seconds to stay on the fallback after a sidecar failure
+MATCHER_BATCH_WINDOW_MS = 2    # how long the sidecar waits to batch concurrent requests
+MATCHER_BATCH_MAX_ROWS = 4096
@@ -0,0 +1,98 @@
+# train_categorical.py
+"""
+Native-categorical variant of the roommate matcher.
+
+Same pairs, labels, split and boosting parameters as train_model.py, but
+instead of a dense one-hot block per categorical column the model sees one
+integer-coded column per feature and learns categorical splits
+(``enable_categorical``). Artifacts:
+
+  roommate_matcher_categorical.json   XGBoost JSON model
+  roommate_matcher_categories.json    {column: [values]}; a value's index is its code
+
+Both are read by users.ml_utils without xgboost (set MATCHER_MODEL_PATH to the
+.json to serve this variant); ``manage.py compare_matchers`` compares it with
+the one-hot pipeline.
+"""
+import json
+
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+
+from users.candidates import BUDGET_TOLERANCE
+from users.ml_utils import file_digest, write_atomic
+from training_pairs import (
+    MODEL_PARAMS, TARGET_COL, candidate_pairs, category_mapping, compatibility_scores,
+    encode_categorical, feature_columns, load_profiles, phase,
+)
+
+DATASET_PATH = "sharespace_profiles.csv"
+MODEL_OUTPUT_PATH = "roommate_matcher_categorical.json"
+MAPPING_OUTPUT_PATH = "roommate_matcher_categories.json"
+
+RANDOM_STATE = 42
+
+
+def dump_json(obj, path):
+    with open(path, "w") as fh:
+        json.dump(obj, fh, indent=1)
+
+
+def main():
+    phases = {}
+    print(f"Loading dataset from '{DATASET_PATH}'...")
+    with phase("load", phases):
+        seekers, listers = load_profiles(DATASET_PATH)
+    with phase("pairs", phases):
+        pairs = candidate_pairs(seekers, listers, BUDGET_TOLERANCE)
+    with phase("label", phases):
+        pairs[TARGET_COL] = compatibility_scores(pairs)
+    print(f"Candidate pairs: {len(pairs):,}")
+
+    feature_cols, numeric_cols, categorical_cols = feature_columns(
+        pairs.columns, lambda c: pd.api.types.is_numeric_dtype(pairs[c])
+    )
+    X = pairs[feature_cols]
+    y = pairs[TARGET_COL].astype(float)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.20, random_state=RANDOM_STATE)
+
+    with phase("encode", phases):
+        categories = category_mapping(X_train, categorical_cols)
+        X_train_enc = encode_categorical(X_train, numeric_cols, categorical_cols, categories)
+        X_test_enc = encode_categorical(X_test, numeric_cols, categorical_cols, categories)
+    print(f"Features -> numeric: {len(numeric_cols)}, categorical: {len(categorical_cols)} "
+          f"({sum(len(v) for v in categories.values())} categories, {X_train_enc.shape[1]} columns)")
+
+    model = xgb.XGBRegressor(
+        **MODEL_PARAMS,
+        tree_method="hist",
+        enable_categorical=True,
+        feature_types=["q"] * len(numeric_cols) + ["c"] * len(categorical_cols),
+        random_state=RANDOM_STATE,
+        n_jobs=-1,
+    )
+    print("Training the native-categorical XGBoost model...")
+    with phase("fit", phases):
+        model.fit(X_train_enc, y_train)
+    with phase("evaluate", phases):
+        y_pred = model.predict(X_test_enc)
+    print(f"\nModel training complete. R^2: {r2_score(y_test, y_pred):.4f} | "
+          f"MAE: {mean_absolute_error(y_test, y_pred):.2f}")
+
+    # Model first, then the mapping stamped with its version: a loader that sees a
+    # new model with the old mapping refuses it instead of mis-encoding.
+    write_atomic(MODEL_OUTPUT_PATH, model.get_booster().save_model)
+    mapping = {
+        "model_version": file_digest(MODEL_OUTPUT_PATH),
+        "numeric_cols": numeric_cols,
+        "categorical_cols": categorical_cols,
+        "categories": categories,
+    }
+    write_atomic(MAPPING_OUTPUT_PATH, lambda p: dump_json(mapping, p))
+    print(f"Saved '{MODEL_OUTPUT_PATH}' ({mapping['model_version']}) and '{MAPPING_OUTPUT_PATH}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# train_external.py
+"""
+Out-of-core variant of train_model.py for user tables too large for an
+in-memory city self-merge.
+
+1. Candidate pairs are generated city by city and appended, labeled, to a
+   Parquet file (one row group per chunk; see training_pairs.write_pair_dataset).
+2. One streaming pass over the file collects every category and a random
+   sample of rows; the preprocessor is fitted on the sample with the full
+   category lists, so the one-hot layout covers the whole dataset.
+3. XGBoost trains from an external-memory DMatrix fed by a DataIter that
+   encodes one row group at a time. Train/validation membership is drawn per
+   row group from a fixed seed, so every pass over the data sees the same split.
+
+The saved artifacts have the same layout as train_model.py's
+(a ``prep`` + ``model`` Pipeline and a meta dict), so compile_matcher and the
+web workers load them unchanged.
+
+    python train_external.py [--pairs training_pairs.parquet] [--rebuild] [--chunk-rows 250000]
+"""
+import argparse
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import xgboost as xgb
+import joblib
+from sklearn.pipeline import Pipeline
+
+from users.candidates import BUDGET_TOLERANCE
+from training_pairs import (
+    MODEL_PARAMS, PAIR_CHUNK_ROWS, TARGET_COL, build_preprocessor, feature_columns, load_profiles,
+    write_pair_dataset,
+)
+
+DATASET_PATH = "sharespace_profiles.csv"
+PAIRS_PATH = "training_pairs.parquet"
+PIPELINE_OUTPUT_PATH = "roommate_matcher_pipeline.pkl"
+META_OUTPUT_PATH = "roommate_matcher_meta.pkl"
+
+RANDOM_STATE = 42
+TEST_SIZE = 0.20
+SAMPLE_ROWS = 200_000   # rows used to fit the imputers
+
+
+class PairBatches(xgb.DataIter):
+    """Feeds one encoded Parquet row group per ``next`` call, train or validation rows only."""
+
+    def __init__(self, path, prep, feature_cols, split, cache_prefix):
+        self._file = pq.ParquetFile(path)
+        self._prep = prep
+        self._feature_cols = feature_cols
+        self._split = split
+        self._group = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        while self._group < self._file.num_row_groups:
+            group = self._group
+            self._group += 1
+            frame = self._file.read_row_group(group).to_pandas()
+            mask = validation_mask(group, len(frame))
+            frame = frame[mask if self._split == "valid" else ~mask]
+            if len(frame):
+                input_data(
+                    data=self._prep.transform(frame[self._feature_cols]).astype(np.float32),
+                    label=frame[TARGET_COL].to_numpy(dtype=np.float32),
+                )
+                return True
+        return False
+
+    def reset(self):
+        self._group = 0
+
+
+def validation_mask(group, n_rows):
+    return np.random.default_rng([RANDOM_STATE, group]).random(n_rows) < TEST_SIZE
+
+
+def scan_dataset(path, categorical_cols, sample_rows):
+    """One pass: sorted categories per column and a uniform row sample."""
+    pairs_file = pq.ParquetFile(path)
+    total = pairs_file.metadata.num_rows
+    fraction = min(1.0, sample_rows / max(total, 1))
+    rng = np.random.default_rng(RANDOM_STATE)
+    categories = {c: set() for c in categorical_cols}
+    samples = []
+    for group in range(pairs_file.num_row_groups):
+        frame = pairs_file.read_row_group(group).to_pandas()
+        for c in categorical_cols:
+            categories[c].update(frame[c].dropna().unique())
+        samples.append(frame[rng.random(len(frame)) < fraction])
+    return [sorted(categories[c]) for c in categorical_cols], pd.concat(samples, ignore_index=True), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--pairs", default=PAIRS_PATH, help="Parquet pair dataset (built if missing).")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the pair dataset even if it exists.")
+    parser.add_argument("--chunk-rows", type=int, default=PAIR_CHUNK_ROWS)
+    parser.add_argument("--cache-dir", default=None, help="Where XGBoost pages its external-memory cache.")
+    parser.add_argument("--sample-rows", type=int, default=SAMPLE_ROWS)
+    args = parser.parse_args()
+
+    if args.rebuild or not os.path.exists(args.pairs):
+        print(f"Building candidate pairs from '{args.dataset}' -> '{args.pairs}'...")
+        start = time.perf_counter()
+        seekers, listers = load_profiles(args.dataset)
+        n_pairs = write_pair_dataset(seekers, listers, args.pairs, chunk_rows=args.chunk_rows)
+        print(f"Wrote {n_pairs:,} pairs in {time.perf_counter() - start:.1f}s")
+
+    schema = pq.read_schema(args.pairs)
+    numeric_types = {name for name in schema.names
+                     if pd.api.types.is_numeric_dtype(schema.field(name).type.to_pandas_dtype())}
+    feature_cols, numeric_cols, categorical_cols = feature_columns(schema.names, lambda c: c in numeric_types)
+    print(f"Features -> numeric: {len(numeric_cols)}, categorical: {len(categorical_cols)}")
+
+    print("Scanning pairs for categories and an imputer sample...")
+    categories, sample, n_pairs = scan_dataset(args.pairs, categorical_cols, args.sample_rows)
+    prep = build_preprocessor(numeric_cols, categorical_cols, categories=categories)
+    prep.fit(sample[feature_cols])
+    print(f"{n_pairs:,} pairs; preprocessor fitted on {len(sample):,} sampled rows")
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="xgb-extmem-")
+    try:
+        print("Training XGBoost from external memory...")
+        start = time.perf_counter()
+        train_iter = PairBatches(args.pairs, prep, feature_cols, "train", os.path.join(cache_dir, "train"))
+        valid_iter = PairBatches(args.pairs, prep, feature_cols, "valid", os.path.join(cache_dir, "valid"))
+        dtrain = xgb.ExtMemQuantileDMatrix(train_iter)
+        dvalid = xgb.ExtMemQuantileDMatrix(valid_iter, ref=dtrain)
+
+        params = {k: v for k, v in MODEL_PARAMS.items() if k != "n_estimators"}
+        params.update(tree_method="hist", seed=RANDOM_STATE, eval_metric=["rmse", "mae"])
+        evals_result = {}
+        booster = xgb.train(
+            params, dtrain, num_boost_round=MODEL_PARAMS["n_estimators"],
+            evals=[(dvalid, "valid")], evals_result=evals_result, verbose_eval=50,
+        )
+        print(f"Trained in {time.perf_counter() - start:.1f}s")
+
+        # R^2 over the validation rows, accumulated batch by batch
+        sse = sst_sum = sst_sq = n = 0.0
+        valid_iter.reset()
+        pairs_file = pq.ParquetFile(args.pairs)
+        for group in range(pairs_file.num_row_groups):
+            frame = pairs_file.read_row_group(group).to_pandas()
+            frame = frame[validation_mask(group, len(frame))]
+            if not len(frame):
+                continue
+            y = frame[TARGET_COL].to_numpy(dtype=float)
+            pred = booster.inplace_predict(prep.transform(frame[feature_cols]).astype(np.float32))
+            sse += float(((y - pred) ** 2).sum())
+            sst_sum += float(y.sum())
+            sst_sq += float((y ** 2).sum())
+            n += len(y)
+        r2 = 1.0 - sse / (sst_sq - sst_sum ** 2 / n) if n else float("nan")
+        mae = evals_result["valid"]["mae"][-1]
+        print(f"\nModel training complete. R^2: {r2:.4f} | MAE: {mae:.2f}")
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # Same artifact layout as train_model.py: sklearn wrapper around the trained booster
+    model = xgb.XGBRegressor(**MODEL_PARAMS, random_state=RANDOM_STATE)
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    pipe = Pipeline(steps=[("prep", prep), ("model", model)])
+
+    print(f"\nSaving full pipeline to '{PIPELINE_OUTPUT_PATH}'...")
+    joblib.dump(pipe, PIPELINE_OUTPUT_PATH)
+    meta = {
+        "feature_cols": feature_cols,
+        "numeric_cols": numeric_cols,
+        "categorical_cols": categorical_cols,
+        "random_state": RANDOM_STATE,
+        "budget_tolerance": BUDGET_TOLERANCE,
+        "n_pairs": n_pairs,
+        "external_memory": True,
+    }
+    with open(META_OUTPUT_PATH, "wb") as f:
+        pickle.dump(meta, f)
+    print("Artifacts saved.")
+
+
+if __name__ == "__main__":
+    main()
@@ -113,23 +113,27 @@
 
 
 # train_model.py
+import argparse
 import os
 import math
 import pickle
 import random
-from typing import List
 
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split, KFold, cross_val_score
-from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import OneHotEncoder
 from sklearn.metrics import r2_score, mean_absolute_error
 import xgboost as xgb
 import joblib
 
+# Same blocking rule the API uses before scoring (see users/candidates.py)
+from users.candidates import BUDGET_TOLERANCE, budget_overlap_mask, normalize_city
+from training_pairs import (
+    MODEL_PARAMS, TARGET_COL, build_preprocessor, candidate_pairs, compatibility_scores,
+    feature_columns, load_profiles, phase,
+)
+
 # -----------------------------
 # Config
 # -----------------------------
@@ -139,146 +143,91 @@ META_OUTPUT_PATH = "roommate_matcher_meta.pkl"           # saves column lists &
 TOPN_SAMPLE_OUTPUT = "sample_top_matches.csv"
 
 RANDOM_STATE = 42
-MAX_PAIRS = 200_000   # safety cap for training size; tweak based on your RAM/CPU
-BUDGET_TOLERANCE = 0.35  # allow ~35% mismatch before hard-filtering a candidate
 PRINT_TOP_FEATURES = 30
+CV_FOLDS = 5
+CV_ROWS = 200_000       # native mode cross-validates on a sample this size
+ENCODE_ROWS = 100_000   # native mode encodes this many rows at a time
+EARLY_STOPPING_ROUNDS = 25
 
 random.seed(RANDOM_STATE)
 np.random.seed(RANDOM_STATE)
 
+parser = argparse.ArgumentParser(
+    description="Train the roommate matcher pipeline. For pair tables too large to hold in memory "
+                "even as raw columns, use train_external.py."
+)
+parser.add_argument(
+    "--mode", choices=["native", "sklearn"], default="native",
+    help="native: encode in chunks into a QuantileDMatrix, xgb.cv on a sample with early stopping, "
+         "one final fit on every training row (default). "
+         "sklearn: cross_val_score over the whole pipeline, refitting the encoders in every fold; "
+         "holds several dense copies of the data, so only for small datasets."
+)
+parser.add_argument("--early-stopping-rounds", type=int, default=EARLY_STOPPING_ROUNDS)
+parser.add_argument("--cv-rows", type=int, default=CV_ROWS,
+                    help="native: cross-validate on at most this many training rows.")
+parser.add_argument("--encode-rows", type=int, default=ENCODE_ROWS,
+                    help="native: rows encoded per batch while building the training matrix.")
+args = parser.parse_args()
+
+PHASES = {}  # phase -> wall time / peak memory, printed at the end and stored in the meta
+
+
+def encode(prep, frame):
+    return prep.transform(frame).astype(np.float32)
 
-# -----------------------------
-# Utility: validations
-# -----------------------------
-REQUIRED_COLUMNS = [
-    # identifiers & role
-    "user_id", "role",
-    # location
-    "city",
-    # budgets (int)
-    "budget",
-    # core numerics (scale 1..5 or 1..3 etc.)
-    "cleanliness", "noise_level",
-    # categoricals (string/enums)
-    "sleep_schedule", "smoking", "social_level",
-    # booleans
-    "has_pets",
-    # optional but helpful
-    "gender_preference", "work_schedule", "occupation", "mbti_type"
-]
-
-def ensure_columns(df: pd.DataFrame, cols: List[str]):
-    missing = [c for c in cols if c not in df.columns]
-    if missing:
-        raise ValueError(f"Missing required columns in CSV: {missing}")
+
+class EncodedBatches(xgb.DataIter):
+    """Feeds ``frame`` to a QuantileDMatrix ``rows`` at a time, encoded by ``prep``."""
+
+    def __init__(self, prep, frame, label, rows):
+        self._prep = prep
+        self._frame = frame
+        self._label = label.to_numpy(dtype=np.float32)
+        self._rows = rows
+        self._start = 0
+        super().__init__()
+
+    def next(self, input_data):
+        if self._start >= len(self._frame):
+            return False
+        end = self._start + self._rows
+        input_data(data=encode(self._prep, self._frame.iloc[self._start:end]), label=self._label[self._start:end])
+        self._start = end
+        return True
+
+    def reset(self):
+        self._start = 0
 
 
 # -----------------------------
 # Load
 # -----------------------------
 print(f"Loading dataset from '{DATASET_PATH}'...")
-df = pd.read_csv(DATASET_PATH)
-ensure_columns(df, REQUIRED_COLUMNS)
-
-# Basic type hygiene
-if df["has_pets"].dtype != np.int64 and df["has_pets"].dtype != np.int32 and df["has_pets"].dtype != np.int8:
-    # accept True/False or 'yes'/'no'
-    df["has_pets"] = df["has_pets"].map({True: 1, False: 0, "yes": 1, "no": 0, "Yes": 1, "No": 0}).fillna(df["has_pets"])
-    df["has_pets"] = df["has_pets"].astype("float").round().astype(int)
-
-# Keep only needed columns to avoid accidental leakage
-df = df[[c for c in REQUIRED_COLUMNS if c in df.columns]].copy()
-
-# Split roles
-seekers = df[df["role"].str.lower() == "seeker"].copy().reset_index(drop=True)
-listers = df[df["role"].str.lower() == "lister"].copy().reset_index(drop=True)
+with phase("load", PHASES):
+    seekers, listers = load_profiles(DATASET_PATH)
 
 if seekers.empty or listers.empty:
     raise ValueError("Need at least one Seeker and one Lister row to build pairs.")
 
 # -----------------------------
-# Candidate pairing (efficient)
+# Candidate pairing (columnar)
 #   - Same city
 #   - Budget overlap / tolerance
-#   - Sample if too large
+#   - Every candidate pair is kept; no sampling
 # -----------------------------
-def budget_overlap_ok(b1, b2, tol=BUDGET_TOLERANCE):
-    # Accept if budgets within tol proportion (e.g., 35%) or min/max cross each other
-    if pd.isna(b1) or pd.isna(b2):
-        return True
-    b1 = float(b1); b2 = float(b2)
-    denom = max(1.0, (b1 + b2) / 2.0)
-    return abs(b1 - b2) / denom <= tol
-
 print("Building candidate pairs (same city + budget tolerance)...")
-seekers_small = seekers.rename(columns={c: f"{c}_seeker" for c in seekers.columns})
-listers_small = listers.rename(columns={c: f"{c}_lister" for c in listers.columns})
-
-# Fast filter: inner join on city to avoid full cartesian
-seekers_small["key_city"] = seekers_small["city_seeker"].fillna("__NA__").astype(str).str.strip().str.lower()
-listers_small["key_city"] = listers_small["city_lister"].fillna("__NA__").astype(str).str.strip().str.lower()
-
-pairs = seekers_small.merge(
-    listers_small[["user_id_lister", "budget_lister", "has_pets_lister", "cleanliness_lister",
-                   "noise_level_lister", "sleep_schedule_lister", "smoking_lister",
-                   "social_level_lister", "gender_preference_lister", "work_schedule_lister",
-                   "occupation_lister", "mbti_type_lister", "key_city"]],
-    on="key_city",
-    how="inner",
-    suffixes=("_seeker", "_lister")
-)
-
-# Apply budget overlap filter
-pairs = pairs[pairs.apply(lambda r: budget_overlap_ok(r["budget_seeker"], r["budget_lister"], BUDGET_TOLERANCE), axis=1)]
-
-# If too large, sample down deterministically
-if len(pairs) > MAX_PAIRS:
-    pairs = pairs.sample(n=MAX_PAIRS, random_state=RANDOM_STATE).reset_index(drop=True)
-
+with phase("pairs", PHASES):
+    pairs = candidate_pairs(seekers, listers, BUDGET_TOLERANCE)
 print(f"Candidate pairs: {len(pairs):,}")
 
 # -----------------------------
 # Target: rule-based compatibility on RAW cols
+#   (training_pairs.calculate_compatibility_score, vectorized)
 # -----------------------------
-def calculate_compatibility_score(row):
-    score = 100.0
-
-    # Numeric distances (assume scales 1..5)
-    if not pd.isna(row["cleanliness_seeker"]) and not pd.isna(row["cleanliness_lister"]):
-        score -= abs(float(row["cleanliness_seeker"]) - float(row["cleanliness_lister"])) * 5.0
-
-    if not pd.isna(row["noise_level_seeker"]) and not pd.isna(row["noise_level_lister"]):
-        score -= abs(float(row["noise_level_seeker"]) - float(row["noise_level_lister"])) * 5.0
-
-    # Categorical alignment
-    if pd.notna(row["sleep_schedule_seeker"]) and pd.notna(row["sleep_schedule_lister"]):
-        if str(row["sleep_schedule_seeker"]).strip().lower() != str(row["sleep_schedule_lister"]).strip().lower():
-            score -= 15.0
-
-    if pd.notna(row["smoking_seeker"]) and pd.notna(row["smoking_lister"]):
-        if str(row["smoking_seeker"]).strip().lower() != str(row["smoking_lister"]).strip().lower():
-            score -= 20.0  # bigger penalty
-
-    if pd.notna(row["social_level_seeker"]) and pd.notna(row["social_level_lister"]):
-        if str(row["social_level_seeker"]).strip().lower() == str(row["social_level_lister"]).strip().lower():
-            score += 10.0
-
-    # Budget difference penalty (~₹ or $ agnostic)
-    if pd.notna(row["budget_seeker"]) and pd.notna(row["budget_lister"]):
-        budget_diff = abs(float(row["budget_seeker"]) - float(row["budget_lister"]))
-        score -= (budget_diff / 500.0) * 10.0  # tune later
-
-    # Pets hard rule (optional; comment if not needed)
-    # If lister disallows pets but seeker has pets, drop score
-    # You could carry a lister.allows_pets field; here we only compare ownership.
-    # If you want strict rule, uncomment below:
-    # if row.get("has_pets_seeker", 0) == 1 and row.get("has_pets_lister", 0) == 0:
-    #     score -= 10.0
-
-    return max(0.0, min(100.0, score))
-
 print("Computing compatibility scores...")
-pairs["compatibility_score"] = pairs.apply(calculate_compatibility_score, axis=1)
+with phase("label", PHASES):
+    pairs[TARGET_COL] = compatibility_scores(pairs)
 
 # Drop helper key
 pairs = pairs.drop(columns=["key_city"])
@@ -287,42 +236,17 @@ pairs = pairs.drop(columns=["key_city"])
 # Preprocess (impute + one-hot)
 #   - Build list of model features
 # -----------------------------
-TARGET_COL = "compatibility_score"
-
-# Columns that belong to a pair (exclude IDs and obvious non-features)
-exclude_cols_prefixes = ["user_id_"]
-exclude_cols = [c for c in pairs.columns if any(c.startswith(p) for p in exclude_cols_prefixes)]
-feature_cols = [c for c in pairs.columns if c not in exclude_cols + [TARGET_COL]]
-
-# Separate numeric / categorical
-numeric_cols = []
-categorical_cols = []
-for c in feature_cols:
-    if pd.api.types.is_numeric_dtype(pairs[c]):
-        numeric_cols.append(c)
-    else:
-        categorical_cols.append(c)
+# Columns that belong to a pair (exclude IDs and obvious non-features); numeric vs categorical by dtype
+feature_cols, numeric_cols, categorical_cols = feature_columns(
+    pairs.columns, lambda c: pd.api.types.is_numeric_dtype(pairs[c])
+)
 
 print(f"Features -> numeric: {len(numeric_cols)}, categorical: {len(categorical_cols)}")
 
-preprocessor = ColumnTransformer(
-    transformers=[
-        ("num", SimpleImputer(strategy="median"), numeric_cols),
-        ("cat", Pipeline(steps=[
-            ("imputer", SimpleImputer(strategy="most_frequent")),
-            ("ohe", OneHotEncoder(handle_unknown="ignore", sparse_output=False))
-        ]), categorical_cols),
-    ],
-    remainder="drop"
-)
+preprocessor = build_preprocessor(numeric_cols, categorical_cols)
 
 model = xgb.XGBRegressor(
-    objective="reg:squarederror",
-    n_estimators=400,
-    learning_rate=0.05,
-    max_depth=6,
-    subsample=0.85,
-    colsample_bytree=0.85,
+    **MODEL_PARAMS,
     random_state=RANDOM_STATE,
     n_jobs=-1
 )
@@ -339,25 +263,75 @@ X_train, X_test, y_train, y_test = train_test_split(
     X, y, test_size=0.20, random_state=RANDOM_STATE
 )
 
-print("Training the XGBoost pipeline...")
-pipe.fit(X_train, y_train)
+if args.mode == "native":
+    # The encoded matrix is never held in full: rows are encoded ENCODE_ROWS at a time into a
+    # QuantileDMatrix, which keeps only their histogram bin indices (one byte per value). Fitting
+    # the ColumnTransformer transforms everything it is fitted on, so it is fitted on a sample,
+    # with the full category lists (as train_external.py does); CV runs on the same sample, since
+    # xgb.cv keeps a copy of its DMatrix per fold.
+    cv_rows = min(args.cv_rows, len(X_train))
+    cv_sample = np.sort(np.random.default_rng(RANDOM_STATE).choice(len(X_train), cv_rows, replace=False))
+    print(f"Encoding features in batches of {args.encode_rows:,} rows...")
+    with phase("encode", PHASES):
+        preprocessor.set_params(cat__ohe__categories=[sorted(X_train[c].dropna().unique()) for c in categorical_cols])
+        preprocessor.fit(X_train.iloc[cv_sample])
+        dtrain = xgb.QuantileDMatrix(EncodedBatches(preprocessor, X_train, y_train, args.encode_rows))
+
+    print(f"Running {CV_FOLDS}-fold xgb.cv on {cv_rows:,} sampled rows "
+          f"(hist, early stopping after {args.early_stopping_rounds} rounds)...")
+    with phase("cv", PHASES):
+        cv_params = {k: v for k, v in MODEL_PARAMS.items() if k != "n_estimators"}
+        cv_params.update(tree_method="hist", seed=RANDOM_STATE)
+        cv_results = xgb.cv(
+            cv_params,
+            xgb.DMatrix(encode(preprocessor, X_train.iloc[cv_sample]), label=y_train.iloc[cv_sample].to_numpy()),
+            num_boost_round=MODEL_PARAMS["n_estimators"],
+            nfold=CV_FOLDS,
+            metrics="rmse",
+            early_stopping_rounds=args.early_stopping_rounds,
+            seed=RANDOM_STATE,
+        )
+    best_rounds = len(cv_results)
+    cv_rmse = cv_results["test-rmse-mean"].iloc[-1]
+    cv_r2 = 1.0 - cv_rmse ** 2 / float(np.var(y_train.iloc[cv_sample]))
+    print(f"CV: {best_rounds} rounds | RMSE mean={cv_rmse:.4f} std={cv_results['test-rmse-std'].iloc[-1]:.4f} "
+          f"| R^2 ~ {cv_r2:.4f}")
+
+    print("Training the XGBoost model on every training row...")
+    with phase("fit", PHASES):
+        booster = xgb.train(cv_params, dtrain, num_boost_round=best_rounds)
+        del dtrain
+        # Same artifact layout as before: the sklearn wrapper around the trained booster.
+        model.set_params(n_estimators=best_rounds, tree_method="hist")
+        model.load_model(bytearray(booster.save_raw("ubj")))
+    with phase("evaluate", PHASES):
+        y_pred = np.concatenate([
+            model.predict(encode(preprocessor, X_test.iloc[start:start + args.encode_rows]))
+            for start in range(0, len(X_test), args.encode_rows)
+        ])
+else:
+    print("Training the XGBoost pipeline...")
+    with phase("fit", PHASES):
+        pipe.fit(X_train, y_train)
+    with phase("evaluate", PHASES):
+        y_pred = pipe.predict(X_test)
 
-y_pred = pipe.predict(X_test)
 r2 = r2_score(y_test, y_pred)
 mae = mean_absolute_error(y_test, y_pred)
 print(f"\nModel training complete. R^2: {r2:.4f} | MAE: {mae:.2f}")
 
-# 5-fold CV (quick sanity check)
-print("Running 5-fold CV R^2 (this may take a bit)...")
-cv = KFold(n_splits=5, shuffle=True, random_state=RANDOM_STATE)
-cv_scores = cross_val_score(pipe, X, y, scoring="r2", cv=cv, n_jobs=-1)
-print(f"CV R^2: mean={cv_scores.mean():.4f} | std={cv_scores.std():.4f}")
+if args.mode == "sklearn":
+    # 5-fold CV (quick sanity check)
+    print("Running 5-fold CV R^2 (this may take a bit)...")
+    with phase("cv", PHASES):
+        cv = KFold(n_splits=CV_FOLDS, shuffle=True, random_state=RANDOM_STATE)
+        cv_scores = cross_val_score(pipe, X, y, scoring="r2", cv=cv, n_jobs=-1)
+    print(f"CV R^2: mean={cv_scores.mean():.4f} | std={cv_scores.std():.4f}")
 
 # -----------------------------
-# Inspect top features (approx)
+# Inspect top features
 # -----------------------------
-# To get feature names after OHE, fit a tiny copy and fetch names
-pipe.fit(X_train[:200], y_train[:200])  # small fit for names only
+# Names come from the encoders fitted above (pipe holds the same objects).
 prep = pipe.named_steps["prep"]
 model_fitted = pipe.named_steps["model"]
 
@@ -389,7 +363,10 @@ meta = {
     "categorical_cols": categorical_cols,
     "random_state": RANDOM_STATE,
     "budget_tolerance": BUDGET_TOLERANCE,
-    "max_pairs": MAX_PAIRS
+    "n_pairs": len(pairs),
+    "training_mode": args.mode,
+    "n_estimators": int(model_fitted.get_params()["n_estimators"]),
+    "phases": PHASES,
 }
 with open(META_OUTPUT_PATH, "wb") as f:
     pickle.dump(meta, f)
@@ -406,9 +383,9 @@ def recommend_top_n_for_seeker(sample_seeker: pd.Series, listers_df: pd.DataFram
 
     cand = listers_df.copy()
     cand = cand.rename(columns={c: f"{c}_lister" for c in cand.columns})
-    cand["key_city"] = cand["city_lister"].fillna("__NA__").astype(str).str.strip().str.lower()
+    cand["key_city"] = cand["city_lister"].map(normalize_city)
 
-    key_city = str(sample_seeker["city"]).strip().lower() if pd.notna(sample_seeker["city"]) else "__NA__"
+    key_city = normalize_city(sample_seeker["city"])
     cand = cand[cand["key_city"] == key_city].drop(columns=["key_city"], errors="ignore")
 
     if cand.empty:
@@ -419,7 +396,7 @@ def recommend_top_n_for_seeker(sample_seeker: pd.Series, listers_df: pd.DataFram
     pairs_local = s_df.assign(key=1).merge(cand.assign(key=1), on="key").drop(columns=["key"])
 
     # filter budgets
-    pairs_local = pairs_local[pairs_local.apply(lambda r: budget_overlap_ok(r["budget_seeker"], r["budget_lister"], BUDGET_TOLERANCE), axis=1)]
+    pairs_local = pairs_local[budget_overlap_mask(pairs_local["budget_seeker"], pairs_local["budget_lister"], BUDGET_TOLERANCE)]
     if pairs_local.empty:
         return pd.DataFrame(columns=["user_id_lister", "predicted_score"])
 
@@ -442,4 +419,8 @@ try:
 except Exception as e:
     print(f"(Non-fatal) Could not generate sample Top-N CSV: {e}")
 
+print("\nPhase          seconds   peak traced MB   max RSS MB")
+for name, stats in PHASES.items():
+    print(f"{name:<12}{stats['seconds']:>10.1f}{stats['peak_traced_mb']:>17,.0f}{stats['max_rss_mb']:>13,.0f}")
+
 print("\n✅ Successfully trained and saved the upgraded model & pipeline!")
@@ -0,0 +1,391 @@
+# training_pairs.py
+"""
+Training data for the roommate matcher: load profiles, build candidate
+(seeker, lister) pairs and label them with the rule-based compatibility score.
+
+Pairs are generated city by city from budget-sorted listers, so memory is
+bounded by the chunk size rather than by the same-city cross product;
+``write_pair_dataset`` streams them to a Parquet file for out-of-core
+training (train_external.py). Everything here is columnar. The original row-wise label function is kept as
+``calculate_compatibility_score`` because it is the definition the vectorized
+``compatibility_scores`` has to reproduce (see benchmark_labels.py).
+"""
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from users.candidates import BUDGET_TOLERANCE, budget_bounds, budget_overlap_mask, normalize_city
+
+REQUIRED_COLUMNS = [
+    # identifiers & role
+    "user_id", "role",
+    # location
+    "city",
+    # budgets (int)
+    "budget",
+    # core numerics (scale 1..5 or 1..3 etc.)
+    "cleanliness", "noise_level",
+    # categoricals (string/enums)
+    "sleep_schedule", "smoking", "social_level",
+    # booleans
+    "has_pets",
+    # optional but helpful
+    "gender_preference", "work_schedule", "occupation", "mbti_type"
+]
+
+TARGET_COL = "compatibility_score"
+PAIR_CHUNK_ROWS = 250_000
+
+# Model config shared by train_model.py and train_external.py
+MODEL_PARAMS = {
+    "objective": "reg:squarederror",
+    "n_estimators": 400,
+    "learning_rate": 0.05,
+    "max_depth": 6,
+    "subsample": 0.85,
+    "colsample_bytree": 0.85,
+}
+
+LISTER_PAIR_COLUMNS = [
+    "user_id_lister", "budget_lister", "has_pets_lister", "cleanliness_lister",
+    "noise_level_lister", "sleep_schedule_lister", "smoking_lister",
+    "social_level_lister", "gender_preference_lister", "work_schedule_lister",
+    "occupation_lister", "mbti_type_lister", "key_city",
+]
+
+
+def ensure_columns(df: pd.DataFrame, cols: List[str]):
+    missing = [c for c in cols if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns in CSV: {missing}")
+
+
+def load_profiles(path):
+    """
+    Read the profiles CSV (or a Parquet file/directory from ``manage.py
+    export_profiles``) and split it into (seekers, listers) frames. A user
+    exported more than once keeps their latest row.
+    """
+    path = str(path)
+    df = pd.read_parquet(path) if path.endswith(".parquet") or os.path.isdir(path) else pd.read_csv(path)
+    ensure_columns(df, REQUIRED_COLUMNS)
+    df = df.drop_duplicates("user_id", keep="last")
+
+    # Basic type hygiene
+    if df["has_pets"].dtype != np.int64 and df["has_pets"].dtype != np.int32 and df["has_pets"].dtype != np.int8:
+        # accept True/False or 'yes'/'no'
+        df["has_pets"] = df["has_pets"].map({True: 1, False: 0, "yes": 1, "no": 0, "Yes": 1, "No": 0}).fillna(df["has_pets"])
+        df["has_pets"] = df["has_pets"].astype("float").round().astype(int)
+
+    # Keep only needed columns to avoid accidental leakage
+    df = df[[c for c in REQUIRED_COLUMNS if c in df.columns]].copy()
+    return split_roles(df)
+
+
+def split_roles(df: pd.DataFrame):
+    seekers = df[df["role"].str.lower() == "seeker"].copy().reset_index(drop=True)
+    listers = df[df["role"].str.lower() == "lister"].copy().reset_index(drop=True)
+    return seekers, listers
+
+
+def profiles_frame(rows):
+    """
+    Profiles in the CSV layout from ``CustomUser.objects.values("id", *REQUIRED_COLUMNS[1:])``
+    rows: ``user_id`` is the UUID as a string and ``has_pets`` is 0/1.
+    """
+    df = pd.DataFrame.from_records(list(rows), columns=["id"] + REQUIRED_COLUMNS[1:])
+    df.insert(0, "user_id", df.pop("id").astype(str))
+    df["has_pets"] = df["has_pets"].astype(int)
+    return df
+
+
+def pair_frames(seekers: pd.DataFrame, listers: pd.DataFrame):
+    """Suffix the profile columns and add the normalized ``key_city`` join key."""
+    seekers_small = seekers.rename(columns={c: f"{c}_seeker" for c in seekers.columns})
+    listers_small = listers.rename(columns={c: f"{c}_lister" for c in listers.columns})
+    seekers_small["key_city"] = seekers_small["city_seeker"].map(normalize_city)
+    listers_small["key_city"] = listers_small["city_lister"].map(normalize_city)
+    return seekers_small, listers_small[LISTER_PAIR_COLUMNS]
+
+
+def _candidate_ranges(seeker_budgets, lister_budgets, tol):
+    """
+    Per seeker, the slice ``[start, stop)`` of budget-sorted listers that can
+    pass the budget rule. Bounds are conservative; the exact check comes after.
+    Seekers without a budget get every lister with one.
+    """
+    start = np.zeros(len(seeker_budgets), dtype=np.int64)
+    stop = np.full(len(seeker_budgets), len(lister_budgets), dtype=np.int64)
+    known = ~np.isnan(seeker_budgets)
+    if known.any():
+        low, high = zip(*(budget_bounds(b, tol) for b in seeker_budgets[known]))
+        start[known] = np.searchsorted(lister_budgets, low, side="left")
+        stop[known] = np.searchsorted(lister_budgets, high, side="right")
+    return start, stop
+
+
+def iter_candidate_pairs(seekers: pd.DataFrame, listers: pd.DataFrame, chunk_rows=PAIR_CHUNK_ROWS,
+                         tol=BUDGET_TOLERANCE):
+    """
+    Yield the candidate pairs of ``candidate_pairs`` as frames of roughly
+    ``chunk_rows`` rows (a single seeker's candidates are never split), one
+    city at a time. Only pairs inside a seeker's budget window are ever built.
+    """
+    seekers_small, listers_small = pair_frames(seekers, listers)
+    lister_cols = [c for c in listers_small.columns if c != "key_city"]
+    lister_groups = dict(tuple(listers_small.groupby("key_city", sort=True)))
+
+    for city, city_seekers in seekers_small.groupby("key_city", sort=True):
+        city_listers = lister_groups.get(city)
+        if city_listers is None:
+            continue
+        city_listers = city_listers.sort_values("budget_lister", kind="stable", na_position="last")
+        lister_budgets = city_listers["budget_lister"].to_numpy(dtype=float)
+        n_known = int((~np.isnan(lister_budgets)).sum())
+        no_budget = np.arange(n_known, len(city_listers))  # always candidates
+
+        seeker_budgets = city_seekers["budget_seeker"].to_numpy(dtype=float)
+        start, stop = _candidate_ranges(seeker_budgets, lister_budgets[:n_known], tol)
+        counts = stop - start + len(no_budget)
+
+        # Cut the city's seekers wherever the running pair count passes chunk_rows.
+        bounds = np.searchsorted(np.cumsum(counts), np.arange(chunk_rows, counts.sum(), chunk_rows), side="left") + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(city_seekers)]):
+            if lo >= hi:
+                continue
+            ranged = stop[lo:hi] - start[lo:hi]
+            seeker_idx = np.repeat(np.arange(lo, hi), ranged)
+            # start[i], start[i] + 1, ..., stop[i] - 1 for each seeker i, flattened
+            lister_idx = np.arange(ranged.sum()) - np.repeat(np.cumsum(ranged) - ranged, ranged) \
+                + np.repeat(start[lo:hi], ranged)
+            if len(no_budget):
+                seeker_idx = np.r_[seeker_idx, np.repeat(np.arange(lo, hi), len(no_budget))]
+                lister_idx = np.r_[lister_idx, np.tile(no_budget, hi - lo)]
+            if not len(seeker_idx):
+                continue
+
+            keep = budget_overlap_mask(seeker_budgets[seeker_idx], lister_budgets[lister_idx], tol)
+            seeker_idx, lister_idx = seeker_idx[keep], lister_idx[keep]
+            if not len(seeker_idx):
+                continue
+            yield pd.concat([
+                city_seekers.iloc[seeker_idx].reset_index(drop=True),
+                city_listers[lister_cols].iloc[lister_idx].reset_index(drop=True),
+            ], axis=1)
+
+
+def candidate_pairs(seekers: pd.DataFrame, listers: pd.DataFrame, tol=BUDGET_TOLERANCE):
+    """Every (seeker, lister) pair in the same city whose budgets pass the blocking rule."""
+    chunks = list(iter_candidate_pairs(seekers, listers, tol=tol))
+    if not chunks:
+        seekers_small, listers_small = pair_frames(seekers, listers)
+        return seekers_small.merge(listers_small, on="key_city").iloc[:0]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _arrow_schema(frame: pd.DataFrame):
+    import pyarrow as pa
+
+    # Object columns are written as strings even when a chunk happens to be all-null.
+    return pa.schema([
+        pa.field(name, pa.string() if dtype == object else pa.from_numpy_dtype(dtype))
+        for name, dtype in frame.dtypes.items()
+    ])
+
+
+def write_pair_dataset(seekers: pd.DataFrame, listers: pd.DataFrame, path, chunk_rows=PAIR_CHUNK_ROWS,
+                       tol=BUDGET_TOLERANCE):
+    """
+    Label every candidate pair and append it to a Parquet file at ``path``, one
+    row group per chunk, without holding more than one chunk in memory.
+    Returns the number of pairs written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer, schema, total = None, None, 0
+    tmp_path = f"{path}.tmp"
+    try:
+        for chunk in iter_candidate_pairs(seekers, listers, chunk_rows=chunk_rows, tol=tol):
+            chunk[TARGET_COL] = compatibility_scores(chunk)
+            chunk = chunk.drop(columns=["key_city"])
+            if writer is None:
+                schema = _arrow_schema(chunk)
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            total += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("No candidate pairs: need at least one Seeker and one Lister in the same city.")
+    os.replace(tmp_path, path)
+    return total
+
+
+# -----------------------------
+# Target: rule-based compatibility on RAW cols
+# -----------------------------
+def calculate_compatibility_score(row):
+    score = 100.0
+
+    # Numeric distances (assume scales 1..5)
+    if not pd.isna(row["cleanliness_seeker"]) and not pd.isna(row["cleanliness_lister"]):
+        score -= abs(float(row["cleanliness_seeker"]) - float(row["cleanliness_lister"])) * 5.0
+
+    if not pd.isna(row["noise_level_seeker"]) and not pd.isna(row["noise_level_lister"]):
+        score -= abs(float(row["noise_level_seeker"]) - float(row["noise_level_lister"])) * 5.0
+
+    # Categorical alignment
+    if pd.notna(row["sleep_schedule_seeker"]) and pd.notna(row["sleep_schedule_lister"]):
+        if str(row["sleep_schedule_seeker"]).strip().lower() != str(row["sleep_schedule_lister"]).strip().lower():
+            score -= 15.0
+
+    if pd.notna(row["smoking_seeker"]) and pd.notna(row["smoking_lister"]):
+        if str(row["smoking_seeker"]).strip().lower() != str(row["smoking_lister"]).strip().lower():
+            score -= 20.0  # bigger penalty
+
+    if pd.notna(row["social_level_seeker"]) and pd.notna(row["social_level_lister"]):
+        if str(row["social_level_seeker"]).strip().lower() == str(row["social_level_lister"]).strip().lower():
+            score += 10.0
+
+    # Budget difference penalty (~₹ or $ agnostic)
+    if pd.notna(row["budget_seeker"]) and pd.notna(row["budget_lister"]):
+        budget_diff = abs(float(row["budget_seeker"]) - float(row["budget_lister"]))
+        score -= (budget_diff / 500.0) * 10.0  # tune later
+
+    return max(0.0, min(100.0, score))
+
+
+def _numeric_penalty(pairs, col, weight):
+    a = pairs[f"{col}_seeker"].to_numpy(dtype=float)
+    b = pairs[f"{col}_lister"].to_numpy(dtype=float)
+    # NaN on either side skips the term; x - 0.0 == x, so this stays bit-exact.
+    return np.where(np.isnan(a) | np.isnan(b), 0.0, np.abs(a - b) * weight)
+
+
+def _normalized_codes(values: pd.Series, vocabulary: dict) -> np.ndarray:
+    """Integer id of ``str(v).strip().lower()`` per row (-1 for missing), normalizing each distinct value once."""
+    codes, uniques = pd.factorize(values)
+    ids = np.array(
+        [vocabulary.setdefault(str(u).strip().lower(), len(vocabulary)) for u in uniques] + [-1],
+        dtype=np.int64,
+    )
+    return ids[codes]  # factorize marks missing as -1, which picks the trailing -1
+
+
+def _same_category(pairs, col):
+    """(both present, equal after strip/lower) masks for a categorical column."""
+    vocabulary = {}
+    a = _normalized_codes(pairs[f"{col}_seeker"], vocabulary)
+    b = _normalized_codes(pairs[f"{col}_lister"], vocabulary)
+    return (a >= 0) & (b >= 0), a == b
+
+
+def compatibility_scores(pairs: pd.DataFrame) -> np.ndarray:
+    """
+    ``calculate_compatibility_score`` for every row at once. Terms are applied
+    in the same order and float64 arithmetic, so the result is identical.
+    """
+    score = np.full(len(pairs), 100.0)
+    score -= _numeric_penalty(pairs, "cleanliness", 5.0)
+    score -= _numeric_penalty(pairs, "noise_level", 5.0)
+
+    present, equal = _same_category(pairs, "sleep_schedule")
+    score -= np.where(present & ~equal, 15.0, 0.0)
+    present, equal = _same_category(pairs, "smoking")
+    score -= np.where(present & ~equal, 20.0, 0.0)
+    present, equal = _same_category(pairs, "social_level")
+    score += np.where(present & equal, 10.0, 0.0)
+
+    a = pairs["budget_seeker"].to_numpy(dtype=float)
+    b = pairs["budget_lister"].to_numpy(dtype=float)
+    score -= np.where(np.isnan(a) | np.isnan(b), 0.0, (np.abs(a - b) / 500.0) * 10.0)
+
+    return np.clip(score, 0.0, 100.0)
+
+
+def feature_columns(columns, is_numeric):
+    """Split pair columns into (feature, numeric, categorical) lists, dropping ids and the target."""
+    feature_cols = [c for c in columns if not c.startswith("user_id_") and c not in ("key_city", TARGET_COL)]
+    numeric_cols = [c for c in feature_cols if is_numeric(c)]
+    categorical_cols = [c for c in feature_cols if not is_numeric(c)]
+    return feature_cols, numeric_cols, categorical_cols
+
+
+def build_preprocessor(numeric_cols, categorical_cols, categories="auto"):
+    """Median-impute numerics; most-frequent-impute and one-hot categoricals (layout CompiledEncoder reads)."""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder
+
+    return ColumnTransformer(
+        transformers=[
+            ("num", SimpleImputer(strategy="median"), numeric_cols),
+            ("cat", Pipeline(steps=[
+                ("imputer", SimpleImputer(strategy="most_frequent")),
+                ("ohe", OneHotEncoder(categories=categories, handle_unknown="ignore", sparse_output=False))
+            ]), categorical_cols),
+        ],
+        remainder="drop"
+    )
+
+
+def _max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KiB elsewhere
+
+
+@contextmanager
+def phase(name, report=None):
+    """
+    Time a training phase and print its wall time and peak memory.
+
+    "peak traced" is the phase's own high-water mark of Python and NumPy
+    allocations (tracemalloc); XGBoost's native buffers don't show up there,
+    so the process-wide max RSS so far is printed as well. With ``report``
+    (a dict), the numbers are also stored under ``name``.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        rss_mb = _max_rss_mb()
+        print(f"[{name}] {elapsed:.1f}s | peak traced {peak_mb:,.0f} MB | max RSS {rss_mb:,.0f} MB")
+        if report is not None:
+            report[name] = {"seconds": round(elapsed, 3), "peak_traced_mb": round(peak_mb, 1),
+                            "max_rss_mb": round(rss_mb, 1)}
+
+
+def category_mapping(frame: pd.DataFrame, categorical_cols):
+    """Sorted observed values per categorical column; a value's index is its integer code."""
+    return {c: sorted(frame[c].dropna().astype(str).unique()) for c in categorical_cols}
+
+
+def encode_categorical(frame: pd.DataFrame, numeric_cols, categorical_cols, categories):
+    """
+    Matrix for the native-categorical model: numerics as float, categoricals as
+    their code in ``categories``; missing and unseen values are NaN. Same
+    layout as users.ml_utils.CategoricalEncoder.
+    """
+    out = np.empty((len(frame), len(numeric_cols) + len(categorical_cols)), dtype=np.float32)
+    for i, c in enumerate(numeric_cols):
+        out[:, i] = frame[c].to_numpy(dtype=float)
+    for i, c in enumerate(categorical_cols, start=len(numeric_cols)):
+        codes = {value: code for code, value in enumerate(categories[c])}
+        values = frame[c]
+        out[:, i] = values.astype(str).map(codes).where(values.notna()).to_numpy(dtype=float)
+    return out
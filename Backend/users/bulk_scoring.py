@@ -0,0 +1,49 @@
+"""
+Worker side of ``manage.py score_all``.
+
+Each ProcessPoolExecutor worker loads the matcher once, then for every task
+builds the blocking index for one city and scores a chunk of that city's
+seekers. Workers never touch the database: they return the scores as flat
+arrays and the parent, the only writer, upserts them in batches. SQLite
+takes one writer at a time, and the parent's own reads must not hold a
+cursor open across another process's write. Profiles arrive as plain dicts
+from ``QuerySet.values()``.
+"""
+from types import SimpleNamespace
+
+import numpy as np
+
+from .candidates import CandidateIndex
+from .ml_utils import load_matcher
+
+_matcher = None
+
+
+def init_worker(path, version, compiled_path):
+    """Pool initializer: set up Django if the worker was spawned, and load the matcher once."""
+    global _matcher
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    _matcher = load_matcher(path, version, compiled_path, sidecar_socket=False)
+
+
+def score_chunk(city, seekers, members):
+    """
+    Score one chunk of a city's seekers against the city's members. Only pairs
+    that pass the candidate blocking rule are scored.
+
+    Returns ``(city, n_seekers, seeker_ids, member_ids, scores)``: one entry
+    per scored pair in each of the last three, the scores as an array.
+    """
+    index = CandidateIndex(SimpleNamespace(**m) for m in members)
+    pairs = []
+    for row in seekers:
+        seeker = SimpleNamespace(**row)
+        pairs.extend((seeker, m) for m in index.candidates(seeker) if m.id != seeker.id)
+    if not pairs:
+        return city, len(seekers), [], [], np.empty(0)
+    scores = np.asarray(_matcher.predict(pairs), dtype=float)
+    return city, len(seekers), [s.id for s, _ in pairs], [m.id for _, m in pairs], scores
@@ -0,0 +1,155 @@
+"""
+Candidate generation for the roommate matcher.
+
+A (seeker, member) pair is only worth scoring when both live in the same
+normalized city and their budgets are within ``BUDGET_TOLERANCE`` of each
+other. A member who lists or lives in an active listing is in that listing's
+city as well as their profile's: profile cities are optional and can be
+stale, and a seeker browsing a city sees its listings either way. Callers
+pass those cities on the member as ``listing_cities``, normalized.
+train_model.py builds its training pairs with these same functions, so the
+model is never asked about pairs it was not trained on.
+
+Kept free of Django imports so the training script can use it directly.
+"""
+import bisect
+import math
+from collections import defaultdict
+
+import numpy as np
+
+BUDGET_TOLERANCE = 0.35  # allow ~35% mismatch before hard-filtering a candidate
+MISSING_CITY = "__na__"
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def normalize_city(city):
+    if _is_missing(city):
+        return MISSING_CITY
+    return str(city).strip().lower()
+
+
+def budget_overlap_ok(b1, b2, tol=BUDGET_TOLERANCE):
+    # Accept if budgets within tol proportion (e.g., 35%) of their mean
+    if _is_missing(b1) or _is_missing(b2):
+        return True
+    b1 = float(b1); b2 = float(b2)
+    denom = max(1.0, (b1 + b2) / 2.0)
+    return abs(b1 - b2) / denom <= tol
+
+
+def budget_overlap_mask(b1, b2, tol=BUDGET_TOLERANCE):
+    """``budget_overlap_ok`` over two arrays of budgets, elementwise."""
+    b1 = np.asarray(b1, dtype=float)
+    b2 = np.asarray(b2, dtype=float)
+    denom = np.maximum(1.0, (b1 + b2) / 2.0)
+    with np.errstate(invalid='ignore'):
+        ok = np.abs(b1 - b2) / denom <= tol
+    return ok | np.isnan(b1) | np.isnan(b2)
+
+
+def budget_bounds(budget, tol=BUDGET_TOLERANCE):
+    """
+    Inclusive ``(low, high)`` range of budgets that can pass ``budget_overlap_ok``
+    against ``budget``. Solving |b1 - b2| <= tol * (b1 + b2) / 2 for b2 gives
+    b1 * (2 - tol) / (2 + tol) <= b2 <= b1 * (2 + tol) / (2 - tol); the bounds
+    are widened by one so they are safe as a coarse prefilter.
+    """
+    budget = float(budget)
+    low = budget * (2.0 - tol) / (2.0 + tol)
+    high = budget * (2.0 + tol) / (2.0 - tol)
+    return max(0, math.floor(low) - 1), math.ceil(high) + 1
+
+
+def member_cities(member):
+    """Normalized cities ``member`` is matched in: profile and listings."""
+    return {normalize_city(member.city), *getattr(member, 'listing_cities', ())}
+
+
+def is_candidate(seeker, member, city=None, tol=BUDGET_TOLERANCE):
+    """
+    Blocking rule for one pair. ``city`` overrides the seeker's own city, e.g.
+    when a seeker browses matches in a city they are moving to.
+    """
+    seeker_city = normalize_city(city if city is not None else seeker.city)
+    if seeker_city not in member_cities(member):
+        return False
+    return budget_overlap_ok(seeker.budget, member.budget, tol)
+
+
+def filter_candidates(seeker, members, city=None, tol=BUDGET_TOLERANCE):
+    return [m for m in members if is_candidate(seeker, m, city=city, tol=tol)]
+
+
+def candidate_queryset(queryset, seeker, city=None, tol=BUDGET_TOLERANCE):
+    """
+    Push the budget band of the blocking rule into SQL. The caller is expected
+    to have filtered on city already; run ``filter_candidates`` on the result
+    for the exact rule.
+    """
+    if _is_missing(seeker.budget):
+        return queryset
+    low, high = budget_bounds(seeker.budget, tol)
+    return queryset.filter(budget__gte=low, budget__lte=high)
+
+
+class CandidateIndex:
+    """
+    In-memory blocking index for bulk scoring: members bucketed by normalized
+    city (each of ``member_cities``), and within a city by budget band. A band
+    spans one ``(2 + tol) / (2 - tol)`` ratio, so a query only visits the
+    seeker's band and its two neighbours before the exact
+    ``budget_overlap_ok`` check.
+    """
+
+    def __init__(self, members=(), tol=BUDGET_TOLERANCE):
+        self.tol = tol
+        self._log_ratio = math.log((2.0 + tol) / (2.0 - tol))
+        self._bands = defaultdict(dict)        # city -> band -> [member, ...]
+        self._band_keys = defaultdict(list)    # city -> sorted band numbers
+        self._no_budget = defaultdict(list)    # city -> members without a budget
+        self._size = 0
+        for member in members:
+            self.add(member)
+
+    def __len__(self):
+        return self._size
+
+    def band(self, budget):
+        return math.floor(math.log(max(float(budget), 1.0)) / self._log_ratio)
+
+    def add(self, member):
+        self._size += 1
+        for city in member_cities(member):
+            if _is_missing(member.budget):
+                self._no_budget[city].append(member)
+                continue
+            band = self.band(member.budget)
+            bands = self._bands[city]
+            if band not in bands:
+                bands[band] = []
+                bisect.insort(self._band_keys[city], band)
+            bands[band].append(member)
+
+    def candidates(self, seeker, city=None):
+        city = normalize_city(city if city is not None else seeker.city)
+        found = list(self._no_budget.get(city, ()))
+        bands = self._bands.get(city)
+        if not bands:
+            return found
+        if _is_missing(seeker.budget):
+            return found + [m for bucket in bands.values() for m in bucket]
+
+        keys = self._band_keys[city]
+        center = self.band(seeker.budget)
+        lo = bisect.bisect_left(keys, center - 1)
+        hi = bisect.bisect_right(keys, center + 1)
+        for band in keys[lo:hi]:
+            found.extend(
+                m for m in bands[band]
+                if budget_overlap_ok(seeker.budget, m.budget, self.tol)
+            )
+        return found
@@ -0,0 +1,206 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Lower, Trim
+from django.utils import timezone
+
+from listings.models import Listing
+from .candidates import MISSING_CITY, candidate_queryset, filter_candidates, is_candidate, member_cities, normalize_city
+from .ml_utils import predict_pairs, registry
+from .models import CompatibilityScore, CustomUser
+
+# Member ids per stored-score lookup; stays under SQLite's 999 bound parameters.
+SCORE_LOOKUP_BATCH = 900
+
+
+def listings_in(city):
+    """Active listings whose normalized city is ``city``."""
+    return Listing.objects.alias(normalized_city=Lower(Trim('city'))).filter(is_active=True, normalized_city=city)
+
+
+def attach_listing_cities(pairs, city=None):
+    """
+    Set ``listing_cities`` (see users/candidates.py) on the members of
+    ``(seeker, member)`` pairs whose profile city alone would block them. Two
+    queries, and none when every profile city already matches.
+    """
+    stray = {
+        m.id: m for s, m in pairs
+        if normalize_city(city if city is not None else s.city) not in member_cities(m)
+    }
+    if not stray:
+        return
+    listed = Listing.objects.filter(lister_id__in=stray, is_active=True).values_list('lister_id', 'city')
+    lives_in = Listing.current_roommates.through.objects.filter(
+        customuser_id__in=stray, listing__is_active=True
+    ).values_list('customuser_id', 'listing__city')
+    cities = defaultdict(set)
+    for member_id, listing_city in [*listed, *lives_in]:
+        cities[member_id].add(normalize_city(listing_city))
+    for member_id, member in stray.items():
+        member.listing_cities = cities[member_id]
+
+
+def get_scores(seeker, members, city=None):
+    """
+    Return ``{member_id: score}`` for ``seeker`` against those ``members`` that
+    pass the candidate blocking rule (see users/candidates.py); pruned members
+    are left out of the result.
+
+    Stored scores for the current model version are read for these members
+    only, with one indexed query per ``SCORE_LOOKUP_BATCH`` of them; only
+    pairs missing from the store are sent to the model, and their results are
+    written back for the next request.
+    """
+    matcher, version = registry.current()
+    if matcher is None:
+        return {}
+
+    members = [m for m in members if m.id != seeker.id]
+    attach_listing_cities([(seeker, m) for m in members], city=city)
+    members = {m.id: m for m in filter_candidates(seeker, members, city=city)}
+    if not members:
+        return {}
+
+    stored = CompatibilityScore.objects.filter(seeker=seeker, model_version=version)
+    member_ids = list(members)
+    scores = {}
+    for offset in range(0, len(member_ids), SCORE_LOOKUP_BATCH):
+        batch = member_ids[offset:offset + SCORE_LOOKUP_BATCH]
+        scores.update(stored.filter(member_id__in=batch).values_list('member_id', 'score'))
+    missing = [m for member_id, m in members.items() if member_id not in scores]
+    if missing:
+        predicted = predict_pairs([(seeker, m) for m in missing], matcher=matcher)
+        CompatibilityScore.objects.bulk_create(
+            [
+                CompatibilityScore(seeker=seeker, member=m, model_version=version, score=s)
+                for m, s in zip(missing, predicted)
+            ],
+            ignore_conflicts=True,
+        )
+        scores.update((m.id, s) for m, s in zip(missing, predicted))
+
+    return {member_id: scores[member_id] for member_id in members}
+
+
+def score_unscored(seeker, members):
+    """
+    Make sure the store holds a score for ``seeker`` against every candidate
+    in the ``members`` queryset: candidates without a row for the current
+    model version are found in SQL, scored and written. Returns that version,
+    or None when no model is loaded.
+
+    Once the store is warm (e.g. after ``score_all``) this is one query and
+    nothing is scored, so callers can rank and page in SQL.
+    """
+    matcher, version = registry.current()
+    if matcher is None:
+        return None
+
+    city = normalize_city(seeker.city)
+    if city == MISSING_CITY:
+        members = members.filter(city__isnull=True)
+    else:
+        # Members in the seeker's city by profile, or by an active listing they list or live in.
+        listings = listings_in(city)
+        members = members.alias(normalized_city=Lower(Trim('city'))).filter(
+            Q(normalized_city=city)
+            | Q(id__in=listings.values('lister_id'))
+            | Q(id__in=Listing.current_roommates.through.objects.filter(listing__in=listings).values('customuser_id'))
+        )
+    stored = CompatibilityScore.objects.filter(seeker=seeker, model_version=version).values('member_id')
+    unscored = list(candidate_queryset(members, seeker).exclude(id=seeker.id).exclude(id__in=stored))
+
+    attach_listing_cities([(seeker, m) for m in unscored])
+    missing = filter_candidates(seeker, unscored)
+    if missing:
+        predicted = predict_pairs([(seeker, m) for m in missing], matcher=matcher)
+        CompatibilityScore.objects.bulk_create(
+            [
+                CompatibilityScore(seeker=seeker, member=m, model_version=version, score=s)
+                for m, s in zip(missing, predicted)
+            ],
+            ignore_conflicts=True,
+        )
+    return version
+
+
+def refresh_user_scores(user):
+    """
+    Re-score every stored pair that ``user`` takes part in, as seeker or member.
+    Rows from older model versions, pairs that no longer pass the blocking
+    rule, and anything past ``MATCHER_REFRESH_INLINE_LIMIT`` pairs are deleted
+    instead; ``get_scores``/``score_unscored`` score the latter again when
+    they are next read. Returns how many rows were re-scored.
+    """
+    matcher, version = registry.current()
+    if matcher is None:
+        return 0
+
+    involving = CompatibilityScore.objects.filter(seeker=user) | CompatibilityScore.objects.filter(member=user)
+    involving.exclude(model_version=version).delete()
+
+    limit = getattr(settings, 'MATCHER_REFRESH_INLINE_LIMIT', 1000)
+    rows = list(involving.filter(model_version=version).order_by('-updated_at')[:limit + 1])
+    if len(rows) > limit:
+        involving.filter(model_version=version).exclude(id__in=[r.id for r in rows[:limit]]).delete()
+        rows = rows[:limit]
+    if not rows:
+        return 0
+
+    other_ids = {r.member_id if r.seeker_id == user.id else r.seeker_id for r in rows}
+    others = CustomUser.objects.in_bulk(other_ids)
+    pairs = [
+        (user, others[r.member_id]) if r.seeker_id == user.id else (others[r.seeker_id], user)
+        for r in rows
+    ]
+    attach_listing_cities(pairs)
+    candidates, kept, dropped = [], [], []
+    for r, pair in zip(rows, pairs):
+        if is_candidate(*pair):
+            candidates.append(pair)
+            kept.append(r)
+        else:
+            dropped.append(r.id)
+    if dropped:
+        CompatibilityScore.objects.filter(id__in=dropped).delete()
+    if not kept:
+        return 0
+
+    now = timezone.now()
+    for r, s in zip(kept, predict_pairs(candidates, matcher=matcher)):
+        r.score = s
+        r.updated_at = now
+    CompatibilityScore.objects.bulk_update(kept, ['score', 'updated_at'], batch_size=500)
+    return len(kept)
+
+
+def score_new_members(lister_id, member_ids):
+    """
+    New roommates joined a listing: score them for every seeker who already has
+    a stored score for that listing's lister, i.e. who has seen the listing.
+    """
+    matcher, version = registry.current()
+    if matcher is None or not member_ids:
+        return 0
+
+    seeker_ids = CompatibilityScore.objects.filter(
+        member_id=lister_id, model_version=version
+    ).values_list('seeker_id', flat=True)
+    seekers = list(CustomUser.objects.filter(id__in=seeker_ids))
+    members = list(CustomUser.objects.filter(id__in=member_ids))
+
+    pairs = [(s, m) for s in seekers for m in members if s.id != m.id]
+    attach_listing_cities(pairs)
+    pairs = [(s, m) for s, m in pairs if is_candidate(s, m)]
+    if not pairs:
+        return 0
+    CompatibilityScore.objects.bulk_create(
+        [
+            CompatibilityScore(seeker=s, member=m, model_version=version, score=score)
+            for (s, m), score in zip(pairs, predict_pairs(pairs, matcher=matcher))
+        ],
+        ignore_conflicts=True,
+    )
+    return len(pairs)
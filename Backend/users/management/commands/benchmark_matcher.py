@@ -0,0 +1,76 @@
+import csv
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.ml_utils import CompiledEncoder, MEMBER_FEATURES, SEEKER_FEATURES, build_feature_frame, default_model_path
+from users.models import CustomUser
+from users.tree_ensemble import TreeEnsemble
+
+
+def load_profiles(path):
+    """CustomUser instances (unsaved) for the rows of the training CSV."""
+    fields = set(SEEKER_FEATURES) | set(MEMBER_FEATURES)
+    profiles = []
+    with open(path, newline='') as fh:
+        for row in csv.DictReader(fh):
+            values = {f: row[f] or None for f in fields}
+            values['budget'] = int(values['budget'])
+            values['cleanliness'] = int(values['cleanliness'])
+            values['noise_level'] = int(values['noise_level'])
+            values['has_pets'] = str(values['has_pets']).lower() in ('true', '1', 'yes')
+            profiles.append(CustomUser(**values))
+    return profiles
+
+
+class Command(BaseCommand):
+    help = 'Times pipeline.predict, booster.inplace_predict and the NumPy tree evaluator at several batch sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 1_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--profiles', default=str(settings.BASE_DIR / 'sharespace_profiles.csv'))
+
+    def handle(self, *args, **options):
+        import joblib
+
+        try:
+            pipeline = joblib.load(default_model_path())
+        except FileNotFoundError:
+            raise CommandError("Model artifact not found.")
+
+        encoder = CompiledEncoder.from_pipeline(pipeline)
+        booster = pipeline.named_steps['model'].get_booster()
+        trees = TreeEnsemble.from_booster(booster)
+
+        profiles = load_profiles(options['profiles'])
+        seekers = [p for p in profiles if p.role == 'Seeker']
+        members = [p for p in profiles if p.role == 'Lister']
+        max_size = max(options['sizes'])
+        pairs = [(seekers[i % len(seekers)], members[(i * 7) % len(members)]) for i in range(max_size)]
+        X = encoder.encode(pairs)
+
+        self.stdout.write(f"{'batch':>8}  {'pipeline ms':>12}  {'inplace ms':>11}  {'numpy ms':>9}  {'numpy rows/s':>12}  max |diff|")
+        for size in options['sizes']:
+            frame = build_feature_frame(pairs[:size])
+            X_batch = X[:size]
+            t_pipe = self._time(lambda: pipeline.predict(frame), options['repeat'])
+            t_inplace = self._time(lambda: booster.inplace_predict(X_batch), options['repeat'])
+            t_numpy = self._time(lambda: trees.predict(X_batch), options['repeat'])
+            diff = np.abs(trees.predict(X_batch) - pipeline.predict(frame)).max()
+            self.stdout.write(
+                f"{size:>8}  {t_pipe * 1e3:>12.3f}  {t_inplace * 1e3:>11.3f}  {t_numpy * 1e3:>9.3f}  "
+                f"{size / t_numpy:>12,.0f}  {diff:.2e}"
+            )
+
+    @staticmethod
+    def _time(fn, repeat):
+        fn()  # warm-up
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
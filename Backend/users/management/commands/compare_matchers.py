@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.ml_utils import (
+    MEMBER_FEATURES, SEEKER_FEATURES, BoosterModel, CategoricalEncoder, CompiledMatcher, ScoreMemo,
+    default_categories_path, default_compiled_path, default_model_path, file_digest, load_matcher,
+)
+
+
+def frame_to_pairs(frame):
+    """(seeker, member) namespaces for the rows of a training pair frame, NaN as None."""
+    def side(row, attrs, suffix):
+        values = {a: row.get(f"{a}_{suffix}") for a in attrs}
+        return SimpleNamespace(**{a: None if v is None or v != v else v for a, v in values.items()})
+
+    return [
+        (side(row, SEEKER_FEATURES, 'seeker'), side(row, MEMBER_FEATURES, 'lister'))
+        for row in frame.to_dict('records')
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the one-hot pipeline with the native-categorical variant on the held-out '
+        'split of train_model.py: accuracy, artifact size, load time and predict latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default=str(settings.BASE_DIR / 'sharespace_profiles.csv'))
+        parser.add_argument('--onehot', default=None, help='Pipeline .pkl (defaults to MATCHER_MODEL_PATH).')
+        parser.add_argument('--compiled', default=None, help='Its NumPy export (defaults to MATCHER_COMPILED_PATH).')
+        parser.add_argument('--categorical', default=str(settings.BASE_DIR / 'roommate_matcher_categorical.json'))
+        parser.add_argument('--categories', default=None, help='Category mapping (defaults to MATCHER_CATEGORIES_PATH).')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10_000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        onehot_path = options['onehot'] or str(default_model_path())
+        compiled_path = options['compiled'] or str(default_compiled_path())
+        categorical_path = options['categorical']
+        categories_path = options['categories'] or str(default_categories_path())
+        for path in (onehot_path, categorical_path, categories_path):
+            if not os.path.exists(path):
+                raise CommandError(f"Artifact not found: {path}")
+
+        X_test, y_test = self._test_split(options['profiles'])
+        pairs = frame_to_pairs(X_test)
+        self.stdout.write(f"Held-out pairs: {len(pairs):,}")
+
+        onehot_version = file_digest(onehot_path)
+        # NumPy rows are what web workers run; xgboost rows are what the sidecar runs.
+        variants = [
+            ('one-hot', 'numpy', [onehot_path, compiled_path],
+             lambda: load_matcher(onehot_path, onehot_version, compiled_path, sidecar_socket=False)),
+            ('categorical', 'numpy', [categorical_path, categories_path],
+             lambda: CompiledMatcher.from_categorical(categorical_path, categories_path, file_digest(categorical_path))),
+            ('one-hot', 'xgboost', [onehot_path], lambda: self._onehot_booster(onehot_path)),
+            ('categorical', 'xgboost', [categorical_path, categories_path],
+             lambda: self._categorical_booster(categorical_path, categories_path)),
+        ]
+
+        header = f"{'variant':<12}{'runtime':<9}{'R^2':>8}{'MAE':>7}{'size KB':>10}{'load ms':>10}"
+        header += ''.join(f"{f'predict {n} ms':>18}" for n in options['sizes'])
+        self.stdout.write(header)
+        for name, runtime, files, load in variants:
+            load_s, matcher = self._best(load, options['repeat'])
+            if isinstance(matcher, CompiledMatcher):
+                matcher.memo = ScoreMemo(0)  # time the model, not the score cache
+            predicted = np.asarray(matcher.predict(pairs), dtype=float)
+            r2 = 1.0 - ((y_test - predicted) ** 2).sum() / ((y_test - y_test.mean()) ** 2).sum()
+            mae = np.abs(y_test - predicted).mean()
+            size_kb = sum(os.path.getsize(f) for f in files if os.path.exists(f)) / 1024
+            row = f"{name:<12}{runtime:<9}{r2:>8.4f}{mae:>7.2f}{size_kb:>10,.0f}{load_s * 1e3:>10.1f}"
+            for n in options['sizes']:
+                batch = [pairs[i % len(pairs)] for i in range(n)]
+                t, _ = self._best(lambda: matcher.predict(batch), options['repeat'])
+                row += f"{t * 1e3:>18.3f}"
+            self.stdout.write(row)
+
+    @staticmethod
+    def _onehot_booster(path):
+        import joblib
+
+        return CompiledMatcher.from_pipeline(joblib.load(path))
+
+    @staticmethod
+    def _categorical_booster(model_path, mapping_path):
+        import xgboost as xgb
+
+        with open(mapping_path) as fh:
+            encoder = CategoricalEncoder.from_spec(json.load(fh))
+        return CompiledMatcher(encoder, BoosterModel(xgb.Booster(model_file=model_path)))
+
+    def _test_split(self, profiles):
+        import pandas as pd
+        from sklearn.model_selection import train_test_split
+
+        from training_pairs import TARGET_COL, candidate_pairs, compatibility_scores, feature_columns, load_profiles
+
+        # Same pairs, labels and split as train_model.py / train_categorical.py.
+        seekers, listers = load_profiles(profiles)
+        pairs = candidate_pairs(seekers, listers)
+        pairs[TARGET_COL] = compatibility_scores(pairs)
+        feature_cols, _, _ = feature_columns(pairs.columns, lambda c: pd.api.types.is_numeric_dtype(pairs[c]))
+        _, X_test, _, y_test = train_test_split(
+            pairs[feature_cols], pairs[TARGET_COL].astype(float), test_size=0.20, random_state=42
+        )
+        return X_test, y_test.to_numpy()
+
+    @staticmethod
+    def _best(fn, repeat):
+        best, result = float('inf'), None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        return best, result
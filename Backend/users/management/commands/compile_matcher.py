@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from users.ml_utils import compile_pipeline, default_compiled_path, default_model_path, file_digest, write_atomic
+
+
+class Command(BaseCommand):
+    help = 'Exports the matcher pipeline to flat NumPy arrays so web workers can score without xgboost.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None, help='Pipeline artifact (defaults to MATCHER_MODEL_PATH).')
+        parser.add_argument('--output', default=None, help='Output .npz (defaults to MATCHER_COMPILED_PATH).')
+
+    def handle(self, *args, **options):
+        import joblib
+
+        model_path = options['model'] or default_model_path()
+        output_path = options['output'] or default_compiled_path()
+        if not os.path.exists(model_path):
+            raise CommandError(f"Model artifact not found: {model_path}")
+
+        version = file_digest(model_path)
+        pipeline = joblib.load(model_path)
+        try:
+            arrays = compile_pipeline(pipeline)
+        except (AttributeError, KeyError, ValueError) as e:
+            raise CommandError(f"Pipeline can't be compiled: {e}")
+        arrays['source_version'] = np.array(version)
+
+        def write(tmp_path):
+            # A file handle, not the path: savez would append '.npz' to a path without it.
+            with open(tmp_path, 'wb') as fh:
+                np.savez_compressed(fh, **arrays)
+
+        # Swapped in atomically; the registry may be watching it.
+        write_atomic(output_path, write)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled model {version}: {arrays['roots'].size} trees, {arrays['feature'].size} nodes, "
+            f"max depth {int(arrays['max_depth'])} -> {output_path}"
+        ))
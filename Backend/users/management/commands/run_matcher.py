@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.matcher_client import HEADER
+from users.ml_utils import MEMBER_FEATURES, SEEKER_FEATURES, ModelRegistry
+
+
+class Batcher:
+    """
+    Collects scoring requests from every connected worker and runs them as one
+    predict call once ``window`` seconds have passed since the first queued
+    request, or ``max_rows`` pairs are waiting.
+    """
+
+    def __init__(self, registry, window, max_rows):
+        self.registry = registry
+        self.window = window
+        self.max_rows = max_rows
+        self.queue = asyncio.Queue()
+        self.stats = {'batches': 0, 'requests': 0, 'pairs': 0}
+
+    async def score(self, version, pairs):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((version, pairs, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            rows = len(batch[0][1])
+            deadline = loop.time() + self.window
+            while rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                rows += len(item[1])
+            await loop.run_in_executor(None, self._predict, batch)
+
+    def _predict(self, batch):
+        matcher, version = self.registry.current()
+        accepted, pairs = [], []
+        for requested_version, request_pairs, future in batch:
+            if matcher is None:
+                self._resolve(future, {'error': 'ML model not found.'})
+            elif requested_version != version:
+                self._resolve(future, {'error': f'sidecar serves model {version}, not {requested_version}'})
+            else:
+                accepted.append((len(pairs), len(request_pairs), future))
+                pairs.extend(request_pairs)
+        if not accepted:
+            return
+
+        try:
+            scores = [float(s) for s in matcher.predict(pairs)] if pairs else []
+        except Exception as e:
+            for _, _, future in accepted:
+                self._resolve(future, {'error': f'prediction error: {e}'})
+            return
+
+        self.stats['batches'] += 1
+        self.stats['requests'] += len(accepted)
+        self.stats['pairs'] += len(pairs)
+        for start, count, future in accepted:
+            self._resolve(future, {'version': version, 'scores': scores[start:start + count]})
+
+    @staticmethod
+    def _resolve(future, reply):
+        def set_result():
+            if not future.done():
+                future.set_result(reply)
+        future.get_loop().call_soon_threadsafe(set_result)
+
+
+def to_pairs(raw_pairs):
+    return [
+        (
+            SimpleNamespace(**dict(zip(SEEKER_FEATURES, seeker_values))),
+            SimpleNamespace(**dict(zip(MEMBER_FEATURES, member_values))),
+        )
+        for seeker_values, member_values in raw_pairs
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Runs the roommate matcher as a sidecar on a UNIX socket, batching requests from all web workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=None, help='Socket path (defaults to MATCHER_SIDECAR_SOCKET).')
+        parser.add_argument('--window-ms', type=float, default=None, help='How long to wait for more requests before predicting.')
+        parser.add_argument('--max-rows', type=int, default=None, help='Predict as soon as this many pairs are queued.')
+
+    def handle(self, *args, **options):
+        socket_path = options['socket'] or getattr(settings, 'MATCHER_SIDECAR_SOCKET', None)
+        if not socket_path:
+            raise CommandError("No socket path: pass --socket or set MATCHER_SIDECAR_SOCKET.")
+        window_ms = options['window_ms'] if options['window_ms'] is not None else getattr(settings, 'MATCHER_BATCH_WINDOW_MS', 2)
+        max_rows = options['max_rows'] or getattr(settings, 'MATCHER_BATCH_MAX_ROWS', 4096)
+
+        registry = ModelRegistry(use_sidecar=False)
+        matcher, version = registry.current()
+        if matcher is None:
+            raise CommandError(f"Model artifact not found: {registry.path}")
+        backend = type(getattr(matcher, 'model', matcher)).__name__
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving model {version} ({backend}) on {socket_path}, window {window_ms}ms, max {max_rows} rows"
+        ))
+
+        batcher = Batcher(registry, window_ms / 1000.0, max_rows)
+        try:
+            asyncio.run(self.serve(str(socket_path), batcher))
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+    async def serve(self, socket_path, batcher, stop=None):
+        """Serve until ``stop`` is set; by default, until SIGINT or SIGTERM."""
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        async def handle_client(reader, writer):
+            try:
+                while True:
+                    header = await reader.readexactly(HEADER.size)
+                    request = json.loads(await reader.readexactly(HEADER.unpack(header)[0]))
+                    try:
+                        reply = await batcher.score(request['version'], to_pairs(request['pairs']))
+                    except (KeyError, TypeError, ValueError) as e:
+                        reply = {'error': f'bad request: {e}'}
+                    data = json.dumps(reply).encode('utf-8')
+                    writer.write(HEADER.pack(len(data)) + data)
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        if stop is None:
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+
+        server = await asyncio.start_unix_server(handle_client, path=socket_path)
+        batch_task = asyncio.create_task(batcher.run())
+        stats_task = asyncio.create_task(self.report(batcher))
+        async with server:
+            await stop.wait()
+        batch_task.cancel()
+        stats_task.cancel()
+        self.stdout.write("Matcher sidecar stopped.")
+
+    async def report(self, batcher, every=60):
+        last = dict(batcher.stats)
+        while True:
+            await asyncio.sleep(every)
+            stats = dict(batcher.stats)
+            batches = stats['batches'] - last['batches']
+            if batches:
+                self.stdout.write(
+                    f"{time.strftime('%H:%M:%S')} {batches} batches, "
+                    f"{stats['requests'] - last['requests']} requests, {stats['pairs'] - last['pairs']} pairs"
+                )
+            last = stats
@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from listings.models import Listing
+from users.bulk_scoring import init_worker, score_chunk
+from users.candidates import MISSING_CITY, normalize_city
+from users.ml_utils import (
+    MEMBER_FEATURES, SEEKER_FEATURES, archived_model_path, default_compiled_path,
+    default_model_path, file_digest,
+)
+from users.models import CompatibilityScore, CustomUser
+
+PROFILE_VALUES = ['id'] + sorted(set(SEEKER_FEATURES) | set(MEMBER_FEATURES))
+# SQLite and PostgreSQL; matches the unique_compatibility_score constraint.
+UPSERT_SQL = (
+    f"INSERT INTO {CompatibilityScore._meta.db_table} (seeker_id, member_id, model_version, score, updated_at) "
+    f"VALUES (%s, %s, %s, %s, %s) "
+    f"ON CONFLICT (seeker_id, model_version, member_id) "
+    f"DO UPDATE SET score = excluded.score, updated_at = excluded.updated_at"
+)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Precomputes compatibility scores for every seeker against the listers and roommates '
+        'in their city, in a process pool; this process writes the results. Resumable: '
+        'finished cities are checkpointed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-version', default=None,
+                            help='Score with this version from MATCHER_ARCHIVE_DIR instead of the live artifact.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=500, help='Seekers per worker task.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT batch.')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Progress file (defaults to .score_all-<version>.json next to the model).')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and score every city.')
+        parser.add_argument('--prune', action='store_true',
+                            help='After a complete run, delete stored scores of every other model version.')
+
+    def handle(self, *args, **options):
+        path, version = self._resolve_model(options['model_version'])
+        checkpoint = options['checkpoint'] or os.path.join(
+            os.path.dirname(os.path.abspath(path)), f'.score_all-{version}.json'
+        )
+        done = set() if options['restart'] else self._load_checkpoint(checkpoint)
+
+        cities = self._cities()
+        todo = [c for c in sorted(cities) if c not in done]
+        self.stdout.write(
+            f"Model {version}: {len(cities)} cities, {len(cities) - len(todo)} already done, "
+            f"{options['workers']} workers"
+        )
+
+        compiled_path = default_compiled_path() if version == file_digest(default_model_path()) else None
+        pending = {}                       # future -> city
+        remaining = defaultdict(int)       # city -> chunks not yet written
+        stats = {'pairs': 0, 'seekers': 0, 'cities': 0}
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            # Spawned, not forked: workers must not inherit this process's open DB connection.
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(str(path), version, str(compiled_path) if compiled_path else None),
+        ) as pool:
+            for city in todo:
+                seekers, members = self._profiles(cities[city])
+                if not members:
+                    self._finish_city(city, done, checkpoint, stats)
+                    continue
+                # Hold one extra count while submitting, so the city can't be
+                # checkpointed before its last chunk has even been queued.
+                remaining[city] += 1
+                for seeker_rows in chunked(seekers, options['chunk_size']):
+                    # Bound the in-flight work so memory stays flat on large tables.
+                    while len(pending) >= 2 * options['workers']:
+                        self._drain(pending, remaining, done, checkpoint, stats, start, version, options['batch_size'])
+                    pending[pool.submit(score_chunk, city, seeker_rows, members)] = city
+                    remaining[city] += 1
+                remaining[city] -= 1
+                if not remaining[city]:
+                    self._finish_city(city, done, checkpoint, stats)
+            while pending:
+                self._drain(pending, remaining, done, checkpoint, stats, start, version, options['batch_size'])
+
+        elapsed = time.perf_counter() - start
+        rate = stats['pairs'] / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {stats['pairs']:,} pairs for {stats['seekers']:,} seekers in {elapsed:.1f}s "
+            f"({rate:,.0f} pairs/s, {rate / options['workers']:,.0f} pairs/s per worker)"
+        ))
+
+        if options['prune']:
+            deleted, _ = CompatibilityScore.objects.exclude(model_version=version).delete()
+            self.stdout.write(f"Pruned {deleted:,} scores from other model versions.")
+
+    def _resolve_model(self, requested):
+        live_path = default_model_path()
+        live_version = file_digest(live_path) if os.path.exists(live_path) else None
+        if requested is None or requested == live_version:
+            if live_version is None:
+                raise CommandError(f"Model artifact not found: {live_path}")
+            return live_path, live_version
+
+        path = archived_model_path(requested)
+        if not os.path.exists(path):
+            raise CommandError(f"No artifact for model version {requested} at {path}")
+        if file_digest(path) != requested:
+            raise CommandError(f"{path} does not hash to version {requested}")
+        return path, requested
+
+    def _cities(self):
+        """Normalized city -> the raw spellings stored for it."""
+        cities = defaultdict(set)
+        for city in CustomUser.objects.values_list('city', flat=True).distinct().iterator():
+            cities[normalize_city(city)].add(city)
+        # Listers and roommates are in their listings' cities too (see users/candidates.py).
+        for city in Listing.objects.filter(is_active=True).values_list('city', flat=True).distinct().iterator():
+            cities[normalize_city(city)].add(city)
+        return cities
+
+    def _profiles(self, spellings):
+        in_city = Q(city__in=[c for c in spellings if c is not None])
+        if None in spellings:
+            in_city |= Q(city__isnull=True)
+        # Read in full before any chunk is submitted: results are written on this
+        # connection while the city's chunks are still being queued.
+        seekers = list(CustomUser.objects.filter(in_city, role='Seeker').values(*PROFILE_VALUES).order_by('id'))
+        # Everyone a seeker can be scored against: listers, and the people on active listings.
+        listed = [c for c in spellings if c is not None]
+        members = (
+            CustomUser.objects.filter(
+                (in_city & (Q(role='Lister') | Q(listing__is_active=True) | Q(current_listings__is_active=True)))
+                | Q(listing__is_active=True, listing__city__in=listed)
+                | Q(current_listings__is_active=True, current_listings__city__in=listed)
+            )
+            .distinct().values(*PROFILE_VALUES)
+        )
+        # Whatever their profile says, everyone here is a member of this city.
+        city = normalize_city(next(iter(spellings)))
+        return seekers, [{**m, 'listing_cities': (city,)} for m in members]
+
+    def _drain(self, pending, remaining, done, checkpoint, stats, start, version, batch_size):
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            pending.pop(future)
+            city, n_seekers, seeker_ids, member_ids, scores = future.result()
+            n_pairs = self._write(version, seeker_ids, member_ids, scores, batch_size)
+            stats['pairs'] += n_pairs
+            stats['seekers'] += n_seekers
+            remaining[city] -= 1
+            if not remaining[city]:
+                self._finish_city(city, done, checkpoint, stats)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"  {'(no city)' if city == MISSING_CITY else city}: done "
+                    f"[{stats['cities']} cities, {stats['pairs']:,} pairs, "
+                    f"{stats['pairs'] / elapsed if elapsed else 0:,.0f} pairs/s]"
+                )
+
+    def _write(self, version, seeker_ids, member_ids, scores, batch_size):
+        """
+        Upsert one chunk's scores; this process is the only writer. Returns how many.
+
+        Plain ``executemany``: building and compiling model instances made
+        bulk_create(update_conflicts=True) about 4x slower, and the parent's
+        write rate caps the whole run now that workers don't write.
+        """
+        if not len(scores):
+            return 0
+        prep_id = CustomUser._meta.pk.get_db_prep_value
+        updated_at = CompatibilityScore._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+        rows = [
+            (prep_id(seeker_id, connection), prep_id(member_id, connection), version, float(score), updated_at)
+            for seeker_id, member_id, score in zip(seeker_ids, member_ids, scores)
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for offset in range(0, len(rows), batch_size):
+                cursor.executemany(UPSERT_SQL, rows[offset:offset + batch_size])
+        return len(rows)
+
+    def _finish_city(self, city, done, checkpoint, stats):
+        done.add(city)
+        stats['cities'] += 1
+        tmp_path = f"{checkpoint}.tmp"
+        with open(tmp_path, 'w') as fh:
+            json.dump({'done': sorted(done)}, fh)
+        os.replace(tmp_path, checkpoint)
+
+    def _load_checkpoint(self, checkpoint):
+        try:
+            with open(checkpoint) as fh:
+                return set(json.load(fh)['done'])
+        except FileNotFoundError:
+            return set()
+        except (ValueError, KeyError):
+            raise CommandError(f"Unreadable checkpoint {checkpoint}; rerun with --restart.")
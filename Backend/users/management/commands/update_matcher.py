@@ -0,0 +1,202 @@
+import os
+import pickle
+import shutil
+import time
+import warnings
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.candidates import normalize_city
+from users.ml_utils import (
+    archived_model_path, compile_pipeline, default_compiled_path, default_meta_path, default_model_path,
+    file_digest, write_atomic,
+)
+from users.models import CustomUser
+
+RANDOM_STATE = 42
+
+
+class Command(BaseCommand):
+    help = (
+        'Updates the live matcher from profiles created or changed since the last update: builds '
+        'only their candidate pairs and continues boosting from the current booster (or refreshes '
+        'its leaf values), then publishes a versioned artifact the running server hot-swaps in.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None,
+                            help='ISO timestamp to use instead of the watermark stored in the meta file.')
+        parser.add_argument('--strategy', choices=['append', 'refresh'], default='append',
+                            help='append: add --rounds trees fitted on the new pairs; '
+                                 'refresh: keep the trees, re-fit their leaf values on the new pairs.')
+        parser.add_argument('--rounds', type=int, default=50, help='Trees added by --strategy append.')
+        parser.add_argument('--min-pairs', type=int, default=500,
+                            help='Skip the update when fewer new pairs than this are found.')
+        parser.add_argument('--holdout', type=float, default=0.2,
+                            help='Share of the new pairs kept back to compare the old and new model.')
+        parser.add_argument('--max-regression', type=float, default=0.05,
+                            help='Refuse to publish if holdout MAE grows by more than this fraction.')
+        parser.add_argument('--force', action='store_true', help='Publish even past --max-regression.')
+        parser.add_argument('--dry-run', action='store_true', help='Train and report, but publish nothing.')
+
+    def handle(self, *args, **options):
+        import joblib
+
+        from training_pairs import MODEL_PARAMS, TARGET_COL, compatibility_scores
+
+        model_path = default_model_path()
+        meta_path = default_meta_path()
+        if str(model_path).endswith('.json'):
+            raise CommandError('Incremental updates need the one-hot pipeline (.pkl), not the categorical variant.')
+        if not os.path.exists(model_path) or not os.path.exists(meta_path):
+            raise CommandError(f"Model artifacts not found: {model_path}, {meta_path}")
+
+        parent_version = file_digest(model_path)
+        with open(meta_path, 'rb') as fh:
+            meta = pickle.load(fh)
+        since = self._watermark(options['since'], meta)
+
+        changed = CustomUser.objects.all() if since is None else CustomUser.objects.filter(updated_at__gt=since)
+        through = changed.aggregate(through=Max('updated_at'))['through']
+        if through is None:
+            self.stdout.write(f"No profile changes since {since}; model {parent_version} is current.")
+            return
+
+        start = time.perf_counter()
+        pairs = self._new_pairs(changed.filter(updated_at__lte=through))
+        if len(pairs) < options['min_pairs']:
+            self.stdout.write(
+                f"Only {len(pairs):,} new candidate pairs (< --min-pairs {options['min_pairs']}); "
+                f"model {parent_version} left as is."
+            )
+            return
+        pairs[TARGET_COL] = compatibility_scores(pairs)
+
+        pipeline = joblib.load(model_path)
+        prep, model = pipeline.named_steps['prep'], pipeline.named_steps['model']
+        X = prep.transform(pairs[meta['feature_cols']]).astype(np.float32)
+        y = pairs[TARGET_COL].to_numpy(dtype=np.float32)
+        valid = np.random.default_rng(RANDOM_STATE).random(len(y)) < options['holdout']
+        self.stdout.write(
+            f"{len(pairs):,} new pairs from profiles changed "
+            f"{'ever' if since is None else 'since ' + since.isoformat()} "
+            f"({int((~valid).sum()):,} train / {int(valid.sum()):,} holdout)"
+        )
+
+        booster = self._update_booster(model.get_booster(), X[~valid], y[~valid], options, MODEL_PARAMS)
+        mae_before = float(np.abs(model.get_booster().inplace_predict(X[valid]) - y[valid]).mean())
+        mae_after = float(np.abs(booster.inplace_predict(X[valid]) - y[valid]).mean())
+        self.stdout.write(
+            f"{options['strategy']}: {booster.num_boosted_rounds()} trees, holdout MAE "
+            f"{mae_before:.3f} -> {mae_after:.3f} ({time.perf_counter() - start:.1f}s)"
+        )
+        if mae_after > mae_before * (1 + options['max_regression']) and not options['force']:
+            raise CommandError('Updated model is worse on the new pairs; not publishing (use --force to override).')
+        if options['dry_run']:
+            return
+
+        model.load_model(bytearray(booster.save_raw('ubj')))
+        model.set_params(n_estimators=booster.num_boosted_rounds())
+        version = self._publish(pipeline, model_path, parent_version)
+        meta.update(
+            n_estimators=booster.num_boosted_rounds(),
+            profiles_through=through.isoformat(),
+            updates=meta.get('updates', []) + [{
+                'version': version,
+                'parent_version': parent_version,
+                'strategy': options['strategy'],
+                'n_pairs': len(pairs),
+                'holdout_mae': (round(mae_before, 4), round(mae_after, 4)),
+                'at': timezone.now().isoformat(),
+            }],
+        )
+        write_atomic(meta_path, lambda p: self._dump_pickle(meta, p))
+        self.stdout.write(self.style.SUCCESS(
+            f"Published model {version} (from {parent_version}); watermark {through.isoformat()}"
+        ))
+
+    def _watermark(self, since, meta):
+        value = since or meta.get('profiles_through')
+        if value is None:
+            return None  # never updated from the database: every profile is new
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Not an ISO timestamp: {value}")
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    def _new_pairs(self, changed):
+        """Candidate pairs with at least one changed profile, in the cities those profiles live in."""
+        import pandas as pd
+
+        from training_pairs import REQUIRED_COLUMNS, candidate_pairs, profiles_frame, split_roles
+
+        changed_ids = {str(i) for i in changed.values_list('id', flat=True).iterator()}
+        cities = {normalize_city(c) for c in changed.values_list('city', flat=True).distinct()}
+        rows = (
+            row for row in CustomUser.objects.values('id', *REQUIRED_COLUMNS[1:]).iterator(chunk_size=2000)
+            if normalize_city(row['city']) in cities
+        )
+        profiles = profiles_frame(rows)
+        is_new = profiles['user_id'].isin(changed_ids)
+        new_seekers, new_listers = split_roles(profiles[is_new])
+        old_seekers, _ = split_roles(profiles[~is_new])
+        _, listers = split_roles(profiles)
+
+        # New seekers against every lister, then unchanged seekers against new listers: no pair twice.
+        return pd.concat(
+            [candidate_pairs(new_seekers, listers), candidate_pairs(old_seekers, new_listers)], ignore_index=True
+        )
+
+    @staticmethod
+    def _update_booster(booster, X, y, options, model_params):
+        import xgboost as xgb
+
+        params = {k: v for k, v in model_params.items() if k != 'n_estimators'}
+        params['seed'] = RANDOM_STATE
+        if options['strategy'] == 'refresh':
+            # Same tree structure, leaf values and node stats re-estimated from the new pairs.
+            params.update(process_type='update', updater='refresh', refresh_leaf=True)
+            rounds = booster.num_boosted_rounds()
+        else:
+            params['tree_method'] = 'hist'
+            rounds = options['rounds']
+        with warnings.catch_warnings():
+            # The parent's saved config still names tree_method; for refresh it is irrelevant.
+            warnings.filterwarnings('ignore', message='.*tree_method.*', category=UserWarning)
+            return xgb.train(params, xgb.DMatrix(X, label=y), num_boost_round=rounds, xgb_model=booster)
+
+    def _publish(self, pipeline, model_path, parent_version):
+        """
+        Archive parent and child under MATCHER_ARCHIVE_DIR, write the child's
+        NumPy export, then swap the child in as the live artifact for the
+        registry to pick up.
+        """
+        import joblib
+
+        parent_archive = archived_model_path(parent_version)
+        os.makedirs(os.path.dirname(parent_archive), exist_ok=True)
+        if not os.path.exists(parent_archive):
+            write_atomic(parent_archive, lambda p: shutil.copyfile(model_path, p))
+
+        staged = archived_model_path('staged')
+        write_atomic(staged, lambda p: joblib.dump(pipeline, p))
+        version = file_digest(staged)
+        os.replace(staged, archived_model_path(version))
+
+        # Export first, so a worker that reloads once the new .pkl is live always
+        # finds a matching export. Running workers only reload on that swap.
+        arrays = compile_pipeline(pipeline)
+        arrays['source_version'] = np.array(version)
+        write_atomic(default_compiled_path(), lambda p: np.savez_compressed(p, **arrays))
+        write_atomic(model_path, lambda p: shutil.copyfile(archived_model_path(version), p))
+        return version
+
+    @staticmethod
+    def _dump_pickle(obj, path):
+        with open(path, 'wb') as fh:
+            pickle.dump(obj, fh)
+
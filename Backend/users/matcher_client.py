@@ -0,0 +1,120 @@
+"""
+Client for the matcher sidecar (``manage.py run_matcher``).
+
+With ``MATCHER_SIDECAR_SOCKET`` set, the registry hands out a SidecarMatcher
+instead of loading the model: raw profile values go over a UNIX socket and the
+sidecar batches them with other workers' requests into one predict call. When
+the sidecar is unreachable, or is serving a different model version, scoring
+falls back to an in-process matcher that is loaded on first need.
+
+Wire format, both directions: 4-byte big-endian length + UTF-8 JSON.
+  request  {"version": str, "pairs": [[seeker_values, member_values], ...]}
+  response {"version": str, "scores": [float, ...]} or {"error": str}
+"""
+import json
+import socket
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+from .ml_utils import MEMBER_FEATURES, SEEKER_FEATURES
+
+HEADER = struct.Struct('!I')
+
+
+class SidecarError(Exception):
+    pass
+
+
+def send_message(sock, payload):
+    data = json.dumps(payload, default=str).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    header = _recv_exact(sock, HEADER.size)
+    return json.loads(_recv_exact(sock, HEADER.unpack(header)[0]))
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise SidecarError("connection closed by sidecar")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def pair_values(seeker, member):
+    return [
+        [getattr(seeker, f, None) for f in SEEKER_FEATURES],
+        [getattr(member, f, None) for f in MEMBER_FEATURES],
+    ]
+
+
+class SidecarMatcher:
+    """Matcher whose ``predict`` runs in the sidecar, with an in-process fallback."""
+
+    def __init__(self, socket_path, version, load_local, timeout=None, retry_after=None):
+        self.socket_path = str(socket_path)
+        self.version = version
+        self._load_local = load_local
+        self._local = None
+        self._local_lock = threading.Lock()
+        self._conn = threading.local()
+        self.timeout = timeout if timeout is not None else getattr(settings, 'MATCHER_SIDECAR_TIMEOUT', 2.0)
+        self.retry_after = retry_after if retry_after is not None else getattr(settings, 'MATCHER_SIDECAR_RETRY', 5.0)
+        self._down_until = 0.0
+
+    def predict(self, pairs):
+        if time.monotonic() >= self._down_until:
+            try:
+                return self._predict_remote(pairs)
+            except (OSError, SidecarError, ValueError):
+                self._close()
+                # Don't pay a connect timeout on every request while the sidecar is down.
+                self._down_until = time.monotonic() + self.retry_after
+        return self.local().predict(pairs)
+
+    def local(self):
+        if self._local is None:
+            with self._local_lock:
+                if self._local is None:
+                    self._local = self._load_local()
+        return self._local
+
+    def _predict_remote(self, pairs):
+        sock = self._socket()
+        send_message(sock, {'version': self.version, 'pairs': [pair_values(s, m) for s, m in pairs]})
+        reply = recv_message(sock)
+        if 'error' in reply:
+            raise SidecarError(reply['error'])
+        if reply.get('version') != self.version or len(reply['scores']) != len(pairs):
+            raise SidecarError("sidecar answered for a different model or batch")
+        return reply['scores']
+
+    def _socket(self):
+        sock = getattr(self._conn, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._conn.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._conn, 'sock', None)
+        if sock is not None:
+            self._conn.sock = None
+            try:
+                sock.close()
+            except OSError:
+                pass
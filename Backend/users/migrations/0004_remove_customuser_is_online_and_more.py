@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:22
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_customuser_is_online_customuser_last_seen'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='is_online',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='last_seen',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+from listings.thumbnails import AVATAR_SIZES, variants
+
+
+def backfill_avatar_variants(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    field = CustomUser._meta.get_field('avatar')
+    batch = []
+    for user in CustomUser.objects.exclude(avatar__isnull=True).exclude(avatar='').only('avatar').iterator(chunk_size=2000):
+        user.avatar_variants = variants(field, user.avatar, AVATAR_SIZES)
+        batch.append(user)
+        if len(batch) == 2000:
+            CustomUser.objects.bulk_update(batch, ['avatar_variants'])
+            batch = []
+    CustomUser.objects.bulk_update(batch, ['avatar_variants'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_customuser_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(backfill_avatar_variants, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,494 @@
-import joblib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
 from django.conf import settings
 
-def load_pipeline():
+from .tree_ensemble import TreeEnsemble, export_model
+
+# Profile attributes fed to the model, in the column order used by train_model.py.
+SEEKER_FEATURES = [
+    'role', 'city', 'budget', 'cleanliness', 'noise_level', 'sleep_schedule', 'smoking',
+    'social_level', 'has_pets', 'gender_preference', 'work_schedule', 'occupation', 'mbti_type',
+]
+MEMBER_FEATURES = [
+    'budget', 'has_pets', 'cleanliness', 'noise_level', 'sleep_schedule', 'smoking',
+    'social_level', 'gender_preference', 'work_schedule', 'occupation', 'mbti_type',
+]
+FEATURE_COLUMNS = [f"{c}_seeker" for c in SEEKER_FEATURES] + [f"{c}_lister" for c in MEMBER_FEATURES]
+# Attributes train_model.py treats as numeric (median-imputed); the rest are one-hot categoricals.
+NUMERIC_FEATURES = {'budget', 'cleanliness', 'noise_level', 'has_pets'}
+# Any change to one of these on a CustomUser makes their cached scores stale.
+PROFILE_FEATURE_FIELDS = sorted(set(SEEKER_FEATURES) | set(MEMBER_FEATURES))
+
+
+def default_model_path():
+    return getattr(settings, 'MATCHER_MODEL_PATH', settings.BASE_DIR / 'roommate_matcher_pipeline.pkl')
+
+
+def default_compiled_path():
+    return getattr(settings, 'MATCHER_COMPILED_PATH', settings.BASE_DIR / 'roommate_matcher_compiled.npz')
+
+
+def default_categories_path():
+    return getattr(settings, 'MATCHER_CATEGORIES_PATH', settings.BASE_DIR / 'roommate_matcher_categories.json')
+
+
+def default_meta_path():
+    return getattr(settings, 'MATCHER_META_PATH', settings.BASE_DIR / 'roommate_matcher_meta.pkl')
+
+
+def archived_model_path(version):
+    """Where the pipeline for an older or staged model ``version`` is kept."""
+    archive_dir = getattr(settings, 'MATCHER_ARCHIVE_DIR', settings.BASE_DIR / 'matcher_versions')
+    return os.path.join(archive_dir, f"{version}.pkl")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Short content hash of a model artifact, used as its version."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def write_atomic(path, write):
+    """Call ``write(tmp_path)`` on a temp file next to ``path``, then swap it in with ``os.replace``."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _stat_key(path):
     try:
-        model_path = settings.BASE_DIR / 'roommate_matcher_pipeline.pkl'
-        return joblib.load(model_path)
+        st = os.stat(path)
     except FileNotFoundError:
         return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class ModelRegistry:
+    """
+    Process-wide owner of the roommate matcher.
+
+    The artifact is loaded lazily on first use and the same matcher is handed
+    to every caller in the worker. On access the file's mtime/size is checked
+    (at most once every ``check_interval`` seconds); if it changed, the content
+    hash is compared and a new matcher is swapped in without a restart.
+    Artifacts should be replaced atomically (write to a temp file, then
+    ``os.replace``) so a half-written file is never picked up.
+
+    When ``compile_matcher`` has exported the pipeline to NumPy arrays for the
+    same version, those are loaded instead and xgboost is never imported. With
+    ``MATCHER_SIDECAR_SOCKET`` set, the matcher is a client for ``run_matcher``.
+    A ``.json`` artifact is the native-categorical variant (train_categorical.py),
+    read together with its category mapping.
+    """
+
+    def __init__(self, path=None, compiled_path=None, check_interval=None, use_sidecar=True):
+        self._path = path
+        self._compiled_path = compiled_path
+        self._use_sidecar = use_sidecar
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._current = (None, None)  # (matcher, version), swapped as one object
+        self._stat = None
+        self._last_check = 0.0
+
+    @property
+    def path(self):
+        return self._path or default_model_path()
+
+    @property
+    def compiled_path(self):
+        return self._compiled_path or default_compiled_path()
+
+    @property
+    def check_interval(self):
+        if self._check_interval is not None:
+            return self._check_interval
+        return getattr(settings, 'MATCHER_RELOAD_INTERVAL', 5.0)
+
+    @property
+    def version(self):
+        return self.current()[1]
+
+    def get(self):
+        """Return the shared matcher, or None if no artifact is available."""
+        return self.current()[0]
+
+    def current(self):
+        """Return ``(matcher, version)`` read together, so a hot-swap can't split them."""
+        now = time.monotonic()
+        if self._stat is not None and now - self._last_check < self.check_interval:
+            return self._current
+
+        with self._lock:
+            if self._stat is not None and now - self._last_check < self.check_interval:
+                return self._current
+            self._last_check = now
+            self._refresh()
+            return self._current
+
+    def reload(self):
+        """Force a stat/hash check on the next access."""
+        with self._lock:
+            self._last_check = 0.0
+            self._stat = None
+
+    def _refresh(self):
+        model_stat = _stat_key(self.path)
+        if model_stat is None:
+            self._current, self._stat = (None, None), ()
+            return
+
+        stat_key = (model_stat, _stat_key(self.compiled_path))
+        if stat_key == self._stat:
+            return
+
+        current_matcher, current_version = self._current
+        version = file_digest(self.path)
+        compiled_changed = self._stat is None or self._stat[1:] != stat_key[1:]
+        if version != current_version or current_matcher is None or compiled_changed:
+            try:
+                matcher = load_matcher(
+                    self.path, version, self.compiled_path,
+                    sidecar_socket=None if self._use_sidecar else False,
+                )
+            except Exception:
+                # Keep serving the previous model if the new artifact is unreadable.
+                if current_matcher is not None:
+                    return
+                raise
+            self._current = (matcher, version)
+        self._stat = stat_key
+
+
+def load_matcher(path, version, compiled_path=None, sidecar_socket=None):
+    """
+    Build the matcher for the artifact at ``path``: a client for the sidecar
+    when one is configured, else the NumPy export if one exists for this exact
+    version, else the unpickled pipeline.
+    """
+    if sidecar_socket is None:
+        sidecar_socket = getattr(settings, 'MATCHER_SIDECAR_SOCKET', None)
+    if sidecar_socket:
+        from .matcher_client import SidecarMatcher
+
+        return SidecarMatcher(
+            sidecar_socket, version,
+            load_local=lambda: _load_local_matcher(path, version, compiled_path),
+        )
+
+    if str(path).endswith('.json'):
+        return CompiledMatcher.from_categorical(path, default_categories_path(), version)
+
+    if compiled_path is not None and os.path.exists(compiled_path):
+        with np.load(compiled_path) as arrays:
+            if str(arrays['source_version']) == version:
+                return CompiledMatcher.from_arrays(arrays)
+
+    import joblib
+
+    pipeline = joblib.load(path)
+    try:
+        return CompiledMatcher.from_pipeline(pipeline)
+    except (AttributeError, KeyError, TypeError):
+        return PipelineMatcher(pipeline)
+
+
+def _load_local_matcher(path, version, compiled_path):
+    if file_digest(path) != version:
+        raise RuntimeError("Model artifact changed before the in-process fallback could load it.")
+    return load_matcher(path, version, compiled_path, sidecar_socket=False)
+
+
+registry = ModelRegistry()
+
+
+def get_matcher():
+    return registry.get()
+
+
+def get_model_version():
+    return registry.version
+
+
+class CompiledEncoder:
+    """
+    Writes (seeker, member) pairs straight into the matrix that the fitted
+    ColumnTransformer in train_model.py would produce: imputed numerics first,
+    then one one-hot block per categorical column.
+
+    Numeric inputs that are missing take the fitted imputer median. Categorical
+    values outside the fitted categories (including missing ones) encode as an
+    all-zero block, as ``OneHotEncoder(handle_unknown="ignore")`` does.
+    """
+
+    def __init__(self, numeric_cols, medians, categorical_cols, categories):
+        self.spec = {
+            'numeric_cols': list(numeric_cols),
+            'medians': [float(m) for m in medians],
+            'categorical_cols': list(categorical_cols),
+            'categories': [[str(c) for c in cats] for cats in categories],
+        }
+        self.width = len(numeric_cols) + sum(len(c) for c in categories)
+        self.numeric = [
+            (*_split_feature(col), i, float(median))
+            for i, (col, median) in enumerate(zip(numeric_cols, medians))
+        ]
+        self.categorical = []
+        offset = len(numeric_cols)
+        for col, cats in zip(categorical_cols, categories):
+            lookup = {cat: offset + j for j, cat in enumerate(cats)}
+            self.categorical.append((*_split_feature(col), lookup))
+            offset += len(cats)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        prep = pipeline.named_steps['prep']
+        num_imputer = prep.named_transformers_['num']
+        cat_steps = prep.named_transformers_['cat'].named_steps
+        columns = {name: cols for name, _, cols in prep.transformers_}
+        return cls(
+            numeric_cols=columns['num'],
+            medians=num_imputer.statistics_,
+            categorical_cols=columns['cat'],
+            categories=cat_steps['ohe'].categories_,
+        )
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(**spec)
+
+    def encode(self, pairs, out=None):
+        n = len(pairs)
+        if out is None:
+            out = np.zeros((n, self.width), dtype=np.float32)
+        else:
+            out = out[:n]
+            out.fill(0.0)
+
+        for row, pair in enumerate(pairs):
+            for side, attr, col, median in self.numeric:
+                value = getattr(pair[side], attr, None)
+                out[row, col] = median if value is None else float(value)
+            for side, attr, lookup in self.categorical:
+                value = getattr(pair[side], attr, None)
+                col = lookup.get(value) if value is not None else None
+                if col is not None:
+                    out[row, col] = 1.0
+        return out
+
+
+class CategoricalEncoder:
+    """
+    Encoder for the native-categorical model variant: one column per input
+    feature, numerics as floats and categoricals as their integer code from a
+    plain dict lookup. Missing numerics and missing or unseen categories are
+    NaN, which the trees route down their learned default branch.
+    """
+
+    def __init__(self, numeric_cols, categorical_cols, categories):
+        self.spec = {
+            'numeric_cols': list(numeric_cols),
+            'categorical_cols': list(categorical_cols),
+            'categories': {col: [str(c) for c in categories[col]] for col in categorical_cols},
+        }
+        self.width = len(numeric_cols) + len(categorical_cols)
+        self.numeric = [(*_split_feature(col), i) for i, col in enumerate(numeric_cols)]
+        self.categorical = [
+            (*_split_feature(col), len(numeric_cols) + i,
+             {cat: float(code) for code, cat in enumerate(self.spec['categories'][col])})
+            for i, col in enumerate(categorical_cols)
+        ]
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(spec['numeric_cols'], spec['categorical_cols'], spec['categories'])
+
+    def encode(self, pairs, out=None):
+        n = len(pairs)
+        out = np.empty((n, self.width), dtype=np.float32) if out is None else out[:n]
+        nan = float('nan')
+        for row, pair in enumerate(pairs):
+            for side, attr, col in self.numeric:
+                value = getattr(pair[side], attr, None)
+                out[row, col] = nan if value is None else float(value)
+            for side, attr, col, lookup in self.categorical:
+                value = getattr(pair[side], attr, None)
+                out[row, col] = nan if value is None else lookup.get(str(value), nan)
+        return out
+
+
+def _split_feature(col):
+    """'budget_seeker' -> (0, 'budget'); 'budget_lister' -> (1, 'budget')."""
+    attr, _, side = col.rpartition('_')
+    return (0 if side == 'seeker' else 1), attr
+
+
+class BoosterModel:
+    """Adapter giving an ``xgboost.Booster`` the ``predict(X)`` of TreeEnsemble."""
+
+    def __init__(self, booster):
+        self.booster = booster
+
+    def predict(self, X):
+        return self.booster.inplace_predict(X)
+
+
+class ScoreMemo:
+    """
+    Bounded LRU of encoded-row hash -> score.
+
+    Model inputs are mostly low-cardinality (1-5 scales, a few enums, budget),
+    so many pairs encode to identical rows. ``predict`` scores each distinct
+    row of a batch once, serves repeats from earlier batches out of the memo,
+    and fans the results back out to the original row order. A memo belongs to
+    one CompiledMatcher, i.e. one model version; a hot-swap starts a new one.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def predict(self, X, predict_matrix):
+        if len(X) == 0:
+            return np.empty(0, dtype=np.float32)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        # One opaque bytes item per row: much cheaper to unique than ``axis=0``.
+        rows = X.view(np.dtype((np.void, X.shape[1] * X.itemsize))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        unique = X[first]
+        keys = [hashlib.blake2b(rows[i].tobytes(), digest_size=16).digest() for i in first]
+
+        scores = np.empty(len(unique), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._scores.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    self._scores.move_to_end(key)
+                    scores[i] = score
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            scores[missing] = predict_matrix(unique[missing])
+            if self.maxsize:
+                with self._lock:
+                    for i in missing:
+                        self._scores[keys[i]] = float(scores[i])
+                    while len(self._scores) > self.maxsize:
+                        self._scores.popitem(last=False)
+
+        return scores[inverse.reshape(-1)]
+
+
+class CompiledMatcher:
+    """CompiledEncoder plus a matrix model: the booster, or its NumPy TreeEnsemble export."""
+
+    def __init__(self, encoder, model, memo_size=None):
+        self.encoder = encoder
+        self.model = model
+        if memo_size is None:
+            memo_size = getattr(settings, 'MATCHER_SCORE_MEMO_SIZE', 50_000)
+        self.memo = ScoreMemo(memo_size)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        booster = pipeline.named_steps['model'].get_booster()
+        return cls(CompiledEncoder.from_pipeline(pipeline), BoosterModel(booster))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        encoder = CompiledEncoder.from_spec(json.loads(str(arrays['encoder_spec'])))
+        return cls(encoder, TreeEnsemble.from_arrays(arrays))
+
+    @classmethod
+    def from_categorical(cls, model_path, mapping_path, version=None):
+        """Native-categorical variant: XGBoost JSON model + category mapping, both read without xgboost."""
+        with open(mapping_path) as fh:
+            mapping = json.load(fh)
+        if version is not None and mapping.get('model_version') not in (None, version):
+            raise ValueError(f"{mapping_path} belongs to model {mapping['model_version']}, not {version}")
+        with open(model_path) as fh:
+            trees = TreeEnsemble(**export_model(json.load(fh)))
+        return cls(CategoricalEncoder.from_spec(mapping), trees)
+
+    def predict_matrix(self, X):
+        return self.model.predict(X)
+
+    def predict(self, pairs):
+        return self.memo.predict(self.encoder.encode(pairs), self.predict_matrix)
+
+
+class PipelineMatcher:
+    """Fallback for pipelines CompiledEncoder can't read: DataFrame + ``pipeline.predict``."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def predict(self, pairs):
+        return self.pipeline.predict(build_feature_frame(pairs))
+
+
+def compile_pipeline(pipeline):
+    """Arrays for ``np.savez`` that let a worker score ``pipeline`` with NumPy only."""
+    encoder = CompiledEncoder.from_pipeline(pipeline)
+    trees = TreeEnsemble.from_booster(pipeline.named_steps['model'].get_booster())
+    if trees.num_feature != encoder.width:
+        raise ValueError(f"Booster expects {trees.num_feature} features, encoder produces {encoder.width}")
+    return {**trees.to_arrays(), 'encoder_spec': np.array(json.dumps(encoder.spec))}
+
+
+def build_feature_frame(pairs):
+    """One model input row per (seeker, member) pair, as a DataFrame for ``pipeline.predict``."""
+    import pandas as pd
+
+    rows = []
+    for seeker, member in pairs:
+        rows.append({
+            **{f"{col}_seeker": getattr(seeker, col, None) for col in SEEKER_FEATURES},
+            **{f"{col}_lister": getattr(member, col, None) for col in MEMBER_FEATURES},
+        })
+    df = pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+    # Missing values get the same treatment as in CompiledEncoder: numerics stay NaN for
+    # the pipeline's median imputer, categoricals become 0, an unknown category.
+    for col in FEATURE_COLUMNS:
+        if col.rpartition('_')[0] in NUMERIC_FEATURES:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+        else:
+            df[col] = df[col].fillna(0)
+    return df
+
 
-pipeline = load_pipeline()
+def predict_pairs(pairs, matcher=None):
+    """Raw model scores for a list of (seeker, member) pairs."""
+    if matcher is None:
+        matcher = get_matcher()
+    if matcher is None:
+        raise RuntimeError("ML model not found.")
+    if not pairs:
+        return []
+    return [float(s) for s in matcher.predict(pairs)]
@@ -2,6 +2,7 @@ import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from cloudinary.models import CloudinaryField 
+from listings import thumbnails
 
 class CustomUser(AbstractUser):
     # We will use the default username, password, email fields from Django's AbstractUser
@@ -11,6 +12,8 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=10, choices=[('Seeker', 'Seeker'), ('Lister', 'Lister')], default='Seeker')
     city = models.CharField(max_length=100, blank=True, null=True)
     avatar = CloudinaryField('avatar', blank=True, null=True)
+    # Sized URLs of avatar, built on save (see listings/thumbnails.py).
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(blank=True, null=True)
 
     favorites = models.ManyToManyField('listings.Listing', related_name="favorited_by", blank=True)
@@ -33,5 +36,37 @@ class CustomUser(AbstractUser):
     # Financials (primarily for Seekers)
     budget = models.PositiveIntegerField(default=1000)
 
+    # Watermark for incremental jobs (update_matcher); saves with update_fields that omit it leave it alone.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.avatar_variants = thumbnails.variants(self._meta.get_field('avatar'), self.avatar, thumbnails.AVATAR_SIZES)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'avatar' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'avatar_variants'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.username
+
+class CompatibilityScore(models.Model):
+    """
+    Materialized model output for one (seeker, member) pair under one model version.
+    Rows are filled on read and refreshed by users/signals.py when an input changes.
+    """
+    seeker = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='compatibility_scores')
+    member = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    model_version = models.CharField(max_length=64)
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seeker', 'model_version', 'member'], name='unique_compatibility_score'),
+        ]
+        indexes = [
+            models.Index(fields=['member', 'model_version'], name='compat_member_version_idx'),
+        ]
+
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return f"{self.seeker_id} -> {self.member_id}: {self.score:.1f} ({self.model_version})"
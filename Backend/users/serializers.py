@@ -1,4 +1,6 @@
+from django.core.files.uploadedfile import UploadedFile
 from rest_framework import serializers
+from listings import thumbnails, uploads
 from .models import CustomUser
 
 class LoginSerializer(serializers.Serializer):
@@ -30,10 +32,9 @@ class UserSerializer(serializers.ModelSerializer):
         }
         
     def get_avatar_url(self, obj):
-        # CloudinaryField's .url attribute already provides the full absolute URL.
-        if obj.avatar:
-            return obj.avatar.url
-        return None
+        # Stored on the row by CustomUser.save(); see listings/thumbnails.py.
+        size = thumbnails.requested_size(self.context.get('request'))
+        return thumbnails.url(obj, 'avatar', size, thumbnails.AVATAR_SIZES)
 
     def create(self, validated_data):
         user = CustomUser.objects.create_user(**validated_data)
@@ -55,7 +56,14 @@ class ProfileUpdateSerializer(serializers.ModelSerializer):
         )
         
     def get_avatar_url(self, obj):
-    # CloudinaryField's .url attribute already provides the full absolute URL.
-        if obj.avatar:
-            return obj.avatar.url
-        return None
\ No newline at end of file
+        # Stored on the row by CustomUser.save(); see listings/thumbnails.py.
+        size = thumbnails.requested_size(self.context.get('request'))
+        return thumbnails.url(obj, 'avatar', size, thumbnails.AVATAR_SIZES)
+
+    def update(self, instance, validated_data):
+        # A new avatar file is uploaded after commit; the old one shows until then.
+        avatar = validated_data.get('avatar')
+        if isinstance(avatar, UploadedFile):
+            del validated_data['avatar']
+            uploads.attach_avatar(instance, avatar)
+        return super().update(instance, validated_data)
\ No newline at end of file
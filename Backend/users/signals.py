@@ -0,0 +1,54 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, pre_save
+from django.dispatch import receiver
+
+from listings.models import Listing
+from .compatibility import refresh_user_scores, score_new_members
+from .ml_utils import PROFILE_FEATURE_FIELDS
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+def _quietly(refresh, *args):
+    # Runs after the save has committed: a failed refresh is logged rather than
+    # failing the request, and the stale rows are re-scored when next read.
+    try:
+        refresh(*args)
+    except Exception:
+        logger.exception("Refreshing compatibility scores failed.")
+
+
+@receiver(pre_save, sender=CustomUser)
+def detect_profile_feature_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._matcher_inputs_changed = False
+    if raw or instance._state.adding:
+        return
+    # Saves like update_last_login() touch none of the model inputs.
+    if update_fields is not None and not set(update_fields) & set(PROFILE_FEATURE_FIELDS):
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*PROFILE_FEATURE_FIELDS).first()
+    if old is None:
+        return
+    instance._matcher_inputs_changed = any(getattr(instance, f) != old[f] for f in PROFILE_FEATURE_FIELDS)
+
+
+@receiver(post_save, sender=CustomUser)
+def refresh_scores_on_profile_change(sender, instance, created, **kwargs):
+    if getattr(instance, '_matcher_inputs_changed', False):
+        transaction.on_commit(lambda: _quietly(refresh_user_scores, instance))
+
+
+@receiver(m2m_changed, sender=Listing.current_roommates.through)
+def score_new_roommates(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        # user.current_listings.add(...): one member joined several listings.
+        for lister_id in Listing.objects.filter(id__in=pk_set).values_list('lister_id', flat=True):
+            transaction.on_commit(lambda lister_id=lister_id: _quietly(score_new_members, lister_id, [instance.id]))
+    else:
+        member_ids = list(pk_set)
+        transaction.on_commit(lambda: _quietly(score_new_members, instance.lister_id, member_ids))
@@ -1,3 +1,467 @@
-from django.test import TestCase
+import asyncio
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .management.commands.run_matcher import Batcher, Command as RunMatcherCommand
+from .matcher_client import SidecarMatcher
+from .ml_utils import (
+    CategoricalEncoder, CompiledMatcher, ModelRegistry, ScoreMemo, build_feature_frame, compile_pipeline,
+    file_digest, load_matcher,
+)
+from listings.models import Listing
+from .compatibility import get_scores, score_unscored
+from .models import CompatibilityScore, CustomUser
+from .tree_ensemble import TreeEnsemble
+
+HAS_MODEL = Path(settings.MATCHER_MODEL_PATH).exists()
+
+
+def random_profiles(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        CustomUser(
+            role=rng.choice(['Seeker', 'Lister']),
+            city=rng.choice(['Metro City', 'Suburbia', 'Coastal Town', 'Unknown Town', None]),
+            budget=rng.randint(300, 3000),
+            cleanliness=rng.randint(1, 5),
+            noise_level=rng.randint(1, 5),
+            sleep_schedule=rng.choice(['Early Bird', 'Night Owl', 'Flexible']),
+            smoking=rng.choice(['Non-Smoker', 'Smokes Outside', 'Smokes Inside']),
+            social_level=rng.choice(['Keep to self', 'Friendly but independent', 'Very social / Friends']),
+            has_pets=rng.random() < 0.3,
+            gender_preference=rng.choice(['Male', 'Female', 'No Preference']),
+            work_schedule=rng.choice(['9-to-5', 'Shift Work', 'Remote / WFH', 'Student']),
+            occupation=rng.choice(['Tech', 'Healthcare', 'Other', 'Astronaut', None]),
+            mbti_type=rng.choice(['INTJ', 'ESFP', 'ISTJ', None]),
+        )
+        for _ in range(n)
+    ]
+
+
+@skipUnless(HAS_MODEL, "matcher artifact not present")
+class CompiledMatcherTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import joblib
+
+        cls.pipeline = joblib.load(settings.MATCHER_MODEL_PATH)
+        profiles = random_profiles(400)
+        cls.pairs = list(zip(profiles[:200], profiles[200:]))
+
+    def test_encoding_matches_column_transformer(self):
+        compiled = CompiledMatcher.from_pipeline(self.pipeline)
+        expected = self.pipeline.named_steps['prep'].transform(build_feature_frame(self.pairs))
+        np.testing.assert_array_equal(compiled.encoder.encode(self.pairs), expected.astype(np.float32))
+
+    def test_scores_match_pipeline_predict(self):
+        compiled = CompiledMatcher.from_pipeline(self.pipeline)
+        expected = self.pipeline.predict(build_feature_frame(self.pairs))
+        np.testing.assert_allclose(compiled.predict(self.pairs), expected, rtol=0, atol=1e-4)
+
+    def test_numpy_trees_match_pipeline_predict(self):
+        compiled = CompiledMatcher.from_arrays(compile_pipeline(self.pipeline))
+        self.assertIsInstance(compiled.model, TreeEnsemble)
+        expected = self.pipeline.predict(build_feature_frame(self.pairs))
+        np.testing.assert_allclose(compiled.predict(self.pairs), expected, rtol=0, atol=1e-3)
+
+    def test_missing_values_are_imputed_the_same_way(self):
+        profiles = random_profiles(100, seed=2)
+        for i, profile in enumerate(profiles):
+            for j, attr in enumerate(('budget', 'cleanliness', 'noise_level', 'has_pets', 'city', 'occupation')):
+                if (i + j) % 3 == 0:
+                    setattr(profile, attr, None)
+        pairs = list(zip(profiles[:50], profiles[50:]))
+        compiled = CompiledMatcher.from_pipeline(self.pipeline)
+        frame = build_feature_frame(pairs)
+        self.assertTrue(frame['budget_seeker'].isna().any())
+
+        prep = self.pipeline.named_steps['prep']
+        medians = dict(zip(prep.transformers_[0][2], prep.named_transformers_['num'].statistics_))
+        encoded = compiled.encoder.encode(pairs)
+        self.assertEqual(encoded[0, 0], np.float32(medians['budget_seeker']))  # profiles[0] has no budget
+        np.testing.assert_array_equal(encoded, prep.transform(frame).astype(np.float32))
+        np.testing.assert_allclose(compiled.predict(pairs), self.pipeline.predict(frame), rtol=0, atol=1e-4)
+
+    def test_numpy_trees_follow_default_direction_for_missing_values(self):
+        booster = self.pipeline.named_steps['model'].get_booster()
+        trees = TreeEnsemble.from_booster(booster)
+        X = CompiledMatcher.from_pipeline(self.pipeline).encoder.encode(self.pairs)
+        X[::3, :8] = np.nan
+        np.testing.assert_allclose(trees.predict(X), booster.inplace_predict(X), rtol=0, atol=1e-3)
+
+
+class CategoricalTreeTests(SimpleTestCase):
+    def test_numpy_trees_match_booster_on_categorical_splits(self):
+        import xgboost as xgb
+
+        profiles = random_profiles(2000, seed=1)
+        pairs = list(zip(profiles[:1000], profiles[1000:]))
+        encoder = CategoricalEncoder(
+            numeric_cols=['budget_seeker', 'cleanliness_seeker', 'budget_lister', 'cleanliness_lister'],
+            categorical_cols=['city_seeker', 'sleep_schedule_seeker', 'sleep_schedule_lister', 'occupation_lister'],
+            categories={
+                'city_seeker': ['Coastal Town', 'Metro City', 'Suburbia'],
+                'sleep_schedule_seeker': ['Early Bird', 'Flexible', 'Night Owl'],
+                'sleep_schedule_lister': ['Early Bird', 'Flexible', 'Night Owl'],
+                'occupation_lister': ['Healthcare', 'Other', 'Tech'],
+            },
+        )
+        X = encoder.encode(pairs)
+        self.assertTrue(np.isnan(X[:, 4:]).any())  # unseen and missing categories
+        y = np.array([
+            (s.sleep_schedule == m.sleep_schedule) * 15 - abs(s.budget - m.budget) / 100 for s, m in pairs
+        ])
+        model = xgb.XGBRegressor(
+            n_estimators=30, max_depth=4, tree_method='hist', enable_categorical=True,
+            feature_types=['q'] * 4 + ['c'] * 4,
+        ).fit(X, y)
+        booster = model.get_booster()
+
+        trees = TreeEnsemble.from_booster(booster)
+        self.assertTrue(trees.has_categorical)
+        np.testing.assert_allclose(trees.predict(X), booster.inplace_predict(X), rtol=0, atol=1e-3)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'model.pkl')
+        self.registry = ModelRegistry(
+            path=self.path, compiled_path=os.path.join(tmp.name, 'compiled.npz'), check_interval=0, use_sidecar=False)
+        patcher = mock.patch('users.ml_utils.load_matcher', side_effect=lambda path, version, *a, **kw: object())
+        self.load_matcher = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, content, mtime=None):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(content)
+        if mtime is not None:
+            os.utime(tmp_path, ns=(mtime, mtime))
+        os.replace(tmp_path, self.path)
+
+    def test_missing_model(self):
+        self.assertEqual(self.registry.current(), (None, None))
+        self.load_matcher.assert_not_called()
+
+    def test_swapping_the_artifact_bumps_the_version(self):
+        self.write(b'first model', mtime=1_000_000_000)
+        matcher, version = self.registry.current()
+        self.assertEqual(version, file_digest(self.path))
+
+        self.write(b'second model', mtime=2_000_000_000)
+        new_matcher, new_version = self.registry.current()
+        self.assertNotEqual(new_version, version)
+        self.assertIsNot(new_matcher, matcher)
+        self.assertEqual(self.load_matcher.call_count, 2)
+
+    def test_unchanged_artifact_is_not_reloaded(self):
+        self.write(b'model', mtime=1_000_000_000)
+        matcher, version = self.registry.current()
+        self.assertEqual(self.registry.current(), (matcher, version))
+
+        # Rewritten with the same bytes: the stat changes, the hash doesn't.
+        self.write(b'model', mtime=2_000_000_000)
+        with mock.patch('users.ml_utils.file_digest', wraps=file_digest) as digest:
+            self.assertEqual(self.registry.current(), (matcher, version))
+        digest.assert_called_once()
+        self.assertEqual(self.load_matcher.call_count, 1)
+
+
+class ScoreMemoTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+    def predict_matrix(self, X, offset=0.0):
+        self.batches.append(X.tolist())
+        return X.sum(axis=1) + offset
+
+    def test_duplicate_rows_are_predicted_once(self):
+        memo = ScoreMemo(maxsize=10)
+        X = np.array([[1, 2], [3, 4], [1, 2], [1, 2], [3, 4]], dtype=np.float32)
+        np.testing.assert_array_equal(memo.predict(X, self.predict_matrix), [3, 7, 3, 3, 7])
+        self.assertEqual(len(self.batches), 1)
+        self.assertCountEqual(self.batches[0], [[1, 2], [3, 4]])
+
+        np.testing.assert_array_equal(memo.predict(X[::-1], self.predict_matrix), [7, 3, 3, 7, 3])
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual((memo.hits, memo.misses), (2, 2))
+
+    def test_least_recently_used_rows_are_evicted(self):
+        memo = ScoreMemo(maxsize=2)
+        a, b, c = ([[float(n), 0.0]] for n in (1, 2, 3))
+        for row in (a, b, a, c):  # reading a makes b the oldest
+            memo.predict(np.array(row), self.predict_matrix)
+        self.assertEqual(len(memo), 2)
+        self.batches.clear()
+
+        memo.predict(np.array(a + c), self.predict_matrix)
+        self.assertEqual(self.batches, [])
+        memo.predict(np.array(b), self.predict_matrix)
+        self.assertEqual(self.batches, [b])
+
+    def test_each_model_version_has_its_own_memo(self):
+        encoder = SimpleNamespace(encode=lambda pairs: np.array(pairs, dtype=np.float32))
+        old = CompiledMatcher(encoder, SimpleNamespace(predict=self.predict_matrix), memo_size=10)
+        new = CompiledMatcher(encoder, SimpleNamespace(predict=lambda X: self.predict_matrix(X, offset=100)), memo_size=10)
+        rows = [[1, 2], [3, 4]]
+        np.testing.assert_array_equal(old.predict(rows), [3, 7])
+        np.testing.assert_array_equal(new.predict(rows), [103, 107])
+        np.testing.assert_array_equal(old.predict(rows), [3, 7])
+        self.assertEqual(len(self.batches), 2)
+        self.assertEqual((old.memo.hits, new.memo.hits), (2, 0))
+
+
+class FakeMatcher:
+    """Scores a pair by the member's cleanliness, so tests can tell re-scored rows apart."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs):
+        self.calls.append(len(pairs))
+        return np.array([10.0 * member.cleanliness for _, member in pairs])
+
+
+class ScoreRefreshTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        profile = {'password': 'x', 'city': 'Metro City', 'budget': 1000}
+        cls.seeker = CustomUser.objects.create_user('seeker', role='Seeker', **profile)
+        cls.lister = CustomUser.objects.create_user('lister', role='Lister', cleanliness=4, **profile)
+        cls.roommate = CustomUser.objects.create_user('roommate', role='Seeker', cleanliness=2, **profile)
+        cls.listing = Listing.objects.create(lister=cls.lister, title='Room', city='Metro City', rent=900)
+
+    def setUp(self):
+        self.matcher = FakeMatcher()
+        patcher = mock.patch('users.compatibility.registry.current', return_value=(self.matcher, 'v1'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored(self):
+        return dict(CompatibilityScore.objects.filter(seeker=self.seeker).values_list('member__username', 'score'))
+
+    def save_profile(self, user, **changes):
+        for field, value in changes.items():
+            setattr(user, field, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+    def test_profile_change_rescores_stored_pairs(self):
+        get_scores(self.seeker, [self.lister])
+        self.save_profile(self.lister, cleanliness=5)
+        self.assertEqual(self.stored(), {'lister': 50.0})
+
+        self.matcher.calls.clear()
+        self.save_profile(self.lister, bio='Unrelated to the model')
+        self.assertEqual(self.matcher.calls, [])
+
+    def test_stored_scores_are_read_in_batches(self):
+        get_scores(self.seeker, [self.lister, self.roommate])
+        self.matcher.calls.clear()
+        with mock.patch('users.compatibility.SCORE_LOOKUP_BATCH', 1):
+            self.assertEqual(get_scores(self.seeker, [self.lister, self.roommate]), {
+                self.lister.id: 40.0, self.roommate.id: 20.0})
+        self.assertEqual(self.matcher.calls, [])
+
+    def test_pairs_that_stop_being_candidates_are_dropped(self):
+        get_scores(self.seeker, [self.lister])
+        self.save_profile(self.lister, budget=5000)
+        self.assertEqual(self.stored(), {})
+
+    @override_settings(MATCHER_REFRESH_INLINE_LIMIT=0)
+    def test_pairs_past_the_inline_limit_are_dropped(self):
+        get_scores(self.seeker, [self.lister])
+        self.save_profile(self.lister, cleanliness=5)
+        self.assertEqual(self.stored(), {})
+
+    def test_failed_refresh_does_not_fail_the_save(self):
+        get_scores(self.seeker, [self.lister])
+        with mock.patch.object(self.matcher, 'predict', side_effect=RuntimeError('model broke')):
+            with self.assertLogs('users.signals', 'ERROR'):
+                self.save_profile(self.lister, cleanliness=5)
+        self.assertEqual(CustomUser.objects.get(pk=self.lister.pk).cleanliness, 5)
+
+    def test_new_roommates_are_scored_for_seekers_who_saw_the_listing(self):
+        get_scores(self.seeker, [self.lister])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.current_roommates.add(self.roommate)
+        self.assertEqual(self.stored(), {'lister': 40.0, 'roommate': 20.0})
+
+        other = Listing.objects.create(lister=self.lister, title='Other room', city='Metro City', rent=900)
+        newcomer = CustomUser.objects.create_user(
+            'newcomer', password='x', role='Seeker', city='Metro City', budget=1000, cleanliness=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            newcomer.current_listings.add(other)
+        self.assertEqual(self.stored()['newcomer'], 30.0)
+
+
+class ListingCityTests(TestCase):
+    """Listers and roommates are blocked on their listings' cities, not only their profile's."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeker = CustomUser.objects.create_user('seeker', password='x', role='Seeker', city='Metro City', budget=1000)
+        cls.lister = CustomUser.objects.create_user('lister', password='x', role='Lister', city=None, budget=1000, cleanliness=6)
+        cls.roommate = CustomUser.objects.create_user(
+            'roommate', password='x', role='Seeker', city='Old Town', budget=1000, cleanliness=2)
+        listing = Listing.objects.create(lister=cls.lister, title='Room', city='metro city ', rent=900)
+        listing.current_roommates.add(cls.roommate)
+        cls.elsewhere = CustomUser.objects.create_user(
+            'elsewhere', password='x', role='Lister', city=None, budget=1000, cleanliness=5)
+        Listing.objects.create(lister=cls.elsewhere, title='Far room', city='Suburbia', rent=900)
+
+    def setUp(self):
+        patcher = mock.patch('users.compatibility.registry.current', return_value=(FakeMatcher(), 'v1'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored(self):
+        return dict(CompatibilityScore.objects.filter(seeker=self.seeker).values_list('member__username', 'score'))
+
+    def test_matches_include_listers_without_a_profile_city(self):
+        client = APIClient()
+        client.force_authenticate(self.seeker)
+        with mock.patch('users.views.get_matcher', return_value=object()):
+            response = client.get('/api/users/matches/', {'city': 'Metro City'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['lister_username'] for m in response.json()], ['lister'])
+
+    def test_feed_scores_members_by_listing_city(self):
+        members = CustomUser.objects.exclude(id=self.seeker.id)
+        self.assertEqual(score_unscored(self.seeker, members), 'v1')
+        self.assertEqual(self.stored(), {'lister': 60.0, 'roommate': 20.0})
+
+    def test_listings_in_other_cities_stay_blocked(self):
+        scores = get_scores(self.seeker, [self.lister, self.roommate, self.elsewhere])
+        self.assertEqual(scores, {self.lister.id: 60.0, self.roommate.id: 20.0})
+
+
+class MatcherSidecarTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.socket_path = os.path.join(self.dir, 'matcher.sock')
+        self.pairs = list(zip(random_profiles(4, seed=3), random_profiles(4, seed=4)))
+        self.expected = [10.0 * member.cleanliness for _, member in self.pairs]
+
+    def start_sidecar(self, version='v1', window=0.0, max_rows=4096):
+        """Serve a FakeMatcher as model ``version`` on a temporary socket, in a thread."""
+        matcher = FakeMatcher()
+        batcher = Batcher(SimpleNamespace(current=lambda: (matcher, version)), window, max_rows)
+        started = {}
+
+        async def serve():
+            started['loop'], started['stop'] = asyncio.get_running_loop(), asyncio.Event()
+            await RunMatcherCommand(stdout=mock.MagicMock()).serve(self.socket_path, batcher, started['stop'])
+
+        thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        def stop():
+            started['loop'].call_soon_threadsafe(started['stop'].set)
+            thread.join(5)
+        self.addCleanup(stop)
+        return matcher, batcher
+
+    def sidecar_matcher(self, local=None, version='v1'):
+        local = local or FakeMatcher()
+        return SidecarMatcher(self.socket_path, version, load_local=lambda: local, timeout=5, retry_after=60)
+
+    def test_round_trip(self):
+        remote, _ = self.start_sidecar()
+        local = FakeMatcher()
+        client = self.sidecar_matcher(local)
+        self.assertEqual(client.predict(self.pairs), self.expected)
+        self.assertEqual(client.predict(self.pairs[:1]), self.expected[:1])
+        self.assertEqual(remote.calls, [4, 1])
+        self.assertEqual(local.calls, [])
+
+    def test_concurrent_requests_are_batched(self):
+        remote, batcher = self.start_sidecar(window=5.0, max_rows=3 * len(self.pairs))
+        client = self.sidecar_matcher()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.predict(self.pairs))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(results, [self.expected] * 3)
+        self.assertEqual(remote.calls, [12])
+        self.assertEqual(batcher.stats, {'batches': 1, 'requests': 3, 'pairs': 12})
+
+    def test_other_model_version_falls_back_in_process(self):
+        remote, _ = self.start_sidecar(version='v2')
+        local = FakeMatcher()
+        self.assertEqual(list(self.sidecar_matcher(local).predict(self.pairs)), self.expected)
+        self.assertEqual((remote.calls, local.calls), ([], [4]))
+
+    def test_load_matcher_falls_back_when_the_socket_is_dead(self):
+        # A socket file nobody listens on, as a crashed sidecar leaves behind.
+        dead = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        dead.bind(self.socket_path)
+        dead.close()
+
+        local = FakeMatcher()
+        with mock.patch('users.ml_utils._load_local_matcher', return_value=local):
+            matcher = load_matcher('model.pkl', 'v1', sidecar_socket=self.socket_path)
+            self.assertIsInstance(matcher, SidecarMatcher)
+            self.assertEqual(list(matcher.predict(self.pairs)), self.expected)
+            with mock.patch.object(matcher, '_predict_remote') as remote:
+                matcher.predict(self.pairs)
+        remote.assert_not_called()  # the sidecar is not retried until retry_after has passed
+        self.assertEqual(local.calls, [4, 4])
+
+
+@skipUnless(HAS_MODEL, "matcher artifact not present")
+class ScoreAllTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        profiles = random_profiles(14, seed=5)
+        for i, profile in enumerate(profiles):
+            profile.username = f'user{i}'
+            profile.city = 'Metro City' if i < 12 else 'Suburbia'
+            profile.budget = 1000 + 10 * i
+        for profile in profiles:
+            profile.role = 'Seeker'
+        for profile in profiles[9:]:
+            profile.role = 'Lister'
+        CustomUser.objects.bulk_create(profiles)
+        cls.seekers, cls.listers = profiles[:9], profiles[9:12]
+
+    def test_parallel_run_writes_every_pair_from_the_parent(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command(
+                'score_all', workers=2, chunk_size=2, batch_size=4,
+                checkpoint=os.path.join(tmp, 'checkpoint.json'), stdout=mock.MagicMock(),
+            )
+        pairs = [(seeker, lister) for seeker in self.seekers for lister in self.listers]
+        matcher, version = ModelRegistry(use_sidecar=False).current()
+        expected = {(s.id, m.id): float(score) for (s, m), score in zip(pairs, matcher.predict(pairs))}
+        stored = {
+            (seeker_id, member_id): score
+            for seeker_id, member_id, score in CompatibilityScore.objects.filter(model_version=version)
+            .values_list('seeker_id', 'member_id', 'score')
+        }
+        self.assertEqual(stored.keys(), expected.keys())
+        for pair, score in expected.items():
+            self.assertAlmostEqual(stored[pair], score, places=4)
@@ -0,0 +1,185 @@
+"""
+Pure-NumPy evaluator for the matcher's XGBoost regressor.
+
+``export_booster`` flattens every tree of a trained booster into shared node
+arrays (feature, threshold, children, default direction, leaf value). Leaves
+point back at themselves, so a batch is scored by stepping all rows through
+all trees ``max_depth`` times with fancy indexing, with no xgboost import.
+
+Categorical splits (models trained with ``enable_categorical``) are kept as
+one row of a boolean matrix per split node: a row whose integer category code
+is in the node's set goes right, anything else goes left.
+"""
+import json
+
+import numpy as np
+
+ARRAY_FIELDS = ('feature', 'threshold', 'left', 'right', 'default_left', 'value', 'roots')
+CATEGORICAL_FIELDS = ('cat_row', 'cat_mask')
+
+
+def _parse_base_score(raw):
+    # xgboost >= 3 stores a vector such as "[6.49682E1]".
+    return float(str(raw).strip('[]').split(',')[0])
+
+
+def export_booster(booster):
+    """Return the flat node arrays for an ``xgboost.Booster`` (or anything with ``save_raw``)."""
+    return export_model(json.loads(booster.save_raw('json')))
+
+
+def export_model(model):
+    """Flat node arrays for a parsed XGBoost JSON model (``Booster.save_model('x.json')``)."""
+    learner = model['learner']
+    objective = learner['objective']['name']
+    if objective != 'reg:squarederror':
+        raise ValueError(f"Unsupported objective for the NumPy evaluator: {objective}")
+
+    trees = learner['gradient_booster']['model']['trees']
+    feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+    cat_row, cat_sets = [], []
+    max_depth = 0
+    offset = 0
+    for tree in trees:
+        node_cats = {}
+        for node, start, size in zip(
+            tree.get('categories_nodes', []), tree.get('categories_segments', []), tree.get('categories_sizes', [])
+        ):
+            node_cats[node] = tree['categories'][start:start + size]
+        lc, rc = tree['left_children'], tree['right_children']
+        n = len(lc)
+        depth = [0] * n
+        for i in range(n):
+            is_leaf = lc[i] == -1
+            feature.append(0 if is_leaf else tree['split_indices'][i])
+            threshold.append(0.0 if is_leaf else tree['split_conditions'][i])
+            left.append(offset + (i if is_leaf else lc[i]))
+            right.append(offset + (i if is_leaf else rc[i]))
+            default_left.append(bool(tree['default_left'][i]))
+            # For leaves, split_conditions holds the (learning-rate scaled) leaf value.
+            value.append(tree['split_conditions'][i] if is_leaf else 0.0)
+            if not is_leaf and int(tree['split_type'][i]) != 0:
+                cat_row.append(len(cat_sets))
+                cat_sets.append(node_cats.get(i, []))
+            else:
+                cat_row.append(-1)
+            if not is_leaf:
+                depth[lc[i]] = depth[rc[i]] = depth[i] + 1
+        max_depth = max(max_depth, max(depth))
+        roots.append(offset)
+        offset += n
+
+    n_codes = max((max(cats) + 1 for cats in cat_sets if cats), default=0)
+    cat_mask = np.zeros((len(cat_sets), n_codes), dtype=bool)
+    for row, cats in enumerate(cat_sets):
+        cat_mask[row, cats] = True
+
+    return {
+        'feature': np.asarray(feature, dtype=np.int32),
+        'threshold': np.asarray(threshold, dtype=np.float32),
+        'left': np.asarray(left, dtype=np.int32),
+        'right': np.asarray(right, dtype=np.int32),
+        'default_left': np.asarray(default_left, dtype=bool),
+        'value': np.asarray(value, dtype=np.float32),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'cat_row': np.asarray(cat_row, dtype=np.int32),
+        'cat_mask': cat_mask,
+        'base_score': _parse_base_score(learner['learner_model_param']['base_score']),
+        'max_depth': max_depth,
+        'num_feature': int(learner['learner_model_param']['num_feature']),
+    }
+
+
+class TreeEnsemble:
+    """Vectorized scorer over the arrays produced by ``export_booster``."""
+
+    def __init__(self, feature, threshold, left, right, default_left, value, roots,
+                 base_score, max_depth, num_feature, cat_row=None, cat_mask=None, chunk_rows=4096):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.base_score = float(base_score)
+        self.max_depth = int(max_depth)
+        self.num_feature = int(num_feature)
+        self.chunk_rows = chunk_rows
+        self.cat_row = cat_row if cat_row is not None else np.full(feature.shape, -1, dtype=np.int32)
+        self.cat_mask = cat_mask if cat_mask is not None else np.zeros((0, 0), dtype=bool)
+        self.has_categorical = bool(self.cat_mask.shape[0])
+        if self.has_categorical:
+            # Flat lookup: row 0 is an all-False row for numeric nodes, and the last
+            # column catches codes the model never saw, so no masking is needed per level.
+            n_rows, n_codes = self.cat_mask.shape
+            table = np.zeros((n_rows + 1, n_codes + 1), dtype=bool)
+            table[1:, :n_codes] = self.cat_mask
+            self._cat_table = table.ravel()
+            self._cat_base = (self.cat_row.astype(np.int64) + 1) * (n_codes + 1)
+            self._is_cat = self.cat_row >= 0
+        # children[2 * node] is the left child, children[2 * node + 1] the right one.
+        self.children = np.stack([left, right], axis=1).ravel()
+
+    @classmethod
+    def from_booster(cls, booster, **kwargs):
+        return cls(**export_booster(booster), **kwargs)
+
+    def to_arrays(self):
+        arrays = {name: getattr(self, name) for name in ARRAY_FIELDS}
+        if self.has_categorical:
+            arrays.update((name, getattr(self, name)) for name in CATEGORICAL_FIELDS)
+        arrays.update(
+            base_score=np.float64(self.base_score),
+            max_depth=np.int32(self.max_depth),
+            num_feature=np.int32(self.num_feature),
+        )
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, **kwargs):
+        # Exports written before categorical support have no cat_* arrays.
+        optional = {name: np.asarray(arrays[name]) for name in CATEGORICAL_FIELDS if name in arrays}
+        return cls(
+            **{name: np.asarray(arrays[name]) for name in ARRAY_FIELDS},
+            **optional,
+            base_score=float(arrays['base_score']),
+            max_depth=int(arrays['max_depth']),
+            num_feature=int(arrays['num_feature']),
+            **kwargs,
+        )
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.num_feature:
+            raise ValueError(f"Expected a (n, {self.num_feature}) matrix, got {X.shape}")
+        out = np.empty(X.shape[0], dtype=np.float32)
+        for start in range(0, X.shape[0], self.chunk_rows):
+            out[start:start + self.chunk_rows] = self._predict_chunk(X[start:start + self.chunk_rows])
+        return out
+
+    def _predict_chunk(self, X):
+        flat = np.ascontiguousarray(X).ravel()
+        row_base = (np.arange(X.shape[0], dtype=np.int64) * X.shape[1])[:, None]
+        has_missing = np.isnan(flat).any()
+        codes = self._category_codes(flat) if self.has_categorical else None
+        node = np.broadcast_to(self.roots, (X.shape[0], self.roots.size)).copy()
+        for _ in range(self.max_depth):
+            idx = row_base + self.feature.take(node)
+            x = flat.take(idx)
+            go_right = ~(x < self.threshold.take(node))
+            if codes is not None:
+                # On a categorical split, go right iff the code is in the node's set.
+                in_set = self._cat_table.take(self._cat_base.take(node) + codes.take(idx))
+                go_right = np.where(self._is_cat.take(node), in_set, go_right)
+            if has_missing:
+                missing = np.isnan(x)
+                go_right[missing] = ~self.default_left.take(node[missing])
+            node = self.children.take(2 * node + go_right)
+        return self.value.take(node).sum(axis=1, dtype=np.float64) + self.base_score
+
+    def _category_codes(self, flat):
+        """Inputs as lookup columns; NaN, negative and unseen codes all map to the all-False column."""
+        n_codes = self.cat_mask.shape[1]
+        codes = np.nan_to_num(flat, nan=n_codes)
+        return np.where((codes < 0) | (codes > n_codes), n_codes, codes).astype(np.int64)
@@ -1,6 +1,3 @@
-import pandas as pd
-import joblib
-from django.conf import settings
 from django.contrib.auth import authenticate
 from rest_framework import generics, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -10,6 +7,9 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.db.models import Q 
 from listings.models import Listing
 from listings.serializers import ListingSerializer
+from .candidates import candidate_queryset, normalize_city
+from .compatibility import get_scores, listings_in
+from .ml_utils import get_matcher
 from .models import CustomUser
 from .serializers import LoginSerializer, ProfileUpdateSerializer, UserSerializer
 
@@ -106,17 +106,12 @@ class UserSearchView(generics.ListAPIView):
     
 class MatchesView(APIView):
     permission_classes = [IsAuthenticated]
-    
-    try:
-        model_path = settings.BASE_DIR / 'roommate_matcher_pipeline.pkl'
-        pipeline = joblib.load(model_path)
-    except FileNotFoundError:
-        pipeline = None
 
     def get(self, request, *args, **kwargs):
         from listings.serializers import ListingSerializer
 
-        if self.pipeline is None:
+        matcher = get_matcher()
+        if matcher is None:
             return Response({"error": "ML model not found."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         seeker = request.user
@@ -125,54 +120,30 @@ class MatchesView(APIView):
 
         target_city = request.query_params.get('city', seeker.city) 
         
-        # Find listers who have an active listing in the target city.
+        # Find listers who have an active listing in the target city, whatever their
+        # profile's city; compared normalized, the way the blocking rule compares them.
         listers = CustomUser.objects.filter(
-            role='Lister', 
-            listing__is_active=True,
-            listing__city__iexact=target_city  # Case-insensitive city filter
-        ).exclude(id=seeker.id).distinct()
+            role='Lister',
+            id__in=listings_in(normalize_city(target_city)).values('lister_id'),
+        ).exclude(id=seeker.id)
+        # Only listers inside the seeker's budget band can be candidates.
+        listers = candidate_queryset(listers, seeker, city=target_city)
 
         if not listers.exists():
             # Return an empty list if no listers are found in that city
             return Response([], status=status.HTTP_200_OK)
 
-        REQUIRED_COLS_ORDER = [
-            'role_seeker', 'city_seeker', 'budget_seeker', 'cleanliness_seeker', 'noise_level_seeker',
-            'sleep_schedule_seeker', 'smoking_seeker', 'social_level_seeker', 'has_pets_seeker',
-            'gender_preference_seeker', 'work_schedule_seeker', 'occupation_seeker', 'mbti_type_seeker',
-            'budget_lister', 'has_pets_lister', 'cleanliness_lister', 'noise_level_lister',
-            'sleep_schedule_lister', 'smoking_lister', 'social_level_lister',
-            'gender_preference_lister', 'work_schedule_lister', 'occupation_lister', 'mbti_type_lister'
-        ]
-        
-        seeker_data = {col: getattr(seeker, col.replace('_seeker', ''), None) for col in REQUIRED_COLS_ORDER if col.endswith('_seeker')}
-
-        if not listers.exists():
-            return Response([], status=status.HTTP_200_OK)
-
-        prediction_data = []
-        for lister in listers:
-            lister_data = {col: getattr(lister, col.replace('_lister', ''), None) for col in REQUIRED_COLS_ORDER if col.endswith('_lister')}
-            combined_data = {**seeker_data, **lister_data}
-            prediction_data.append(combined_data)
-
-        df_to_predict = pd.DataFrame(prediction_data)
-
-        for col in REQUIRED_COLS_ORDER:
-            if col not in df_to_predict.columns:
-                 df_to_predict[col] = 0
-
-        df_to_predict = df_to_predict[REQUIRED_COLS_ORDER]
-
+        listers = list(listers)
         try:
-            df_to_predict.fillna(0, inplace=True) 
-            scores = self.pipeline.predict(df_to_predict)
+            scores = get_scores(seeker, listers, city=target_city)
         except Exception as e:
             return Response({"error": f"Prediction error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         results = []
-        for i, lister in enumerate(listers):
-            score = round(scores[i])
+        for lister in listers:
+            if lister.id not in scores:
+                continue
+            score = round(scores[lister.id])
             listing = lister.listing_set.filter(is_active=True).first()
             if score > 50 and listing:
                 results.append({
@@ -216,4 +187,4 @@ class FavoriteListingsView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return self.request.user.favorites.all()
\ No newline at end of file
+        return self.request.user.favorites.select_related('lister')
\ No newline at end of file